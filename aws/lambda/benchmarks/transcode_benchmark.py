@@ -0,0 +1,119 @@
+"""
+Transcode benchmark for up-s3-staged-to-compressed.
+
+Generates synthetic clips locally (ffmpeg testsrc2 + sine) for each duration and
+resolution, runs the Lambda's own compress_video over a preset × CRF × thread-count
+matrix and reports encode fps, real-time factor, output bytes and peak RSS — the
+same fields the Lambda logs as `encode_stats`.
+
+Needs ffmpeg/ffprobe on PATH (or FFMPEG_BIN/FFPROBE_BIN) and boto3 importable; no
+AWS calls are made. Example:
+
+  python aws/lambda/benchmarks/transcode_benchmark.py \\
+      --durations 10,30 --resolutions 1280x720,1920x1080 \\
+      --presets veryfast,fast,medium --crfs 23,25,28 --threads 0,2 --json results.json
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_PATH = os.path.join(LAMBDA_DIR, 'up-s3-staged-to-compressed.py')
+REPORT_COLUMNS = [
+    'resolution', 'durationSeconds', 'preset', 'crf', 'threads',
+    'encodeFps', 'realTimeFactor', 'outputBytes', 'peakRssKb', 'cpuSeconds',
+]
+
+
+def load_compression_module():
+    os.environ.setdefault('FFMPEG_BIN', shutil.which('ffmpeg') or 'ffmpeg')
+    os.environ.setdefault('FFPROBE_BIN', shutil.which('ffprobe') or 'ffprobe')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')  # clients are built at import time
+    sys.path.insert(0, os.path.join(LAMBDA_DIR, 'layers', 'common'))
+    spec = importlib.util.spec_from_file_location('staged_to_compressed', LAMBDA_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Measure the preset as given rather than the Lambda's large-input 'fast' override
+    module.FAST_PRESET_PIXEL_SECONDS = float('inf')
+    return module
+
+
+def generate_clip(ffmpeg_bin, clip_dir, resolution, duration, fps):
+    """
+    Synthetic source clip, cached per shape. MPEG-4 Part 2 at high quality so the
+    Lambda always re-encodes rather than remuxing it.
+    """
+    path = os.path.join(clip_dir, f"testsrc_{resolution}_{duration}s_{fps}fps.mp4")
+    if not os.path.exists(path):
+        subprocess.run([
+            ffmpeg_bin, "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={fps}:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            "-c:v", "mpeg4", "-q:v", "2", "-c:a", "aac", "-b:a", "256k", "-shortest", path,
+        ], check=True)
+    return path
+
+
+def run_matrix(module, args):
+    clip_dir = args.clip_dir or tempfile.mkdtemp(prefix='up-bench-clips-')
+    os.makedirs(clip_dir, exist_ok=True)
+    out_dir = tempfile.mkdtemp(prefix='up-bench-out-')
+    results = []
+    try:
+        for resolution, duration in itertools.product(args.resolutions, args.durations):
+            source = generate_clip(module.FFMPEG_BIN, clip_dir, resolution, duration, args.fps)
+            probe = module.probe_video(source)
+            for preset, crf, threads in itertools.product(args.presets, args.crfs, args.threads):
+                module.ENCODE_PRESET, module.ENCODE_CRF, module.ENCODE_THREADS = preset, crf, threads
+                output = os.path.join(out_dir, 'out.mp4')
+                stats = module.compress_video(source, output, probe)
+                os.remove(output)
+                row = {'resolution': resolution, **stats}
+                results.append(row)
+                print_row(row)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if not args.clip_dir:
+            shutil.rmtree(clip_dir, ignore_errors=True)
+    return results
+
+
+def print_row(row):
+    print("  ".join(f"{str(row.get(column)):>{max(len(column), 9)}}" for column in REPORT_COLUMNS), flush=True)
+
+
+def csv_list(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=csv_list(int), default=[10, 30], help='clip lengths in seconds')
+    parser.add_argument('--resolutions', type=csv_list(str), default=['1280x720', '1920x1080'])
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--presets', type=csv_list(str), default=['veryfast', 'fast', 'medium'])
+    parser.add_argument('--crfs', type=csv_list(str), default=['23', '25', '28'])
+    parser.add_argument('--threads', type=csv_list(int), default=[0], help='0 = ffmpeg auto')
+    parser.add_argument('--clip-dir', help='keep generated clips here between runs')
+    parser.add_argument('--json', help='write all results to this file')
+    args = parser.parse_args()
+
+    module = load_compression_module()
+    print("  ".join(f"{column:>{max(len(column), 9)}}" for column in REPORT_COLUMNS))
+    results = run_matrix(module, args)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.json}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,20 @@
 Attestation verification layer for Up Lambda functions (iOS App Attest + session JWT).
 
 Env vars: JWT_SECRET, NONCE_TABLE, ATTESTED_KEYS_TABLE, APPLE_TEAM_ID,
-          APPLE_BUNDLE_ID, BYPASS_ATTESTATION
+          APPLE_BUNDLE_ID, BYPASS_ATTESTATION, NONCE_HMAC_SECRET
 Deps:     PyJWT, cbor2, cryptography (lazy-imported)
 """
 
+import base64
+import hashlib
+import hmac
 import json
 import os
+import secrets
 import time
+from collections import OrderedDict
 
-import boto3
+import aws_clients
 
 
 # ---------------------------------------------------------------------------
@@ -24,6 +29,18 @@ JWT_ALGORITHM = 'HS256'
 JWT_EXPIRY_SECONDS = 3600  # 1 hour
 
 NONCE_TABLE = os.environ.get('NONCE_TABLE', 'up-attestation-nonces')
+NONCE_TTL_SECONDS = 300  # 5 minutes, matches up-attestation-challenge
+
+# Stateless nonces ("v1.<issued_at>.<random>.<hmac>") are verified by HMAC without a
+# table read; replay is blocked by a conditional put of one small "consumed#<random>"
+# item per nonce into NONCE_TABLE (1 WCU, no read, no shared hot item), expired by
+# TTL. The secret defaults to a key derived from JWT_SECRET.
+STATELESS_NONCE_VERSION = 'v1'
+NONCE_CLOCK_SKEW_SECONDS = 30
+_nonce_hmac_secret = os.environ.get('NONCE_HMAC_SECRET', '').encode('utf-8') or (
+    hmac.new(JWT_SECRET.encode('utf-8'), b'up-attestation-nonce', hashlib.sha256).digest()
+    if JWT_SECRET else b''
+)
 ATTESTED_KEYS_TABLE = os.environ.get('ATTESTED_KEYS_TABLE', 'up-attested-keys')
 
 APPLE_TEAM_ID = os.environ.get('APPLE_TEAM_ID', '')
@@ -52,7 +69,24 @@ oyFraWVIyd/dganmrduC1bmTBGwD
 -----END CERTIFICATE-----
 """
 
-dynamodb = boto3.resource('dynamodb')
+# Per-container certificate caches: the pinned root is parsed once, and intermediates
+# whose chain to the root has been verified are remembered (by SHA-256 fingerprint)
+# until they expire, so a warm attestation only verifies the leaf.
+MAX_CACHED_INTERMEDIATES = 16
+_apple_root_cert = None
+_verified_intermediates = {}  # fingerprint -> not_valid_after_utc
+
+# LRU of key_id -> loaded EC public key, so warm assertions skip the key read and PEM
+# parsing. Revocation still applies: the counter write requires the key item to exist.
+PUBLIC_KEY_CACHE_SIZE = int(os.environ.get('PUBLIC_KEY_CACHE_SIZE', '1024'))
+_public_key_cache = OrderedDict()
+
+# Already-verified session tokens: SHA-256(token) -> (exp, claims). Clients reuse one
+# token for up to JWT_EXPIRY_SECONDS, so warm requests skip HS256 verification.
+SESSION_TOKEN_CACHE_SIZE = int(os.environ.get('SESSION_TOKEN_CACHE_SIZE', '1024'))
+_verified_token_cache = {}
+
+dynamodb = aws_clients.resource('dynamodb')
 nonce_table = dynamodb.Table(NONCE_TABLE)
 attested_keys_table = dynamodb.Table(ATTESTED_KEYS_TABLE)
 
@@ -62,7 +96,11 @@ attested_keys_table = dynamodb.Table(ATTESTED_KEYS_TABLE)
 # ---------------------------------------------------------------------------
 
 def verify_request(event):
-    """Returns {'device_id': ...} and optionally {'session_token': ...}. Raises PermissionError."""
+    """
+    Returns {'device_id', 'platform'}, plus 'user_id' when the device's user binding
+    is known (signed into the session JWT) and 'session_token' when a new token was
+    issued. Pass the result to enforce_user_binding. Raises PermissionError.
+    """
     if BYPASS_ATTESTATION:
         return {}
 
@@ -79,7 +117,11 @@ def verify_request(event):
     if auth_header.startswith('Bearer '):
         token = auth_header[7:]
         claims = _verify_session_jwt(token)
-        return {'device_id': claims.get('device_id')}
+        return {
+            'device_id': claims.get('device_id'),
+            'platform': claims.get('platform'),
+            'user_id': claims.get('user_id'),
+        }
 
     attestation_raw = headers.get('x-attestation-token', '')
     if not attestation_raw:
@@ -99,24 +141,89 @@ def verify_request(event):
 
     _consume_nonce(nonce)
 
+    bound_user_id = None
     if attestation_type == 'assertion':
-        device_id = _verify_apple_assertion(attestation, nonce)
+        device_id, bound_user_id = _verify_apple_assertion(attestation, nonce)
     else:
         device_id = _verify_apple_attestation(attestation, nonce)
 
-    session_token = _issue_session_jwt(device_id, platform)
-    return {'session_token': session_token, 'device_id': device_id}
+    session_token = _issue_session_jwt(device_id, platform, bound_user_id)
+    return {
+        'session_token': session_token,
+        'device_id': device_id,
+        'platform': platform,
+        'user_id': bound_user_id,
+    }
+
+
+def prime():
+    """
+    Warm-up hook: import the lazily-imported deps, parse the pinned root CA and
+    open a pooled connection to the attested keys table.
+    """
+    import jwt  # noqa: F401
+    import cbor2  # noqa: F401
+    from cryptography.hazmat.primitives import serialization  # noqa: F401
+    from cryptography.hazmat.primitives.asymmetric import ec  # noqa: F401
+
+    _get_apple_root_cert()
+    attested_keys_table.get_item(Key={'key_id': '__warmup__'}, ProjectionExpression='key_id')
 
 
 # ---------------------------------------------------------------------------
 # Nonce management
 # ---------------------------------------------------------------------------
 
+def issue_nonce():
+    """A stateless, HMAC-signed challenge nonce valid for NONCE_TTL_SECONDS."""
+    if not _nonce_hmac_secret:
+        raise RuntimeError("JWT_SECRET or NONCE_HMAC_SECRET must be set to issue stateless nonces")
+    body = f"{STATELESS_NONCE_VERSION}.{int(time.time())}.{secrets.token_urlsafe(16)}"
+    return f"{body}.{_nonce_mac(body)}"
+
+
+def _nonce_mac(body):
+    mac = hmac.new(_nonce_hmac_secret, body.encode('utf-8'), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(mac).rstrip(b'=').decode('ascii')
+
+
+def _consume_stateless_nonce(nonce):
+    """Check the HMAC and age, then mark the nonce consumed with its own item."""
+    try:
+        version, issued_at, random_part, mac = nonce.split('.')
+        issued_at = int(issued_at)
+    except ValueError:
+        raise PermissionError("Malformed nonce")
+
+    body = f"{version}.{issued_at}.{random_part}"
+    if not _nonce_hmac_secret or not hmac.compare_digest(mac, _nonce_mac(body)):
+        raise PermissionError("Invalid, expired, or already-used nonce")
+    now = int(time.time())
+    if not issued_at - NONCE_CLOCK_SKEW_SECONDS <= now <= issued_at + NONCE_TTL_SECONDS:
+        raise PermissionError("Invalid, expired, or already-used nonce")
+
+    try:
+        nonce_table.put_item(
+            Item={
+                'nonce': f"consumed#{random_part}",
+                # Kept until the nonce itself can no longer pass the age check
+                'ttl': issued_at + NONCE_TTL_SECONDS + NONCE_CLOCK_SKEW_SECONDS,
+            },
+            ConditionExpression='attribute_not_exists(nonce)',
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        raise PermissionError("Invalid, expired, or already-used nonce")
+
+
 def _consume_nonce(nonce):
     """Atomically consume a nonce (replay prevention)."""
     if not nonce:
         raise PermissionError("Missing nonce")
 
+    if nonce.startswith(f"{STATELESS_NONCE_VERSION}."):
+        _consume_stateless_nonce(nonce)
+        return
+
     try:
         nonce_table.update_item(
             Key={'nonce': nonce},
@@ -141,7 +248,8 @@ def _consume_nonce(nonce):
 # Session JWT
 # ---------------------------------------------------------------------------
 
-def _issue_session_jwt(device_id, platform):
+def _issue_session_jwt(device_id, platform, user_id=None):
+    """The user_id claim records an established (permanent) device → user binding."""
     import jwt as _jwt
     now = int(time.time())
     payload = {
@@ -150,37 +258,77 @@ def _issue_session_jwt(device_id, platform):
         'iat': now,
         'exp': now + JWT_EXPIRY_SECONDS,
     }
+    if user_id:
+        payload['user_id'] = user_id
     return _jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 
 def _verify_session_jwt(token):
+    """Decoded claims of a valid session token, served from the verified-token cache when warm."""
+    digest = hashlib.sha256(token.encode('utf-8')).digest()
+    cached = _verified_token_cache.get(digest)
+    if cached is not None:
+        exp, claims = cached
+        if time.time() < exp:
+            return claims
+        del _verified_token_cache[digest]
+        raise PermissionError("Session expired. Re-attest to continue.")
+
     import jwt as _jwt
     try:
-        return _jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        claims = _jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except _jwt.ExpiredSignatureError:
         raise PermissionError("Session expired. Re-attest to continue.")
     except _jwt.InvalidTokenError as e:
         raise PermissionError(f"Invalid session token: {e}")
 
+    if claims.get('exp'):
+        _cache_verified_token(digest, claims)
+    return claims
+
+
+def _cache_verified_token(digest, claims):
+    if len(_verified_token_cache) >= SESSION_TOKEN_CACHE_SIZE:
+        now = time.time()
+        for key in [key for key, (exp, _) in _verified_token_cache.items() if exp <= now]:
+            del _verified_token_cache[key]
+        while len(_verified_token_cache) >= SESSION_TOKEN_CACHE_SIZE:
+            del _verified_token_cache[next(iter(_verified_token_cache))]  # oldest first
+    _verified_token_cache[digest] = (claims['exp'], claims)
+
 
 # ---------------------------------------------------------------------------
 # Apple certificate chain verification
 # ---------------------------------------------------------------------------
 
+def _get_apple_root_cert():
+    """The pinned root CA, parsed once per container."""
+    global _apple_root_cert
+    if _apple_root_cert is None:
+        from cryptography import x509 as _x509
+        root_cert = _x509.load_pem_x509_certificate(APPLE_APP_ATTEST_ROOT_CA_PEM)
+        # Trust anchor sanity check
+        if root_cert.issuer != root_cert.subject:
+            raise PermissionError("Pinned root CA is not self-signed")
+        _apple_root_cert = root_cert
+    return _apple_root_cert
+
+
 def _verify_certificate_chain(x5c):
     """
     Verify that the x5c certificate chain (DER-encoded certs) chains back to
-    Apple's pinned App Attestation Root CA.
+    Apple's pinned App Attestation Root CA. Returns the parsed leaf certificate.
 
     x5c[0] = leaf (credCert), x5c[1] = intermediate, ... , root is pinned.
-    Raises PermissionError if the chain is invalid.
+    Verification stops at the first intermediate already verified by this
+    container. Raises PermissionError if the chain is invalid.
     """
     from cryptography import x509 as _x509
     from cryptography.hazmat.primitives.asymmetric import ec
     from cryptography.hazmat.primitives import hashes
     import datetime
 
-    root_cert = _x509.load_pem_x509_certificate(APPLE_APP_ATTEST_ROOT_CA_PEM)
+    root_cert = _get_apple_root_cert()
 
     chain_certs = []
     for der_bytes in x5c:
@@ -194,10 +342,20 @@ def _verify_certificate_chain(x5c):
     chain_certs.append(root_cert)
 
     now = datetime.datetime.now(datetime.timezone.utc)
+    intermediate_fingerprints = {}
+    chain_expiry = root_cert.not_valid_after_utc
     for i in range(len(chain_certs) - 1):
         child = chain_certs[i]
         parent = chain_certs[i + 1]
 
+        if i > 0:
+            fingerprint = child.fingerprint(hashes.SHA256())
+            cached_expiry = _verified_intermediates.get(fingerprint)
+            if cached_expiry is not None and now <= cached_expiry:
+                chain_expiry = cached_expiry
+                break  # this cert's chain up to the root is already verified
+            intermediate_fingerprints[fingerprint] = child.not_valid_after_utc
+
         # 1. Check the child's issuer matches the parent's subject
         if child.issuer != parent.subject:
             raise PermissionError(
@@ -226,9 +384,14 @@ def _verify_certificate_chain(x5c):
                 f"Certificate chain signature verification failed at cert[{i}]"
             )
 
-    # Verify the root cert is self-signed (trust anchor sanity check)
-    if root_cert.issuer != root_cert.subject:
-        raise PermissionError("Pinned root CA is not self-signed")
+    # Cache each newly verified intermediate until the first expiry on its path to the root
+    for fingerprint, not_valid_after in reversed(list(intermediate_fingerprints.items())):
+        chain_expiry = min(chain_expiry, not_valid_after)
+        if len(_verified_intermediates) >= MAX_CACHED_INTERMEDIATES:
+            _verified_intermediates.clear()  # Apple rotates intermediates rarely; just start over
+        _verified_intermediates[fingerprint] = chain_expiry
+
+    return chain_certs[0]
 
 
 def _hash_for_algorithm(sig_hash_algo):
@@ -256,8 +419,6 @@ def _verify_apple_attestation(attestation, nonce):
     if not token_b64 or not key_id:
         raise PermissionError("Missing Apple attestation token or key_id")
 
-    import base64
-    import hashlib
     import cbor2
     from cryptography import x509
     from cryptography.hazmat.primitives import serialization
@@ -279,9 +440,7 @@ def _verify_apple_attestation(attestation, nonce):
     if not x5c or len(x5c) < 2:
         raise PermissionError("Invalid certificate chain in attestation")
 
-    _verify_certificate_chain(x5c)
-
-    cred_cert = x509.load_der_x509_certificate(x5c[0])
+    cred_cert = _verify_certificate_chain(x5c)
 
     client_data_hash = hashlib.sha256(nonce.encode('utf-8')).digest()
     composite = hashlib.sha256(auth_data + client_data_hash).digest()  # SHA256(authData || clientDataHash)
@@ -303,7 +462,8 @@ def _verify_apple_attestation(attestation, nonce):
     if rp_id_hash != expected_rp_id_hash:
         raise PermissionError("App ID mismatch in Apple attestation")
 
-    public_key_pem = cred_cert.public_key().public_bytes(
+    public_key = cred_cert.public_key()
+    public_key_pem = public_key.public_bytes(
         serialization.Encoding.PEM,
         serialization.PublicFormat.SubjectPublicKeyInfo,
     ).decode('utf-8')
@@ -317,6 +477,7 @@ def _verify_apple_attestation(attestation, nonce):
             'assertion_counter': 0,
         }
     )
+    _cache_device_public_key(key_id, public_key)
 
     return f"ios:{key_id}"
 
@@ -326,24 +487,21 @@ def _verify_apple_attestation(attestation, nonce):
 # ---------------------------------------------------------------------------
 
 def _verify_apple_assertion(assertion, nonce):
-    """Verify a subsequent Apple assertion against the stored public key."""
+    """
+    Verify a subsequent Apple assertion against the stored public key. The key
+    comes from the LRU when warm; the anti-replay counter is advanced by a single
+    conditional write. Returns (device_id, bound_user_id or None).
+    """
     token_b64 = assertion.get('token', '')
     key_id = assertion.get('key_id', '')
 
     if not token_b64 or not key_id:
         raise PermissionError("Missing Apple assertion token or key_id")
 
-    import base64
-    import hashlib
     import cbor2
-    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives import hashes
     from cryptography.hazmat.primitives.asymmetric import ec
 
-    response = attested_keys_table.get_item(Key={'key_id': key_id})
-    stored_key = response.get('Item')
-    if not stored_key:
-        raise PermissionError("Unknown key_id. Device must re-attest.")
-
     try:
         token_bytes = base64.b64decode(token_b64)
         assertion_obj = cbor2.loads(token_bytes)
@@ -355,44 +513,87 @@ def _verify_apple_assertion(assertion, nonce):
 
     if not authenticator_data or not signature:
         raise PermissionError("Incomplete assertion data")
+    if len(authenticator_data) < 37:
+        raise PermissionError("authenticatorData too short")
 
-    # Anti-replay: counter must increment
-    if len(authenticator_data) >= 37:
-        counter = int.from_bytes(authenticator_data[33:37], byteorder='big')
-        stored_counter = int(stored_key.get('assertion_counter', 0))
-        if counter <= stored_counter:
-            raise PermissionError("Assertion counter did not increment (possible replay)")
+    public_key = _load_device_public_key(key_id)
 
-        attested_keys_table.update_item(
+    client_data_hash = hashlib.sha256(nonce.encode('utf-8')).digest()
+    composite_data = authenticator_data + client_data_hash
+
+    try:
+        public_key.verify(signature, composite_data, ec.ECDSA(hashes.SHA256()))
+    except Exception:
+        raise PermissionError("Invalid assertion signature")
+
+    # Anti-replay: counter must increment
+    counter = int.from_bytes(authenticator_data[33:37], byteorder='big')
+    try:
+        response = attested_keys_table.update_item(
             Key={'key_id': key_id},
             UpdateExpression='SET assertion_counter = :c',
+            ConditionExpression='attribute_exists(key_id) AND assertion_counter < :c',
             ExpressionAttributeValues={':c': counter},
+            ReturnValues='ALL_NEW',  # carries bound_user_id for the session JWT
         )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        _public_key_cache.pop(key_id, None)
+        raise PermissionError("Assertion counter did not increment (possible replay) or key_id unknown")
 
-    client_data_hash = hashlib.sha256(nonce.encode('utf-8')).digest()
-    composite_data = authenticator_data + client_data_hash
+    return f"ios:{key_id}", response.get('Attributes', {}).get('bound_user_id')
+
+
+def _load_device_public_key(key_id):
+    """Loaded EC public key for key_id, from the LRU or the attested keys table."""
+    public_key = _public_key_cache.get(key_id)
+    if public_key is not None:
+        _public_key_cache.move_to_end(key_id)
+        return public_key
 
-    public_key = serialization.load_pem_public_key(
-        stored_key['public_key_pem'].encode('utf-8')
+    from cryptography.hazmat.primitives import serialization
+
+    response = attested_keys_table.get_item(
+        Key={'key_id': key_id},
+        ProjectionExpression='public_key_pem',
     )
+    stored_key = response.get('Item')
+    if not stored_key:
+        raise PermissionError("Unknown key_id. Device must re-attest.")
 
-    try:
-        public_key.verify(signature, composite_data, ec.ECDSA(hashes.SHA256()))
-    except Exception:
-        raise PermissionError("Invalid assertion signature")
+    public_key = serialization.load_pem_public_key(stored_key['public_key_pem'].encode('utf-8'))
+    _cache_device_public_key(key_id, public_key)
+    return public_key
 
-    return f"ios:{key_id}"
+
+def _cache_device_public_key(key_id, public_key):
+    _public_key_cache[key_id] = public_key
+    _public_key_cache.move_to_end(key_id)
+    while len(_public_key_cache) > PUBLIC_KEY_CACHE_SIZE:
+        _public_key_cache.popitem(last=False)
 
 
 # ---------------------------------------------------------------------------
 # IDOR protection — device_id ↔ user_id binding
 # ---------------------------------------------------------------------------
 
-def enforce_user_binding(device_id, user_id):
-    """TOFU binding: device_id → user_id. Raises PermissionError on mismatch."""
+def enforce_user_binding(device_id, user_id, attestation_result=None):
+    """
+    TOFU binding: device_id → user_id. Raises PermissionError on mismatch.
+
+    With the verify_request result, a signed user_id claim settles the check
+    without DynamoDB. Otherwise the binding is looked up (or established) and a
+    session token carrying it is added to attestation_result['session_token'],
+    so the client's next requests skip the lookup.
+    """
     if not device_id or not user_id:
         return
 
+    claimed_user_id = (attestation_result or {}).get('user_id')
+    if claimed_user_id:
+        if claimed_user_id != user_id:
+            raise PermissionError("User ID mismatch: this device is bound to a different user")
+        return
+
     raw_key_id = device_id.split(':', 1)[-1] if ':' in device_id else device_id
 
     response = attested_keys_table.get_item(Key={'key_id': raw_key_id})
@@ -419,6 +620,12 @@ def enforce_user_binding(device_id, user_id):
     elif bound_user_id != user_id:
         raise PermissionError("User ID mismatch: this device is bound to a different user")
 
+    if attestation_result is not None and JWT_SECRET:
+        attestation_result['user_id'] = user_id
+        attestation_result['session_token'] = _issue_session_jwt(
+            device_id, attestation_result.get('platform') or 'ios', user_id
+        )
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -0,0 +1,163 @@
+"""
+Shared rate limiter for Up Lambda functions (per-container token bucket + batched counter sync).
+
+Counts live in up-rate-limits under "<subject>#<scope>#<window>" keys that expire
+one window after their own via DynamoDB TTL.
+
+Default mode: a local token bucket (capacity = limit, refilled over the window)
+plus the last known global count decide each request in memory. Both can only
+reject definitively — neither overestimates usage. Allowed requests are counted
+locally and added to DynamoDB in the background, one write per key per batch,
+which refreshes the global count other containers contributed. Global enforcement
+is therefore approximate (bounded by the unsynced counts of concurrent containers).
+
+Strict mode: one synchronous atomic increment per request, exact across containers.
+Use it for expensive scopes (uploads); RATE_LIMIT_STRICT only sets the default for
+limiters that don't pass strict= themselves.
+
+Env vars: RATE_LIMIT_TABLE, RATE_LIMIT_STRICT, RATE_LIMIT_SYNC_BATCH_SIZE,
+          RATE_LIMIT_SYNC_INTERVAL_SECONDS
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_clients
+
+
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE', 'up-rate-limits')
+RATE_LIMIT_STRICT = os.environ.get('RATE_LIMIT_STRICT', 'false').lower() == 'true'
+SYNC_BATCH_SIZE = int(os.environ.get('RATE_LIMIT_SYNC_BATCH_SIZE', '20'))
+SYNC_INTERVAL_SECONDS = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL_SECONDS', '5'))
+MAX_TRACKED_SUBJECTS = 10000  # per limiter; idle buckets are dropped beyond this
+
+logger = logging.getLogger(__name__)
+
+_table = None
+# One background worker per container; Lambda freezes it between invocations and
+# it resumes on the next one, so a batch is never lost, only delayed
+_sync_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def _rate_limit_table():
+    global _table
+    if _table is None:
+        _table = aws_clients.resource('dynamodb').Table(RATE_LIMIT_TABLE)
+    return _table
+
+
+def _increment(rate_key, window, window_seconds, amount):
+    """Atomically add amount to the window's counter; returns the new global count."""
+    response = _rate_limit_table().update_item(
+        Key={'rate_key': rate_key},
+        UpdateExpression='SET #count = if_not_exists(#count, :zero) + :n, #ttl = :ttl',
+        ExpressionAttributeNames={'#count': 'request_count', '#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':zero': 0,
+            ':n': amount,
+            ':ttl': (window + 2) * window_seconds,  # expire 1 window after current
+        },
+        ReturnValues='UPDATED_NEW',
+    )
+    return int(response['Attributes']['request_count'])
+
+
+class RateLimiter:
+    """At most `limit` requests per subject per `window_seconds`. check() raises PermissionError(message)."""
+
+    def __init__(self, scope, limit, window_seconds, message, strict=None):
+        self.scope = scope
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.message = message
+        self.strict = RATE_LIMIT_STRICT if strict is None else strict
+
+        self._lock = threading.Lock()
+        self._buckets = {}  # subject -> [tokens, last_refill_monotonic]
+        self._windows = {}  # rate_key -> {'window', 'pending', 'synced'}
+        self._pending_total = 0
+        self._last_sync = time.monotonic()
+        self._sync_scheduled = False
+
+    def check(self, subject):
+        window = int(time.time()) // self.window_seconds
+        rate_key = f"{subject}#{self.scope}#{window}"
+
+        if self.strict:
+            if _increment(rate_key, window, self.window_seconds, 1) > self.limit:
+                raise PermissionError(self.message)
+            return
+
+        with self._lock:
+            if not self._take_token(subject):
+                raise PermissionError(self.message)
+            state = self._windows.setdefault(rate_key, {'window': window, 'pending': 0, 'synced': 0})
+            # synced already includes every request this container has flushed
+            if state['synced'] + state['pending'] >= self.limit:
+                raise PermissionError(self.message)
+            state['pending'] += 1
+            self._pending_total += 1
+            sync_due = not self._sync_scheduled and (
+                self._pending_total >= SYNC_BATCH_SIZE
+                or time.monotonic() - self._last_sync >= SYNC_INTERVAL_SECONDS
+            )
+            if sync_due:
+                self._sync_scheduled = True
+
+        if sync_due:
+            _sync_executor.submit(self.sync)
+
+    def sync(self):
+        """Flush pending counts (one write per key) and refresh the known global counts."""
+        with self._lock:
+            batch = {key: (state['window'], state['pending']) for key, state in self._windows.items() if state['pending']}
+            for key in batch:
+                self._windows[key]['pending'] = 0
+            self._pending_total = 0
+
+        try:
+            for rate_key, (window, pending) in batch.items():
+                try:
+                    count = _increment(rate_key, window, self.window_seconds, pending)
+                except Exception as e:
+                    logger.error("Rate limit sync failed for %s: %s", rate_key, e)
+                    with self._lock:
+                        self._windows[rate_key]['pending'] += pending
+                        self._pending_total += pending
+                    continue
+                with self._lock:
+                    self._windows[rate_key]['synced'] = max(self._windows[rate_key]['synced'], count)
+        finally:
+            with self._lock:
+                current_window = int(time.time()) // self.window_seconds
+                for key in [k for k, s in self._windows.items() if s['window'] < current_window and not s['pending']]:
+                    del self._windows[key]
+                self._last_sync = time.monotonic()
+                self._sync_scheduled = False
+
+    def _take_token(self, subject):
+        now = time.monotonic()
+        bucket = self._buckets.get(subject)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_SUBJECTS:
+                self._drop_full_buckets(now)
+            bucket = self._buckets[subject] = [float(self.limit), now]
+
+        tokens, last_refill = bucket
+        tokens = min(float(self.limit), tokens + (now - last_refill) * self.limit / self.window_seconds)
+        if tokens < 1:
+            bucket[:] = [tokens, now]
+            return False
+        bucket[:] = [tokens - 1, now]
+        return True
+
+    def _drop_full_buckets(self, now):
+        """Forget subjects whose buckets have refilled — they'd start full anyway."""
+        refill_seconds = self.window_seconds
+        for subject in [s for s, (_, last) in self._buckets.items() if now - last >= refill_seconds]:
+            del self._buckets[subject]
+        if len(self._buckets) >= MAX_TRACKED_SUBJECTS:
+            self._buckets.clear()
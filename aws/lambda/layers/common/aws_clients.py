@@ -0,0 +1,85 @@
+"""
+Shared boto3 clients and resources for Up Lambda functions.
+
+Every handler and layer module gets its clients from here instead of calling
+boto3.client()/boto3.resource() with the default botocore config (10 pooled
+connections, legacy retries, 60 s timeouts). Clients are built on first use,
+once per process, from one shared session, so a container pays for credential
+resolution and endpoint loading once and thread fan-outs share the pool:
+
+  from aws_clients import client, resource
+  s3 = client('s3')
+  table = resource('dynamodb').Table('up-videometadata')
+
+Keyword overrides (e.g. read_timeout=300 for large transfers, region_name=...)
+build a separate cached client per distinct set of overrides.
+
+Env vars: AWS_MAX_POOL_CONNECTIONS, AWS_CONNECT_TIMEOUT_SECONDS,
+          AWS_READ_TIMEOUT_SECONDS, AWS_RETRY_MODE, AWS_MAX_ATTEMPTS,
+          AWS_TCP_KEEPALIVE
+Deps:     boto3/botocore (provided by the Lambda runtime). Ships in the common layer.
+"""
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+
+# Sized above the widest thread fan-out in any handler (feed lookups, multipart
+# uploads, fingerprint frame sampling) so workers never wait on a connection
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '2'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '10'))
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')  # 'adaptive' | 'standard' | 'legacy'
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '4'))
+TCP_KEEPALIVE = os.environ.get('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+
+CLIENT_OPTIONS = {'region_name', 'endpoint_url'}  # passed to the constructor, not Config
+
+_lock = threading.Lock()  # boto3 sessions are not safe to build clients from concurrently
+_session = None
+_clients = {}
+_resources = {}
+
+
+def default_config(**overrides):
+    """botocore Config with the shared pool, keepalive, retry and timeout settings."""
+    settings = {
+        'max_pool_connections': MAX_POOL_CONNECTIONS,
+        'connect_timeout': CONNECT_TIMEOUT_SECONDS,
+        'read_timeout': READ_TIMEOUT_SECONDS,
+        'retries': {'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+        'tcp_keepalive': TCP_KEEPALIVE,
+    }
+    settings.update(overrides)
+    return Config(**settings)
+
+
+def client(service_name, **overrides):
+    """Process-wide low-level client for service_name."""
+    return _get(_clients, 'client', service_name, overrides)
+
+
+def resource(service_name, **overrides):
+    """Process-wide resource for service_name (e.g. resource('dynamodb').Table(...))."""
+    return _get(_resources, 'resource', service_name, overrides)
+
+
+def _get(cache, kind, service_name, overrides):
+    cache_key = (service_name, tuple(sorted(overrides.items())))
+    built = cache.get(cache_key)
+    if built is not None:
+        return built
+
+    with _lock:
+        built = cache.get(cache_key)
+        if built is None:
+            global _session
+            if _session is None:
+                _session = boto3.session.Session()
+            options = {k: v for k, v in overrides.items() if k in CLIENT_OPTIONS}
+            config = default_config(**{k: v for k, v in overrides.items() if k not in CLIENT_OPTIONS})
+            built = cache[cache_key] = getattr(_session, kind)(service_name, config=config, **options)
+    return built
@@ -0,0 +1,174 @@
+"""
+Hashtag publishing shared by up-create-video-metadata and up-s3-staged-to-compressed.
+
+Each published video gets one up-hashtag row per hashtag, and every distinct
+hashtag is registered in up-hashtag-registry so feed generation can avoid full
+table scans. Videos created by upload sessions are reserved before their bytes
+exist; their metadata carries hashtagsDeferred and they are published by whichever
+status write first makes them playable, so abandoned sessions never leave hashtag
+rows behind:
+
+  update_item(..., SET attributes + playable_status_attributes(status), ReturnValues='ALL_OLD')
+  publish_deferred_hashtags(response.get('Attributes', {}), status)
+
+Deps: boto3 via aws_clients. Ships in the common layer.
+"""
+
+import logging
+import time
+from datetime import datetime
+
+import aws_clients
+
+
+HASHTAG_TABLE = 'up-hashtag'
+HASHTAG_REGISTRY_TABLE = 'up-hashtag-registry'
+PLAYABLE_STATUSES = {'PREVIEW_READY', 'READY'}  # must match up-generate-feed
+
+BATCH_WRITE_MAX_ITEMS = 25  # DynamoDB BatchWriteItem hard limit per request
+BATCH_WRITE_MAX_RETRIES = 5
+BATCH_WRITE_BASE_BACKOFF_SECONDS = 0.05
+
+logger = logging.getLogger(__name__)
+
+# Hashtags known to exist in up-hashtag-registry (seeded lazily, see load_known_hashtags)
+_known_hashtags = None
+
+
+def load_known_hashtags():
+    """
+    Return the container's set of hashtags already present in up-hashtag-registry.
+    Seeded from a registry scan on first use, then grown as this container
+    registers new hashtags. A failed seed scan degrades to an empty set, which
+    only costs redundant (idempotent) registry writes.
+    """
+    global _known_hashtags
+    if _known_hashtags is not None:
+        return _known_hashtags
+
+    registry_table = aws_clients.resource('dynamodb').Table(HASHTAG_REGISTRY_TABLE)
+    known = set()
+    try:
+        response = registry_table.scan(ProjectionExpression='hashtag')
+        known.update(item['hashtag'] for item in response.get('Items', []))
+        while 'LastEvaluatedKey' in response:
+            response = registry_table.scan(
+                ProjectionExpression='hashtag',
+                ExclusiveStartKey=response['LastEvaluatedKey']
+            )
+            known.update(item['hashtag'] for item in response.get('Items', []))
+    except Exception as e:
+        logger.error("Error seeding known hashtags from registry: %s", e)
+
+    _known_hashtags = known
+    return _known_hashtags
+
+
+def batch_write_items(request_items):
+    """
+    Write {table_name: [WriteRequest, ...]} with BatchWriteItem, chunked to the
+    25-item API limit. UnprocessedItems are retried with exponential backoff.
+    Returns whatever is still unprocessed after BATCH_WRITE_MAX_RETRIES.
+    """
+    dynamodb_client = aws_clients.resource('dynamodb').meta.client
+    pending = [
+        (table_name, write_request)
+        for table_name, write_requests in request_items.items()
+        for write_request in write_requests
+    ]
+    unprocessed = {}
+
+    for start in range(0, len(pending), BATCH_WRITE_MAX_ITEMS):
+        chunk = {}
+        for table_name, write_request in pending[start:start + BATCH_WRITE_MAX_ITEMS]:
+            chunk.setdefault(table_name, []).append(write_request)
+
+        for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+            response = dynamodb_client.batch_write_item(RequestItems=chunk)
+            chunk = response.get('UnprocessedItems') or {}
+            if not chunk:
+                break
+            if attempt < BATCH_WRITE_MAX_RETRIES:
+                time.sleep(BATCH_WRITE_BASE_BACKOFF_SECONDS * (2 ** attempt))
+
+        for table_name, write_requests in chunk.items():
+            unprocessed.setdefault(table_name, []).extend(write_requests)
+
+    return unprocessed
+
+
+def flatten_and_publish_hashtags(video_id, hashtags):
+    """
+    Flatten hashtags and publish each hashtag with the associated video info
+    to the up-hashtag table. Also registers each distinct hashtag in the
+    up-hashtag-registry table so feed generation can avoid full table scans.
+
+    All writes go out as one BatchWriteItem per 25 items (two for a maximum-size
+    upload); registry writes are skipped for hashtags this container already knows.
+    """
+    known_hashtags = load_known_hashtags()
+    timestamp = datetime.utcnow().isoformat()
+
+    hashtag_requests = []
+    registry_requests = []
+    new_hashtags = []
+    for hashtag in hashtags:
+        if not isinstance(hashtag, str) or not hashtag.strip():
+            logger.warning("Invalid hashtag type: %s. Skipping.", hashtag)
+            continue
+
+        hashtag_requests.append({'PutRequest': {'Item': {
+            "hashtag": hashtag,
+            "videoId": video_id,
+            "timestamp": timestamp,
+            "popularity": 0
+        }}})
+
+        # Register the hashtag in the registry (idempotent — same PK just overwrites)
+        if hashtag not in known_hashtags:
+            registry_requests.append({'PutRequest': {'Item': {"hashtag": hashtag}}})
+            new_hashtags.append(hashtag)
+
+    request_items = {}
+    if hashtag_requests:
+        request_items[HASHTAG_TABLE] = hashtag_requests
+    if registry_requests:
+        request_items[HASHTAG_REGISTRY_TABLE] = registry_requests
+    if not request_items:
+        return
+
+    try:
+        unprocessed = batch_write_items(request_items)
+    except Exception as e:
+        logger.error("Error publishing hashtags for video %s: %s", video_id, e)
+        return
+
+    for table_name, write_requests in unprocessed.items():
+        logger.error(
+            "Failed to write %d items to %s for video %s after retries",
+            len(write_requests), table_name, video_id
+        )
+
+    unregistered = {
+        request['PutRequest']['Item']['hashtag']
+        for request in unprocessed.get(HASHTAG_REGISTRY_TABLE, [])
+    }
+    known_hashtags.update(h for h in new_hashtags if h not in unregistered)
+
+
+def playable_status_attributes(status):
+    """
+    Extra attributes for a metadata status write: one that makes the video playable
+    also clears hashtagsDeferred, so exactly one writer sees it set (ALL_OLD).
+    """
+    return {'hashtagsDeferred': False} if status in PLAYABLE_STATUSES else {}
+
+
+def publish_deferred_hashtags(previous, status):
+    """
+    Publish a deferred upload's hashtags if this status write made it playable.
+    previous is the metadata item as it was before the write (its ALL_OLD return
+    value); the write must include playable_status_attributes(status).
+    """
+    if previous.get('hashtagsDeferred') and status in PLAYABLE_STATUSES:
+        flatten_and_publish_hashtags(previous['videoId'], previous.get('hashtags', []))
@@ -0,0 +1,90 @@
+"""
+Staging upload rules shared by every handler that hands out uploads
+(up-create-pre-signed-url and up-create-video-metadata's createUploadSession):
+accepted types and extensions, filename sanitizing, the staging key format and
+the presigned POST policy. up-s3-staged-to-compressed validates keys against
+VALID_KEY_PATTERN.
+
+  from uploads import new_upload_key, presigned_upload
+  key = new_upload_key(file_name, content_type)          # raises ValueError
+  response_body = presigned_upload(s3, key, content_type)
+
+Deps: none (callers pass their own S3 client). Ships in the common layer.
+"""
+
+import os
+import re
+import uuid
+
+
+STAGING_BUCKET = 'up-staging-content'
+ALLOWED_CONTENT_TYPES = {'video/mp4', 'video/quicktime', 'video/x-m4v', 'video/webm'}
+ALLOWED_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.webm'}
+MAX_UPLOAD_SIZE_BYTES = 500 * 1024 * 1024
+PRESIGNED_POST_EXPIRY_SECONDS = 300
+
+# Matches every key new_upload_key produces
+VALID_KEY_PATTERN = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}-[a-zA-Z0-9_-]{1,50}\.(mp4|mov|m4v|webm)$'
+)
+
+
+def sanitize_filename(filename):
+    """Strip path traversal, null bytes, and non-alphanumeric chars. Returns None if invalid."""
+    if not filename:
+        return None
+
+    filename = os.path.basename(filename)
+    filename = filename.replace('\x00', '')
+    filename = filename.strip('. \t\n\r')
+
+    if not filename:
+        return None
+
+    name, ext = os.path.splitext(filename)
+    ext = ext.lower()
+
+    if ext not in ALLOWED_EXTENSIONS:
+        return None
+
+    name = re.sub(r'[^a-zA-Z0-9_-]', '_', name)[:50]
+
+    return f"{name}{ext}" if name else None
+
+
+def validate_upload(file_name, content_type):
+    """Sanitized file name for an upload of content_type. Raises ValueError."""
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise ValueError(f"Invalid content type. Allowed: {sorted(ALLOWED_CONTENT_TYPES)}")
+    sanitized_name = sanitize_filename(file_name)
+    if not sanitized_name:
+        raise ValueError("Invalid filename. Must be a valid video file (.mp4, .mov, .m4v, .webm)")
+    return sanitized_name
+
+
+def new_upload_key(file_name, content_type):
+    """Fresh staging key '<uuid4>-<sanitized name>'. Raises ValueError."""
+    return f"{uuid.uuid4()}-{validate_upload(file_name, content_type)}"
+
+
+def presigned_upload(s3, file_key, content_type):
+    """
+    Presigned POST (not a presigned PUT URL, so S3 enforces the size limit) for
+    file_key in the staging bucket: {url, fields, key, maxSizeBytes}.
+    """
+    presigned_post = s3.generate_presigned_post(
+        Bucket=STAGING_BUCKET,
+        Key=file_key,
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            ['content-length-range', 1, MAX_UPLOAD_SIZE_BYTES],
+            {'Content-Type': content_type},
+        ],
+        ExpiresIn=PRESIGNED_POST_EXPIRY_SECONDS
+    )
+    return {
+        'url': presigned_post['url'],
+        'fields': presigned_post['fields'],
+        'key': file_key,
+        'maxSizeBytes': MAX_UPLOAD_SIZE_BYTES,
+    }
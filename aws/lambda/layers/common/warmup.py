@@ -0,0 +1,100 @@
+"""
+Warm-up / init hooks shared by Up Lambda functions.
+
+Each handler lists its primers — idempotent callables that import heavy modules,
+open pooled connections and fill module caches — and wires them up with:
+
+  prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)           at the end of the module
+  if is_warmup_event(event):
+      return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)   first thing in lambda_handler
+
+Primers run during init when the environment is pre-initialized (provisioned
+concurrency, SnapStart) or WARMUP_ON_INIT=true; otherwise a scheduled rule sending
+{"warmup": true} runs them. Each primer succeeds at most once per container.
+Init timing is logged as one `lambda_init` JSON line per container.
+
+Env vars: WARMUP_ON_INIT
+Deps:     none. Attach to every Up Lambda. Package with:
+  mkdir python && cp *.py python/ && zip -r common-layer.zip python/
+"""
+
+import json
+import logging
+import os
+import time
+
+
+WARMUP_EVENT_KEY = 'warmup'
+WARMUP_ON_INIT = os.environ.get('WARMUP_ON_INIT', 'false').lower() == 'true'
+PRE_INITIALIZATION_TYPES = {'provisioned-concurrency', 'snap-start'}
+WARMUP_PROBE_KEY = '__warmup__'  # key for connection-opening reads; never exists
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_primed = set()  # primers that already succeeded in this container
+
+
+def is_warmup_event(event):
+    return isinstance(event, dict) and event.get(WARMUP_EVENT_KEY) is True
+
+
+def run_primers(primers):
+    """Run primers not yet primed in this container; returns {name: ms}. Failures are logged, not raised."""
+    timings = {}
+    for primer in primers:
+        name = primer.__name__
+        if name in _primed:
+            continue
+        started = time.monotonic()
+        try:
+            primer()
+            _primed.add(name)
+        except Exception as e:
+            logger.warning("Warm-up primer %s failed: %s", name, e)
+        timings[name] = round((time.monotonic() - started) * 1000, 1)
+    return timings
+
+
+def prime_during_init(function_name, primers):
+    """Call at the end of module init: primes when pre-initialized and logs init timing."""
+    initialization_type = os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE', 'on-demand')
+    timings = {}
+    if WARMUP_ON_INIT or initialization_type in PRE_INITIALIZATION_TYPES:
+        timings = run_primers(primers)
+
+    process_age = _process_age_seconds()
+    logger.info("lambda_init %s", json.dumps({
+        'function': function_name,
+        'initializationType': initialization_type,
+        'initMs': round(process_age * 1000, 1) if process_age is not None else None,
+        'primerMs': timings,
+    }))
+
+
+def handle_warmup(function_name, primers):
+    """Response for a scheduled warm-up invocation."""
+    timings = run_primers(primers)
+    logger.info("lambda_warmup %s", json.dumps({'function': function_name, 'primerMs': timings}))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'warmed': True, 'primerMs': timings}),
+    }
+
+
+def prime_attestation():
+    """Import the attestation layer's lazily-imported crypto deps and warm its caches."""
+    from attestation_verifier import prime
+    prime()
+
+
+def _process_age_seconds():
+    """Seconds since the runtime process started (covers runtime bootstrap + module init)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
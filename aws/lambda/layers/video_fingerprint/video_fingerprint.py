@@ -0,0 +1,181 @@
+"""
+Perceptual video fingerprints for Up Lambda functions (near-duplicate detection).
+
+A fingerprint is a 64-bit pHash: each sampled frame (a FRAME_SIZE x FRAME_SIZE
+grayscale thumbnail) is reduced to the sign of its low-frequency DCT coefficients
+against their median, and the frame hashes are combined by per-bit majority vote.
+Re-encodes, rescales and light crops land within a few bits of each other.
+
+Lookups use multi-index hashing: the hash is split into BAND_COUNT bands of
+BAND_BITS, and any two hashes within Hamming radius < BAND_COUNT share at least one
+band exactly (pigeonhole). Each band value is a DynamoDB partition, so a lookup is
+BAND_COUNT queries plus a Hamming filter, independent of catalogue size.
+
+Env vars: FINGERPRINT_TABLE, NEAR_DUPLICATE_RADIUS
+Deps:     none (pure Python); needs the common layer (aws_clients). Package with:
+  mkdir python && cp video_fingerprint.py python/ && zip -r video-fingerprint-layer.zip python/
+"""
+
+import math
+import os
+
+import aws_clients
+from boto3.dynamodb.conditions import Key
+
+
+FINGERPRINT_TABLE = os.environ.get('FINGERPRINT_TABLE', 'up-video-fingerprints')
+NEAR_DUPLICATE_RADIUS = int(os.environ.get('NEAR_DUPLICATE_RADIUS', '3'))
+
+FRAME_SIZE = 32       # thumbnails fed to the DCT are FRAME_SIZE x FRAME_SIZE luma bytes
+DCT_SIZE = 8          # low-frequency DCT_SIZE x DCT_SIZE block → 64 hash bits
+HASH_BITS = DCT_SIZE * DCT_SIZE
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+BAND_MASK = (1 << BAND_BITS) - 1
+
+if NEAR_DUPLICATE_RADIUS >= BAND_COUNT:
+    raise RuntimeError(f"NEAR_DUPLICATE_RADIUS must be below {BAND_COUNT} for exact band lookups")
+
+# DCT-II basis for the first DCT_SIZE frequencies over FRAME_SIZE samples
+_DCT_BASIS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * FRAME_SIZE)) for x in range(FRAME_SIZE)]
+    for u in range(DCT_SIZE)
+]
+
+_table = None
+
+
+def _fingerprint_table():
+    global _table
+    if _table is None:
+        _table = aws_clients.resource('dynamodb').Table(FINGERPRINT_TABLE)
+    return _table
+
+
+# ---------------------------------------------------------------------------
+# Hashing
+# ---------------------------------------------------------------------------
+
+def frame_phash(pixels):
+    """64-bit pHash of one FRAME_SIZE x FRAME_SIZE grayscale frame (bytes, row-major)."""
+    if len(pixels) != FRAME_SIZE * FRAME_SIZE:
+        raise ValueError(f"Expected {FRAME_SIZE * FRAME_SIZE} pixels, got {len(pixels)}")
+
+    rows = [pixels[y * FRAME_SIZE:(y + 1) * FRAME_SIZE] for y in range(FRAME_SIZE)]
+    # Separable DCT, keeping only the low-frequency block: rows first, then columns
+    row_coeffs = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    coeffs = [
+        sum(_DCT_BASIS[v][y] * row_coeffs[y][u] for y in range(FRAME_SIZE))
+        for v in range(DCT_SIZE) for u in range(DCT_SIZE)
+    ]
+
+    # The DC term only encodes brightness, so it is left out of the median
+    median = sorted(coeffs[1:])[(HASH_BITS - 1) // 2]
+    phash = 0
+    for coeff in coeffs:
+        phash = (phash << 1) | (coeff > median)
+    return phash
+
+
+def video_phash(frames):
+    """Combine per-frame hashes into one video hash by per-bit majority vote."""
+    frame_hashes = [frame_phash(frame) for frame in frames]
+    if not frame_hashes:
+        raise ValueError("Cannot fingerprint a video with no sampled frames")
+
+    phash = 0
+    for bit in range(HASH_BITS):
+        ones = sum((h >> bit) & 1 for h in frame_hashes)
+        if ones * 2 > len(frame_hashes):
+            phash |= 1 << bit
+    return phash
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_hex(phash):
+    return f"{phash:0{HASH_BITS // 4}x}"
+
+
+def from_hex(value):
+    return int(value, 16)
+
+
+def band_keys(phash):
+    """One partition key per band, e.g. '2:9f3c'."""
+    return [
+        f"{band}:{(phash >> (band * BAND_BITS)) & BAND_MASK:0{BAND_BITS // 4}x}"
+        for band in range(BAND_COUNT)
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Persistent index (DynamoDB, partition key `band`, sort key `videoId`)
+# ---------------------------------------------------------------------------
+
+def register_fingerprint(video_id, phash, compressed_key, attributes=None):
+    """
+    Index a video under each of its bands so later uploads can find it. attributes
+    are the rendition's metadata attributes, returned to callers that reuse it.
+    """
+    with _fingerprint_table().batch_writer() as batch:
+        for band in band_keys(phash):
+            batch.put_item(Item={
+                'band': band,
+                'videoId': video_id,
+                'phash': to_hex(phash),
+                'compressedKey': compressed_key,
+                'attributes': attributes or {},
+            })
+
+
+def find_near_duplicates(phash, radius=NEAR_DUPLICATE_RADIUS):
+    """
+    Indexed videos within `radius` bits of phash, closest first, as
+    [{'videoId', 'compressedKey', 'attributes', 'distance'}].
+    """
+    table = _fingerprint_table()
+    matches = {}
+    for band in band_keys(phash):
+        query_kwargs = {'KeyConditionExpression': Key('band').eq(band)}
+        while True:
+            response = table.query(**query_kwargs)
+            for item in response.get('Items', []):
+                distance = hamming_distance(phash, from_hex(item['phash']))
+                if distance <= radius:
+                    matches[item['videoId']] = {
+                        'videoId': item['videoId'],
+                        'compressedKey': item['compressedKey'],
+                        'attributes': item.get('attributes', {}),
+                        'distance': distance,
+                    }
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return sorted(matches.values(), key=lambda m: m['distance'])
+
+
+# ---------------------------------------------------------------------------
+# In-memory index (e.g. collapsing near-duplicates within one feed)
+# ---------------------------------------------------------------------------
+
+class NearDuplicateIndex:
+    """Multi-index hash table over a working set; add() is O(BAND_COUNT) amortised."""
+
+    def __init__(self, radius=NEAR_DUPLICATE_RADIUS):
+        self.radius = radius
+        self._bands = {}  # band key -> list of hashes
+
+    def find(self, phash):
+        """Some indexed hash within radius of phash, or None."""
+        for band in band_keys(phash):
+            for candidate in self._bands.get(band, ()):
+                if hamming_distance(phash, candidate) <= self.radius:
+                    return candidate
+        return None
+
+    def add(self, phash):
+        for band in band_keys(phash):
+            self._bands.setdefault(band, []).append(phash)
@@ -0,0 +1,145 @@
+"""
+Shared fixtures for the Lambda handler tests.
+
+Handlers build their AWS clients through the common layer's aws_clients module at
+import time; the tests swap in an in-memory stand-in so handlers load without
+boto3 or credentials. FakeTable implements just the DynamoDB surface the handlers
+use (update_item / put_item / get_item with SET updates and simple conditions).
+"""
+
+import importlib.util
+import os
+import re
+import sys
+import types
+
+import pytest
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'layers', 'common'))
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeTable:
+    def __init__(self, name, key_names):
+        self.name = name
+        self.key_names = key_names
+        self.items = {}
+        self.after_update = None  # optional one-shot hook(), called after the next update_item
+        exceptions = types.SimpleNamespace(ConditionalCheckFailedException=ConditionalCheckFailedException)
+        self.meta = types.SimpleNamespace(client=types.SimpleNamespace(exceptions=exceptions))
+
+    def _key(self, key):
+        return tuple(key[name] for name in self.key_names)
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(self._key(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None):
+        key = self._key(Item)
+        existing = self.items.get(key, {})
+        if ConditionExpression and not _evaluate(ConditionExpression, existing,
+                                                 ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+            raise ConditionalCheckFailedException(ConditionExpression)
+        self.items[key] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, ReturnValues=None):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        key = self._key(Key)
+        previous = self.items.get(key)
+        item = dict(previous or {})
+        if ConditionExpression and not _evaluate(ConditionExpression, item, names, values):
+            raise ConditionalCheckFailedException(ConditionExpression)
+
+        if not UpdateExpression.startswith('SET '):
+            raise NotImplementedError(UpdateExpression)
+        item.update(Key)
+        for clause in UpdateExpression[len('SET '):].split(', '):
+            name, value = (part.strip() for part in clause.split('='))
+            item[names.get(name, name)] = values[value]
+        self.items[key] = item
+
+        if self.after_update:
+            hook, self.after_update = self.after_update, None
+            hook()
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': dict(item)}
+        if ReturnValues == 'ALL_OLD' and previous is not None:
+            return {'Attributes': dict(previous)}
+        return {}
+
+
+def _evaluate(expression, item, names, values):
+    """Evaluate attribute_exists / attribute_not_exists / comparisons joined by AND/OR."""
+    def resolve(name):
+        return names.get(name, name)
+
+    python = re.sub(r'attribute_not_exists\(([#\w]+)\)', lambda m: f"({resolve(m.group(1))!r} not in item)", expression)
+    python = re.sub(r'attribute_exists\(([#\w]+)\)', lambda m: f"({resolve(m.group(1))!r} in item)", python)
+    python = re.sub(r'([#\w]+) (<|<=|>|>=|=) (:\w+)',
+                    lambda m: f"(item.get({resolve(m.group(1))!r}) is not None and "
+                              f"item[{resolve(m.group(1))!r}] {'==' if m.group(2) == '=' else m.group(2)} "
+                              f"values[{m.group(3)!r}])",
+                    python)
+    python = python.replace(' AND ', ' and ').replace(' OR ', ' or ')
+    return eval(python, {}, {'item': item, 'values': values})
+
+
+class FakeResource:
+    KEY_NAMES = {
+        'up-videometadata': ('region', 'uploadedAt'),
+        'up-attestation-nonces': ('nonce',),
+        'up-upload-sessions': ('sessionKey',),
+    }
+
+    def __init__(self):
+        self.tables = {}
+        self.meta = types.SimpleNamespace(client=types.SimpleNamespace(
+            exceptions=types.SimpleNamespace(ConditionalCheckFailedException=ConditionalCheckFailedException)))
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.KEY_NAMES.get(name, ('videoId',)))
+        return self.tables[name]
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    """Install a fresh in-memory aws_clients module; returns the shared DynamoDB resource."""
+    dynamodb = FakeResource()
+    module = types.ModuleType('aws_clients')
+    module.resource = lambda service_name, **overrides: dynamodb
+    module.client = lambda service_name, **overrides: types.SimpleNamespace(
+        exceptions=types.SimpleNamespace(ClientError=Exception))
+    monkeypatch.setitem(sys.modules, 'aws_clients', module)
+    # Common-layer modules holding AWS state are re-imported against this test's clients
+    monkeypatch.delitem(sys.modules, 'hashtags', raising=False)
+    return dynamodb
+
+
+def _load_file(path):
+    name = os.path.basename(path)[:-len('.py')].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def load_lambda(fake_aws):
+    """Import a handler file (e.g. 'up-create-video-metadata.py') against the fake clients."""
+    return lambda filename: _load_file(os.path.join(LAMBDA_DIR, filename))
+
+
+@pytest.fixture
+def load_layer(fake_aws):
+    """Import a layer module (e.g. load_layer('attestation', 'attestation_verifier')) against the fake clients."""
+    return lambda layer, name: _load_file(os.path.join(LAMBDA_DIR, 'layers', layer, f'{name}.py'))
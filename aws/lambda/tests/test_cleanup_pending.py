@@ -0,0 +1,33 @@
+"""Orphan cleanup leaves upload sessions alone until they can no longer be in flight."""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip('botocore')
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def cleanup(load_lambda):
+    return load_lambda('up-cleanup-old-videos.py')
+
+
+def item(status):
+    return {'videoId': {'S': 'clip.mp4'}, 'compressionStatus': {'S': status}}
+
+
+def test_fresh_reservation_is_pending(cleanup):
+    assert cleanup.is_pending(item('PROCESSING'), NOW - timedelta(minutes=10), NOW)
+    assert cleanup.is_pending(item('PREVIEW_READY'), NOW - timedelta(minutes=10), NOW)
+
+
+def test_stale_reservation_is_reaped(cleanup):
+    uploaded_at = NOW - timedelta(seconds=cleanup.PENDING_GRACE_SECONDS + 1)
+    assert not cleanup.is_pending(item('PROCESSING'), uploaded_at, NOW)
+
+
+def test_finished_video_is_never_pending(cleanup):
+    assert not cleanup.is_pending(item('READY'), NOW, NOW)
+    assert not cleanup.is_pending({'videoId': {'S': 'clip.mp4'}}, NOW, NOW)
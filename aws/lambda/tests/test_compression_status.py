@@ -0,0 +1,136 @@
+"""Ordering of compressionStatus writes between metadata creation and compression."""
+
+import types
+
+import pytest
+
+VIDEO_ID = '0b7c3c9e-2f4d-4a57-9a43-1d2e3f4a5b6c-clip.mp4'
+REGION = 'us-east-2'
+UPLOADED_AT = '2026-10-19T12:00:00'
+METADATA_KEY = (REGION, UPLOADED_AT)
+
+
+@pytest.fixture
+def lambdas(load_lambda, fake_aws):
+    metadata = load_lambda('up-create-video-metadata.py')
+    compression = load_lambda('up-s3-staged-to-compressed.py')
+    return metadata, compression, fake_aws.Table('up-videometadata'), fake_aws.Table('up-video-compression-status')
+
+
+def save_processing_metadata(metadata):
+    metadata.save_metadata({
+        'videoId': VIDEO_ID,
+        'region': REGION,
+        'uploadedAt': UPLOADED_AT,
+        'compressionStatus': 'PROCESSING',
+        'statusRank': metadata.COMPRESSION_STATUS_RANKS['PROCESSING'],
+    })
+
+
+def test_late_reconcile_does_not_downgrade_ready(lambdas):
+    metadata, compression, metadata_table, status_table = lambdas
+    compression.update_compression_status(VIDEO_ID, 'PREVIEW_READY')
+    save_processing_metadata(metadata)
+
+    # Reconcile reads PREVIEW_READY from the status item; compression then finishes
+    # and writes READY to the metadata before reconcile's own metadata write lands
+    status_table.after_update = lambda: compression.update_compression_status(VIDEO_ID, 'READY')
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    assert metadata_table.items[METADATA_KEY]['compressionStatus'] == 'READY'
+
+
+def test_late_preview_does_not_downgrade_ready(lambdas):
+    metadata, compression, metadata_table, _ = lambdas
+    save_processing_metadata(metadata)
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    compression.update_compression_status(VIDEO_ID, 'READY')
+    compression.update_compression_status(VIDEO_ID, 'PREVIEW_READY')
+
+    assert metadata_table.items[METADATA_KEY]['compressionStatus'] == 'READY'
+
+
+def test_reconcile_applies_recorded_status(lambdas):
+    metadata, compression, metadata_table, _ = lambdas
+    compression.update_compression_status(VIDEO_ID, 'READY', {'compressedKey': VIDEO_ID})
+    save_processing_metadata(metadata)
+
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    item = metadata_table.items[METADATA_KEY]
+    assert item['compressionStatus'] == 'READY'
+    assert item['compressedKey'] == VIDEO_ID
+
+
+def test_ready_retry_replaces_failed(lambdas):
+    metadata, compression, metadata_table, _ = lambdas
+    save_processing_metadata(metadata)
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    compression.update_compression_status(VIDEO_ID, 'FAILED')
+    compression.update_compression_status(VIDEO_ID, 'READY')
+
+    assert metadata_table.items[METADATA_KEY]['compressionStatus'] == 'READY'
+
+
+def test_failed_does_not_overwrite_recorded_ready(lambdas):
+    metadata, compression, metadata_table, status_table = lambdas
+    compression.update_compression_status(VIDEO_ID, 'READY')
+    compression.update_compression_status(VIDEO_ID, 'FAILED')
+    assert status_table.items[(VIDEO_ID,)]['compressionStatus'] == 'READY'
+
+    # Two-call flow: the metadata key is registered afterwards
+    save_processing_metadata(metadata)
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    assert metadata_table.items[METADATA_KEY]['compressionStatus'] == 'READY'
+
+
+def test_cleanup_error_after_ready_is_not_marked_failed(lambdas, monkeypatch):
+    _, compression, _, status_table = lambdas
+
+    def delete_object(**kwargs):
+        raise OSError("throttled")
+
+    monkeypatch.setattr(compression, 'transcode_via_tmp', lambda *args: ({}, None))
+    monkeypatch.setattr(compression, 's3_client', types.SimpleNamespace(delete_object=delete_object))
+    record = {'s3': {'bucket': {'name': 'up-staging-content'}, 'object': {'key': VIDEO_ID, 'size': 1}}}
+
+    with pytest.raises(OSError):
+        compression.process_record(record)
+
+    assert status_table.items[(VIDEO_ID,)]['compressionStatus'] == 'READY'
+
+
+def test_pointer_registration_is_retried(lambdas, monkeypatch):
+    metadata, compression, metadata_table, status_table = lambdas
+    monkeypatch.setattr(metadata, 'STATUS_UPDATE_BASE_BACKOFF_SECONDS', 0)
+    compression.update_compression_status(VIDEO_ID, 'READY')
+    save_processing_metadata(metadata)
+    update_item = status_table.update_item
+    failures = iter([OSError("throttled")])
+
+    def flaky_update_item(**kwargs):
+        error = next(failures, None)
+        if error:
+            raise error
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(status_table, 'update_item', flaky_update_item)
+    metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
+
+    assert metadata_table.items[METADATA_KEY]['compressionStatus'] == 'READY'
+    assert status_table.items[(VIDEO_ID,)]['ttl'] > 0
+
+
+def test_pointer_registration_failure_is_raised(lambdas, monkeypatch):
+    metadata, _, _, status_table = lambdas
+    monkeypatch.setattr(metadata, 'STATUS_UPDATE_BASE_BACKOFF_SECONDS', 0)
+
+    def update_item(**kwargs):
+        raise OSError("throttled")
+
+    monkeypatch.setattr(status_table, 'update_item', update_item)
+    with pytest.raises(OSError):
+        metadata.reconcile_compression_status(VIDEO_ID, REGION, UPLOADED_AT)
@@ -0,0 +1,38 @@
+"""Compaction and storage of confidence maps must survive out-of-range scores."""
+
+from decimal import Decimal
+
+import pytest
+
+
+@pytest.fixture
+def feed(load_lambda):
+    pytest.importorskip('boto3')
+    return load_lambda('up-generate-feed.py')
+
+
+@pytest.fixture
+def profiles(load_lambda):
+    pytest.importorskip('botocore')
+    return load_lambda('up-update-user-profiles.py')
+
+
+def test_huge_scores_are_clamped_before_quantizing(feed):
+    compacted = feed.compact_confidence_scores({'huge': Decimal('1e30'), 'tiny': Decimal('-1e30'), 'ok': Decimal('2.5')})
+
+    assert compacted == {
+        'huge': feed.MAX_CONFIDENCE_SCORE.quantize(Decimal(feed.CONFIDENCE_QUANTUM)),
+        'tiny': (-feed.MAX_CONFIDENCE_SCORE).quantize(Decimal(feed.CONFIDENCE_QUANTUM)),
+        'ok': Decimal('2.500'),
+    }
+
+
+def test_stored_full_maps_are_clamped(profiles):
+    metadata = profiles.VideoFeedTypeMetadata(hashtag_to_confidence_scores={'huge': 1e30, 'ok': 2.5})
+
+    assert metadata.to_dynamodb()['huge'] == profiles.MAX_CONFIDENCE_SCORE.quantize(Decimal(profiles.CONFIDENCE_QUANTUM))
+
+
+def test_non_finite_scores_are_rejected(profiles):
+    with pytest.raises(ValueError):
+        profiles._to_decimal_scores({'bad': float('inf')})
@@ -0,0 +1,60 @@
+"""Content-hash dedupe hashes the source during the one download it already makes."""
+
+import hashlib
+
+import pytest
+
+SOURCE = b'staged video bytes' * 1000
+OBJECT_KEY = '0b7c3c9e-2f4d-4a57-9a43-1d2e3f4a5b6c-clip.mp4'
+
+
+class FakeBody:
+    def iter_chunks(self, chunk_size):
+        for offset in range(0, len(SOURCE), chunk_size):
+            yield SOURCE[offset:offset + chunk_size]
+
+
+class FakeS3:
+    def __init__(self):
+        self.get_object_calls = 0
+
+    def get_object(self, **kwargs):
+        self.get_object_calls += 1
+        return {'Body': FakeBody()}
+
+    def download_file(self, *args):
+        raise AssertionError("the source must be read only once")
+
+
+@pytest.fixture
+def compression(load_lambda, monkeypatch, tmp_path):
+    module = load_lambda('up-s3-staged-to-compressed.py')
+    monkeypatch.setattr(module, 's3_client', FakeS3())
+    monkeypatch.setattr(module, 'TEMP_DIR', str(tmp_path))
+    monkeypatch.setattr(module, 'HASH_READ_CHUNK_BYTES', 4096)
+    return module
+
+
+def test_duplicate_is_found_from_the_download_itself(compression, monkeypatch):
+    lookups = []
+
+    def find_duplicate_rendition(content_hash):
+        lookups.append(content_hash)
+        return {'compressedKey': 'existing.mp4', 'contentHash': content_hash}
+
+    monkeypatch.setattr(compression, 'find_duplicate_rendition', find_duplicate_rendition)
+
+    attributes, content_hash = compression.transcode_via_tmp('up-staging-content', OBJECT_KEY, content_dedupe=True)
+
+    assert content_hash == hashlib.sha256(SOURCE).hexdigest() == lookups[0]
+    assert attributes['compressedKey'] == 'existing.mp4'
+    assert compression.s3_client.get_object_calls == 1
+
+
+def test_downloaded_file_matches_source(compression, tmp_path):
+    path = tmp_path / 'download.mp4'
+
+    content_hash = compression.download_with_content_hash('up-staging-content', OBJECT_KEY, str(path))
+
+    assert path.read_bytes() == SOURCE
+    assert content_hash == hashlib.sha256(SOURCE).hexdigest()
@@ -0,0 +1,36 @@
+"""Encoder arguments for sources that need a re-encode."""
+
+import pytest
+
+
+@pytest.fixture
+def compression(load_lambda):
+    return load_lambda('up-s3-staged-to-compressed.py')
+
+
+def probe(width, height, **video):
+    return {
+        'video': {'codec_name': 'hevc', 'width': width, 'height': height, 'pix_fmt': 'yuv420p',
+                  'r_frame_rate': '30/1', **video},
+        'audio': None,
+        'format': {'duration': '10.0'},
+    }
+
+
+def scale_filter(args):
+    return args[args.index('-vf') + 1]
+
+
+def test_landscape_4k_is_capped_on_width(compression):
+    assert scale_filter(compression.video_encoder_args(probe(3840, 2160))) == 'scale=1920:-2'
+
+
+def test_rotated_portrait_4k_is_capped_on_height(compression):
+    # iPhone portrait: coded landscape, displayed portrait after ffmpeg autorotates
+    rotated = probe(3840, 2160, side_data_list=[{'side_data_type': 'Display Matrix', 'rotation': -90}])
+    assert scale_filter(compression.video_encoder_args(rotated)) == 'scale=-2:1920'
+
+
+def test_rotate_tag_is_honoured(compression):
+    rotated = probe(3840, 2160, tags={'rotate': '90'})
+    assert scale_filter(compression.video_encoder_args(rotated)) == 'scale=-2:1920'
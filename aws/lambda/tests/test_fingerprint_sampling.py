@@ -0,0 +1,32 @@
+"""Fingerprinting is optional: sampling failures must never fail the upload."""
+
+import subprocess
+
+
+def test_timed_out_and_missing_ffmpeg_frames_are_skipped(load_lambda, monkeypatch):
+    compression = load_lambda('up-s3-staged-to-compressed.py')
+    frame = bytes(compression.FINGERPRINT_FRAME_SIZE ** 2)
+    outcomes = iter([subprocess.TimeoutExpired('ffmpeg', 30), OSError('ffmpeg not found')])
+
+    def run(command, **kwargs):
+        outcome = next(outcomes, None)
+        if outcome is not None:
+            raise outcome
+        return subprocess.CompletedProcess(command, 0, stdout=frame, stderr=b'')
+
+    monkeypatch.setattr(compression, 'FINGERPRINT_FRAMES', 4)
+    monkeypatch.setattr(compression.subprocess, 'run', run)
+
+    assert compression.sample_fingerprint_frames('https://example.invalid/clip.mp4', 10.0) == [frame, frame]
+
+
+def test_fingerprint_errors_mean_no_fingerprint(load_lambda, monkeypatch):
+    compression = load_lambda('up-s3-staged-to-compressed.py')
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("presign failed")
+
+    monkeypatch.setattr(compression.s3_client, 'generate_presigned_url', fail, raising=False)
+
+    assert compression.compute_perceptual_hash('up-staging-content', 'clip.mp4') is None
+    assert compression.find_near_duplicate_rendition(None) is None
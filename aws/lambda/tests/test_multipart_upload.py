@@ -0,0 +1,136 @@
+"""Multipart presigning: per-part Content-Length, declared part count, completion checks."""
+
+import pytest
+
+BUCKET = 'up-staging-content'
+PART = 8 * 1024 * 1024
+
+
+class FakeS3:
+    def __init__(self):
+        self.presigned = []
+        self.parts = []
+        self.aborted = False
+        self.completed = False
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'upload-1'}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        self.presigned.append(Params)
+        return f"https://s3.example/{Params['PartNumber']}"
+
+    def get_paginator(self, operation):
+        parts = self.parts
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return [{'Parts': parts}]
+        return Paginator()
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+    def complete_multipart_upload(self, **kwargs):
+        self.completed = True
+
+
+@pytest.fixture
+def presign(load_lambda, monkeypatch):
+    monkeypatch.setenv('JWT_SECRET', 'test-jwt-secret')
+    monkeypatch.delenv('UPLOAD_TOKEN_SECRET', raising=False)
+    module = load_lambda('up-create-pre-signed-url.py')
+    monkeypatch.setattr(module, 's3', FakeS3())
+    return module
+
+
+def create(presign, file_size):
+    return presign.handle_multipart_action(BUCKET, 'multipartCreate', {
+        'fileName': 'clip.mp4', 'contentType': 'video/mp4', 'fileSize': str(file_size),
+    })
+
+
+def test_part_urls_sign_each_part_size(presign):
+    created = create(presign, 2 * PART + 100)
+
+    assert created['partCount'] == 3
+    assert [params['ContentLength'] for params in presign.s3.presigned] == [PART, PART, 100]
+
+
+def test_part_urls_are_capped_at_declared_part_count(presign):
+    created = create(presign, 2 * PART + 100)
+    params = {'key': created['key'], 'uploadId': created['uploadId'], 'uploadToken': created['uploadToken']}
+
+    urls = presign.handle_multipart_action(BUCKET, 'multipartPartUrls', {**params, 'startPart': '2'})
+    assert sorted(urls['partUrls']) == ['2', '3']
+    with pytest.raises(ValueError):
+        presign.handle_multipart_action(BUCKET, 'multipartPartUrls', {**params, 'startPart': '4'})
+
+
+def test_tampered_upload_token_is_rejected(presign):
+    created = create(presign, PART)
+    forged = f"{500 * 1024 * 1024}.{created['uploadToken'].split('.')[1]}"
+
+    with pytest.raises(ValueError):
+        presign.handle_multipart_action(BUCKET, 'multipartPartUrls', {
+            'key': created['key'], 'uploadId': created['uploadId'], 'uploadToken': forged, 'startPart': '1',
+        })
+
+
+def test_complete_aborts_when_sizes_do_not_match_declared(presign):
+    created = create(presign, PART + 100)
+    presign.s3.parts = [
+        {'PartNumber': 1, 'ETag': '"a"', 'Size': PART},
+        {'PartNumber': 2, 'ETag': '"b"', 'Size': PART},
+    ]
+
+    with pytest.raises(ValueError):
+        presign.handle_multipart_action(BUCKET, 'multipartComplete', {
+            'key': created['key'], 'uploadId': created['uploadId'], 'uploadToken': created['uploadToken'],
+        })
+    assert presign.s3.aborted and not presign.s3.completed
+
+
+def test_complete_with_missing_parts_keeps_upload(presign):
+    created = create(presign, PART + 100)
+    presign.s3.parts = [{'PartNumber': 1, 'ETag': '"a"', 'Size': PART}]
+
+    with pytest.raises(ValueError):
+        presign.handle_multipart_action(BUCKET, 'multipartComplete', {
+            'key': created['key'], 'uploadId': created['uploadId'], 'uploadToken': created['uploadToken'],
+        })
+    assert not presign.s3.aborted
+
+
+def test_complete_assembles_declared_parts(presign):
+    created = create(presign, PART + 100)
+    presign.s3.parts = [
+        {'PartNumber': 1, 'ETag': '"a"', 'Size': PART},
+        {'PartNumber': 2, 'ETag': '"b"', 'Size': 100},
+    ]
+
+    result = presign.handle_multipart_action(BUCKET, 'multipartComplete', {
+        'key': created['key'], 'uploadId': created['uploadId'], 'uploadToken': created['uploadToken'],
+    })
+    assert result['sizeBytes'] == PART + 100 and presign.s3.completed
+
+
+def test_upload_tokens_fail_closed_without_a_secret(load_lambda, monkeypatch):
+    monkeypatch.delenv('JWT_SECRET', raising=False)
+    monkeypatch.delenv('UPLOAD_TOKEN_SECRET', raising=False)
+    module = load_lambda('up-create-pre-signed-url.py')
+    monkeypatch.setattr(module, 's3', FakeS3())
+    monkeypatch.setattr(module.s3, 'create_multipart_upload', None)  # must not be reached
+
+    with pytest.raises(RuntimeError):
+        create(module, PART)
+    with pytest.raises(RuntimeError):
+        module._declared_file_size('key', 'upload-1', f"{PART}.{'0' * 32}")
+
+
+def test_signed_size_above_the_cap_is_rejected(presign):
+    file_size = presign.MAX_UPLOAD_SIZE_BYTES + 1
+    token = presign._upload_token('key', 'upload-1', file_size)
+
+    with pytest.raises(ValueError):
+        presign._declared_file_size('key', 'upload-1', token)
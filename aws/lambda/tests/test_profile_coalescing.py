@@ -0,0 +1,59 @@
+"""Coalesced profile updates: durable queueing and per-payload preferences."""
+
+import json
+import sys
+
+import pytest
+
+pytest.importorskip('botocore')
+
+
+@pytest.fixture
+def profiles(load_lambda):
+    return load_lambda('up-update-user-profiles.py')
+
+
+def test_latest_preferences_replace_earlier_ones(profiles):
+    earlier = profiles.UserProfile.from_payload({'user_id': 'u1', 'preferences': {'theme': 'dark', 'muted': True}})
+    later = profiles.UserProfile.from_payload({'user_id': 'u1', 'preferences': {'theme': 'light'}})
+
+    assert earlier.merged_with(later).preferences == {'theme': 'light'}
+
+
+def test_payload_without_preferences_keeps_earlier_ones(profiles):
+    earlier = profiles.UserProfile.from_payload({'user_id': 'u1', 'preferences': {'theme': 'dark'}})
+    later = profiles.UserProfile.from_payload({'user_id': 'u1', 'last_login': '2026-10-19T12:00:00'})
+
+    assert earlier.merged_with(later).preferences == {'theme': 'dark'}
+
+
+def test_coalesce_mode_without_queue_writes_directly(profiles, monkeypatch):
+    written = []
+    monkeypatch.setattr(profiles, 'PROFILE_WRITE_MODE', 'coalesce')
+    monkeypatch.setattr(profiles, 'sqs', None)
+    monkeypatch.setattr(profiles, 'update_user_profile', written.append)
+    monkeypatch.setitem(sys.modules, 'attestation_verifier', type('Verifier', (), {
+        'verify_request': staticmethod(lambda event: {'device_id': 'ios:device-1'}),
+        'enforce_user_binding': staticmethod(lambda device_id, user_id, result: None),
+    }))
+
+    response = profiles.lambda_handler({'body': json.dumps({'user_id': 'u1', 'preferences': {'theme': 'dark'}})}, None)
+
+    assert response['statusCode'] == 200
+    assert [profile.user_id for profile in written] == ['u1']
+
+
+def test_bad_message_fails_alone(profiles, monkeypatch):
+    written = []
+    monkeypatch.setattr(profiles, 'update_user_profile', written.append)
+    records = [
+        {'messageId': 'm1', 'eventSource': 'aws:sqs', 'body': json.dumps({'user_id': 'u1', 'preferences': {'theme': 'dark'}})},
+        {'messageId': 'm2', 'eventSource': 'aws:sqs', 'body': '{not json'},
+        {'messageId': 'm3', 'eventSource': 'aws:sqs', 'body': json.dumps({'preferences': {'theme': 'dark'}})},
+        {'messageId': 'm4', 'eventSource': 'aws:sqs', 'body': json.dumps({'user_id': 'u3', 'last_login': '2026-10-19T12:00:00'})},
+    ]
+
+    response = profiles.lambda_handler({'Records': records}, None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm2'}, {'itemIdentifier': 'm3'}]}
+    assert [profile.user_id for profile in written] == ['u1', 'u3']
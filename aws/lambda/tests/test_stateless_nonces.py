@@ -0,0 +1,38 @@
+"""Stateless challenge nonces are consumed with one small conditional put each."""
+
+import pytest
+
+
+@pytest.fixture
+def verifier(load_layer, monkeypatch):
+    monkeypatch.setenv('JWT_SECRET', 'test-secret')
+    return load_layer('attestation', 'attestation_verifier')
+
+
+def test_nonce_is_consumed_once_into_its_own_item(verifier):
+    nonce = verifier.issue_nonce()
+    _, issued_at, random_part, _ = nonce.split('.')
+
+    verifier._consume_nonce(nonce)
+
+    item = verifier.nonce_table.items[(f"consumed#{random_part}",)]
+    assert item['ttl'] == int(issued_at) + verifier.NONCE_TTL_SECONDS + verifier.NONCE_CLOCK_SKEW_SECONDS
+    with pytest.raises(PermissionError):
+        verifier._consume_nonce(nonce)
+
+
+def test_distinct_nonces_do_not_share_items(verifier):
+    for _ in range(3):
+        verifier._consume_nonce(verifier.issue_nonce())
+
+    assert len(verifier.nonce_table.items) == 3
+    assert all(len(item) == 2 for item in verifier.nonce_table.items.values())
+
+
+def test_forged_nonce_is_rejected_without_a_write(verifier):
+    nonce = verifier.issue_nonce()
+    forged = nonce[:-2] + ('AA' if not nonce.endswith('AA') else 'BB')
+
+    with pytest.raises(PermissionError):
+        verifier._consume_nonce(forged)
+    assert verifier.nonce_table.items == {}
@@ -0,0 +1,58 @@
+"""Streaming compression never leaves a multipart upload behind when ffmpeg can't run."""
+
+import types
+
+import pytest
+
+OBJECT_KEY = '0b7c3c9e-2f4d-4a57-9a43-1d2e3f4a5b6c-clip.mp4'
+
+
+class FakeS3:
+    def __init__(self, create_error=None):
+        self.create_error = create_error
+        self.created = []
+
+    def generate_presigned_url(self, *args, **kwargs):
+        return 'https://up-staging-content.s3.example/clip.mp4'
+
+    def create_multipart_upload(self, **kwargs):
+        if self.create_error:
+            raise self.create_error
+        self.created.append(kwargs['Key'])
+        return {'UploadId': 'upload-1'}
+
+
+@pytest.fixture
+def compression(load_lambda, monkeypatch):
+    module = load_lambda('up-s3-staged-to-compressed.py')
+    monkeypatch.setattr(module, 'probe_video', lambda source: {})
+    monkeypatch.setattr(module, 'transcode_args', lambda probe: ['-c', 'copy'])
+    monkeypatch.setattr(module, 'derived_outputs', lambda probe, work_dir: [])
+    return module
+
+
+def test_failed_spawn_starts_no_multipart_upload(compression, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(compression, 's3_client', s3)
+
+    def popen(*args, **kwargs):
+        raise FileNotFoundError("ffmpeg")
+
+    monkeypatch.setattr(compression.subprocess, 'Popen', popen)
+
+    with pytest.raises(FileNotFoundError):
+        compression.stream_compress_video('up-staging-content', OBJECT_KEY, 'up-compressed-content', OBJECT_KEY)
+
+    assert s3.created == []
+
+
+def test_failed_upload_start_stops_ffmpeg(compression, monkeypatch):
+    monkeypatch.setattr(compression, 's3_client', FakeS3(create_error=OSError("throttled")))
+    killed = []
+    monkeypatch.setattr(compression.subprocess, 'Popen',
+                        lambda *args, **kwargs: types.SimpleNamespace(kill=lambda: killed.append(True)))
+
+    with pytest.raises(OSError):
+        compression.stream_compress_video('up-staging-content', OBJECT_KEY, 'up-compressed-content', OBJECT_KEY)
+
+    assert killed == [True]
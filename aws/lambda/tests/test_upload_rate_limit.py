@@ -0,0 +1,23 @@
+"""The upload limiter must be exact across containers, whatever RATE_LIMIT_STRICT says."""
+
+import sys
+import types
+
+
+def test_upload_limiter_is_strict(load_lambda, monkeypatch):
+    created = []
+
+    class RecordingLimiter:
+        def __init__(self, scope, limit, window_seconds, message, strict=None):
+            created.append({'scope': scope, 'limit': limit, 'strict': strict})
+
+        def check(self, subject):
+            pass
+
+    monkeypatch.setitem(sys.modules, 'rate_limiter', types.SimpleNamespace(RateLimiter=RecordingLimiter))
+    metadata = load_lambda('up-create-video-metadata.py')
+
+    metadata.check_rate_limit('ios:device-1')
+    metadata.check_rate_limit('ios:device-2')
+
+    assert created == [{'scope': 'upload', 'limit': metadata.MAX_UPLOADS_PER_HOUR, 'strict': True}]
@@ -0,0 +1,143 @@
+"""createUploadSession retries with the same idempotencyKey reuse the reserved session."""
+
+import json
+import sys
+import types
+
+import pytest
+
+
+class FakeS3:
+    def generate_presigned_post(self, Bucket, Key, **kwargs):
+        return {'url': f'https://{Bucket}.s3.example', 'fields': {'key': Key}}
+
+
+@pytest.fixture
+def published(metadata, monkeypatch):
+    """(videoId, hashtags) for every hashtag publish."""
+    calls = []
+    monkeypatch.setattr(sys.modules['hashtags'], 'flatten_and_publish_hashtags',
+                        lambda video_id, hashtags: calls.append((video_id, hashtags)))
+    return calls
+
+
+@pytest.fixture
+def metadata(load_lambda, fake_aws, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'attestation_verifier', types.SimpleNamespace(
+        verify_request=lambda event: {'device_id': 'ios:device-1'},
+        enforce_user_binding=lambda device_id, user_id, result: None,
+    ))
+    module = load_lambda('up-create-video-metadata.py')
+    monkeypatch.setattr(module, 's3', FakeS3())
+    monkeypatch.setattr(module, 'check_rate_limit', lambda device_id: None)
+    return module
+
+
+def create_session(metadata, **overrides):
+    body = {
+        'action': 'createUploadSession',
+        'user_id': 'user-1',
+        'fileName': 'clip.mp4',
+        'contentType': 'video/mp4',
+        'description': 'A clip',
+        'hashtags': ['one', 'two', 'three'],
+        'region': 'us-east-2',
+        **overrides,
+    }
+    response = metadata.lambda_handler({'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_retry_reuses_the_reserved_session(metadata, fake_aws):
+    _, first = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    _, retry = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:05')
+
+    assert retry['videoId'] == first['videoId'] == retry['key']
+    assert len(fake_aws.Table('up-videometadata').items) == 1
+
+
+def test_distinct_keys_reserve_distinct_sessions(metadata, fake_aws):
+    _, first = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    _, second = create_session(metadata, idempotencyKey='retry-key-2', uploadedAt='2026-10-19T12:00:05')
+
+    assert first['videoId'] != second['videoId']
+    assert len(fake_aws.Table('up-videometadata').items) == 2
+
+
+def test_retry_after_failed_save_still_saves_metadata(metadata, fake_aws, monkeypatch):
+    reserve_metadata = metadata.reserve_metadata
+
+    def fail_once(item):
+        monkeypatch.setattr(metadata, 'reserve_metadata', reserve_metadata)
+        raise RuntimeError("throttled")
+
+    monkeypatch.setattr(metadata, 'reserve_metadata', fail_once)
+    status, _ = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    assert status == 500
+
+    _, retry = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:05')
+    assert [item['videoId'] for item in fake_aws.Table('up-videometadata').items.values()] == [retry['videoId']]
+
+
+def test_malformed_idempotency_key_is_rejected(metadata):
+    status, _ = create_session(metadata, idempotencyKey='../../x')
+    assert status == 400
+
+
+def test_session_key_uses_the_shared_staging_key_format(metadata):
+    from uploads import VALID_KEY_PATTERN
+
+    _, session = create_session(metadata, fileName='../My Clip!.MOV', contentType='video/quicktime')
+
+    assert VALID_KEY_PATTERN.match(session['key'])
+    assert session['key'].endswith('-My_Clip_.mov')
+
+
+def test_retry_after_failed_reconcile_registers_the_status_pointer(metadata, fake_aws, monkeypatch):
+    reconcile = metadata.reconcile_compression_status
+
+    def fail_once(*args):
+        monkeypatch.setattr(metadata, 'reconcile_compression_status', reconcile)
+        raise RuntimeError("throttled")
+
+    monkeypatch.setattr(metadata, 'reconcile_compression_status', fail_once)
+    status, _ = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    assert status == 500
+
+    _, retry = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:05')
+    pointer = fake_aws.Table('up-video-compression-status').items[(retry['videoId'],)]
+    assert (pointer['region'], pointer['uploadedAt']) == ('us-east-2', '2026-10-19T12:00:00')
+
+
+def test_retry_does_not_take_another_upload_slot(metadata, monkeypatch):
+    checks = []
+    monkeypatch.setattr(metadata, 'check_rate_limit', checks.append)
+
+    create_session(metadata, idempotencyKey='retry-key-1')
+    create_session(metadata, idempotencyKey='retry-key-1')
+
+    assert checks == ['ios:device-1']
+
+
+def test_hashtags_wait_until_the_video_is_playable(metadata, load_lambda, published):
+    _, session = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    create_session(metadata, idempotencyKey='retry-key-1')
+    assert published == []
+
+    compression = load_lambda('up-s3-staged-to-compressed.py')
+    compression.update_compression_status(session['videoId'], 'PREVIEW_READY')
+    compression.update_compression_status(session['videoId'], 'READY')
+
+    assert published == [(session['videoId'], ['one', 'two', 'three'])]
+
+
+def test_hashtags_of_a_recorded_ready_video_are_published_by_reconcile(metadata, load_lambda, fake_aws, published):
+    _, session = create_session(metadata, idempotencyKey='retry-key-1', uploadedAt='2026-10-19T12:00:00')
+    status_table = fake_aws.Table('up-video-compression-status')
+    status_table.items[(session['videoId'],)] = {
+        'videoId': session['videoId'], 'compressionStatus': 'READY', 'statusRank': 3,
+    }
+
+    create_session(metadata, idempotencyKey='retry-key-1')
+
+    assert published == [(session['videoId'], ['one', 'two', 'three'])]
@@ -4,20 +4,27 @@ import os
 import secrets
 import time
 
-import boto3
+import aws_clients
+from warmup import WARMUP_PROBE_KEY, handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = aws_clients.resource('dynamodb')
 nonce_table = dynamodb.Table(os.environ.get('NONCE_TABLE', 'up-attestation-nonces'))
-rate_limit_table = dynamodb.Table('up-rate-limits')
 
 NONCE_TTL_SECONDS = 300  # 5 minutes
 
+# Stateless mode issues HMAC-signed nonces from the attestation layer (no table
+# write here); the layer verifies them without a read and records each consumed
+# nonce as its own TTL'd item with one conditional put. Table-backed nonces stay
+# valid, so the switch can be flipped live.
+STATELESS_NONCES = os.environ.get('STATELESS_NONCES', 'false').lower() == 'true'
+
 # Rate limit: max challenge requests per IP per minute
 MAX_CHALLENGES_PER_MINUTE = 10
 RATE_LIMIT_WINDOW_SECONDS = 60
+_challenge_rate_limiter = None  # built on first use (rate_limiter lives in the attestation layer)
 
 
 def _get_source_ip(event):
@@ -30,27 +37,18 @@ def _get_source_ip(event):
 
 def _check_ip_rate_limit(source_ip):
     """
-    Enforce per-IP rate limiting on challenge generation.
-
-    Uses a minute-bucketed key so each window auto-expires via DynamoDB TTL.
-    Raises PermissionError if the IP has exceeded MAX_CHALLENGES_PER_MINUTE.
+    Enforce per-IP rate limiting on challenge generation via the shared limiter
+    in the attestation layer. Raises PermissionError if the IP has exceeded
+    MAX_CHALLENGES_PER_MINUTE.
     """
-    minute_bucket = int(time.time()) // RATE_LIMIT_WINDOW_SECONDS
-    rate_key = f"{source_ip}#challenge#{minute_bucket}"
-    ttl = (minute_bucket + 2) * RATE_LIMIT_WINDOW_SECONDS  # expire 1 window after current
-
-    response = rate_limit_table.update_item(
-        Key={'rate_key': rate_key},
-        UpdateExpression='SET #count = if_not_exists(#count, :zero) + :one, #ttl = :ttl',
-        ExpressionAttributeNames={'#count': 'request_count', '#ttl': 'ttl'},
-        ExpressionAttributeValues={':zero': 0, ':one': 1, ':ttl': ttl},
-        ReturnValues='UPDATED_NEW',
-    )
-    new_count = int(response['Attributes']['request_count'])
-    if new_count > MAX_CHALLENGES_PER_MINUTE:
-        raise PermissionError(
-            f"Rate limit exceeded: {MAX_CHALLENGES_PER_MINUTE} challenge requests per minute"
+    global _challenge_rate_limiter
+    if _challenge_rate_limiter is None:
+        from rate_limiter import RateLimiter
+        _challenge_rate_limiter = RateLimiter(
+            'challenge', MAX_CHALLENGES_PER_MINUTE, RATE_LIMIT_WINDOW_SECONDS,
+            f"Rate limit exceeded: {MAX_CHALLENGES_PER_MINUTE} challenge requests per minute",
         )
+    _challenge_rate_limiter.check(source_ip)
 
 
 def lambda_handler(event, context):
@@ -58,15 +56,20 @@ def lambda_handler(event, context):
     Generate a cryptographic nonce for app attestation challenge-response.
 
     The client calls this before performing device attestation. The returned
-    nonce is stored in DynamoDB with a 5-minute TTL and must be included in
-    the attestation token. The verification layer checks the nonce is valid,
-    unused, and not expired before accepting the attestation.
+    nonce is stored in DynamoDB with a 5-minute TTL (or, with STATELESS_NONCES,
+    signed instead of stored) and must be included in the attestation token.
+    The verification layer checks the nonce is valid, unused, and not expired
+    before accepting the attestation.
 
     IP-based rate limiting is enforced to prevent DynamoDB table flooding.
 
     Returns:
-        { "nonce": "<base64url-encoded 32-byte random value>" }
+        { "nonce": "<base64url-encoded 32-byte random value>" } or, stateless,
+        { "nonce": "v1.<issued_at>.<random>.<hmac>" }
     """
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
+
     try:
         # Enforce IP-based rate limit before writing to DynamoDB
         source_ip = _get_source_ip(event)
@@ -78,6 +81,14 @@ def lambda_handler(event, context):
             }
         _check_ip_rate_limit(source_ip)
 
+        if STATELESS_NONCES:
+            from attestation_verifier import issue_nonce
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'nonce': issue_nonce()}),
+            }
+
         nonce = secrets.token_urlsafe(32)  # 32 bytes of cryptographic randomness
         ttl = int(time.time()) + NONCE_TTL_SECONDS
 
@@ -110,3 +121,11 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': 'Failed to generate challenge'}),
         }
 
+
+def _prime_nonce_table():
+    nonce_table.get_item(Key={'nonce': WARMUP_PROBE_KEY}, ProjectionExpression='nonce')
+
+
+FUNCTION_NAME = 'up-attestation-challenge'
+WARMUP_PRIMERS = (prime_attestation, _prime_nonce_table)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
@@ -1,7 +1,16 @@
 import json
-import boto3
+import os
 from datetime import datetime, timedelta, timezone
 from botocore.exceptions import ClientError
+import aws_clients
+
+# Upload sessions write PROCESSING metadata before the upload starts, so a video still
+# in these states without a compressed object may simply not be transcoded yet. Only
+# reap it as an abandoned reservation once it outlives the presigned POST (up to
+# 5 min to start the upload) plus the longest possible transcode (the 15 min Lambda
+# cap, with margin for S3 event delivery and a retry).
+PENDING_STATUSES = {'PROCESSING', 'PREVIEW_READY'}
+PENDING_GRACE_SECONDS = int(os.environ.get('PENDING_GRACE_SECONDS', str(5 * 60 + 2 * 15 * 60 + 10 * 60)))
 
 def get_s3_video_files(s3_client, bucket):
     """Get all video files from S3"""
@@ -15,10 +24,45 @@ def get_s3_video_files(s3_client, bucket):
     
     return video_files
 
+def delete_s3_prefix(s3_client, bucket, prefix):
+    """Delete every object under prefix (HLS renditions, posters, sprites). Returns the count."""
+    deleted = 0
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket, Delete={'Objects': keys, 'Quiet': True})
+            deleted += len(keys)
+    return deleted
+
+def storage_key(item):
+    """S3 key holding the video: a deduplicated upload points at an existing rendition"""
+    return item.get('compressedKey', item['videoId'])['S']
+
+def is_pending(item, uploaded_at, now):
+    """True for uploads that may still be in flight: not yet transcoded and inside the grace period"""
+    status = item.get('compressionStatus', {}).get('S')
+    return status in PENDING_STATUSES and now - uploaded_at < timedelta(seconds=PENDING_GRACE_SECONDS)
+
+def get_live_storage_keys(dynamodb, table, cutoff_date_str):
+    """Storage keys still referenced by non-expired metadata, so shared renditions survive"""
+    live_keys = set()
+    paginator = dynamodb.get_paginator('scan')
+    for page in paginator.paginate(
+        TableName=table,
+        ProjectionExpression='videoId, compressedKey, uploadedAt',
+        FilterExpression='uploadedAt >= :cutoff',
+        ExpressionAttributeValues={':cutoff': {'S': cutoff_date_str}}
+    ):
+        for item in page['Items']:
+            live_keys.add(storage_key(item))
+    return live_keys
+
 def lambda_handler(event, context):
     """
     Lambda function to clean up old video metadata and their corresponding S3 files.
-    Also cleans up orphaned records (metadata without S3 files).
+    Also cleans up orphaned records (metadata without S3 files), including upload
+    sessions whose upload never arrived once they are past PENDING_GRACE_SECONDS.
     This function should be run as a cron job to prevent orphaned records.
     """
     
@@ -28,11 +72,12 @@ def lambda_handler(event, context):
     VIDEO_EXPIRY_DAYS = 90  # Delete videos older than 90 days
     
     # Initialize AWS clients
-    dynamodb = boto3.client('dynamodb', region_name='us-east-2')
-    s3 = boto3.client('s3', region_name='us-east-2')
+    dynamodb = aws_clients.client('dynamodb', region_name='us-east-2')
+    s3 = aws_clients.client('s3', region_name='us-east-2')
     
     # Calculate cutoff date (timezone-aware to match parsed upload timestamps)
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=VIDEO_EXPIRY_DAYS)
+    now = datetime.now(timezone.utc)
+    cutoff_date = now - timedelta(days=VIDEO_EXPIRY_DAYS)
     cutoff_date_str = cutoff_date.isoformat()
     
     print(f"Cleaning up videos older than {cutoff_date_str}")
@@ -41,6 +86,9 @@ def lambda_handler(event, context):
     s3_files = get_s3_video_files(s3, S3_BUCKET)
     print(f"Found {len(s3_files)} files in S3")
     
+    # Renditions shared with live videos via content-hash dedupe must not be deleted
+    live_storage_keys = get_live_storage_keys(dynamodb, DYNAMODB_TABLE, cutoff_date_str)
+    
     # Statistics
     stats = {
         'scanned': 0,
@@ -60,6 +108,7 @@ def lambda_handler(event, context):
                 stats['scanned'] += 1
                 
                 video_id = item['videoId']['S']
+                object_key = storage_key(item)
                 uploaded_at_str = item['uploadedAt']['S']
                 
                 # Parse upload date
@@ -74,7 +123,7 @@ def lambda_handler(event, context):
                 
                 # Check if video is expired OR orphaned (doesn't exist in S3)
                 is_expired = uploaded_at < cutoff_date
-                is_orphaned = video_id not in s3_files
+                is_orphaned = object_key not in s3_files and not is_pending(item, uploaded_at, now)
                 
                 if is_expired or is_orphaned:
                     if is_expired:
@@ -100,11 +149,17 @@ def lambda_handler(event, context):
                         print(f"✅ Deleted from DynamoDB: {video_id}")
                         
                         # Delete from S3 if it exists (only for expired videos, not orphaned)
-                        if is_expired:
+                        if is_expired and object_key in live_storage_keys:
+                            print(f"ℹ️  Keeping {object_key}: still referenced by a live video")
+                        elif is_expired:
                             try:
-                                s3.delete_object(Bucket=S3_BUCKET, Key=video_id)
+                                s3.delete_object(Bucket=S3_BUCKET, Key=object_key)
                                 stats['s3_deleted'] += 1
-                                print(f"✅ Deleted from S3: {video_id}")
+                                print(f"✅ Deleted from S3: {object_key}")
+                                for prefix in ("hls", "assets"):
+                                    derived_deleted = delete_s3_prefix(s3, S3_BUCKET, f"{prefix}/{object_key}/")
+                                    if derived_deleted:
+                                        print(f"✅ Deleted {derived_deleted} {prefix} files for: {object_key}")
                             except ClientError as e:
                                 if e.response['Error']['Code'] == 'NoSuchKey':
                                     print(f"ℹ️  S3 file not found (already deleted): {video_id}")
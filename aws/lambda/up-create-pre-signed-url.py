@@ -1,49 +1,190 @@
+import hashlib
+import hmac
 import json
 import logging
-import boto3
+import math
 import os
-import uuid
-import re
+import aws_clients
+from uploads import (
+    MAX_UPLOAD_SIZE_BYTES, STAGING_BUCKET, VALID_KEY_PATTERN, new_upload_key, presigned_upload,
+)
+from warmup import handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client('s3')
-
-ALLOWED_CONTENT_TYPES = {
-    'video/mp4',
-    'video/quicktime',
-    'video/x-m4v',
-    'video/webm',
-}
-
-ALLOWED_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.webm'}
-MAX_UPLOAD_SIZE_BYTES = 500 * 1024 * 1024
-
-def sanitize_filename(filename):
-    """Strip path traversal, null bytes, and non-alphanumeric chars. Returns None if invalid."""
-    if not filename:
-        return None
-
-    filename = os.path.basename(filename)
-    filename = filename.replace('\x00', '')
-    filename = filename.strip('. \t\n\r')
-
-    if not filename:
-        return None
-
-    name, ext = os.path.splitext(filename)
-    ext = ext.lower()
+s3 = aws_clients.client('s3')
+
+# Multipart mode (?action=...): the client uploads parts in parallel to presigned
+# UploadPart URLs, fetched in batches, and can resume by listing the parts S3
+# already has. Part URLs can't carry a content-length-range policy, so each one
+# signs the exact Content-Length of its part, derived from the fileSize declared at
+# multipartCreate. That size travels in an HMAC-signed uploadToken the client sends
+# back, so no upload can store more than it declared.
+MULTIPART_PART_SIZE_BYTES = 8 * 1024 * 1024  # S3 minimum is 5 MiB (except the last part)
+PART_URL_BATCH_SIZE = 20
+PART_URL_EXPIRY_SECONDS = 3600  # long enough to resume on a flaky connection
+MULTIPART_ACTIONS = {'multipartCreate', 'multipartPartUrls', 'multipartListParts', 'multipartComplete', 'multipartAbort'}
+
+# Defaults to a key derived from JWT_SECRET (set on every attested Lambda). With
+# neither set, multipart uploads fail closed rather than sign with an empty key.
+_jwt_secret = os.environ.get('JWT_SECRET', '')
+_upload_token_secret = os.environ.get('UPLOAD_TOKEN_SECRET', '').encode('utf-8') or (
+    hmac.new(_jwt_secret.encode('utf-8'), b'up-multipart-upload', hashlib.sha256).digest()
+    if _jwt_secret else b''
+)
+
+def build_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body),
+        'headers': {'Content-Type': 'application/json'}
+    }
+
+def _upload_token_key():
+    if not _upload_token_secret:
+        raise RuntimeError("JWT_SECRET or UPLOAD_TOKEN_SECRET must be set for multipart uploads")
+    return _upload_token_secret
+
+def _upload_token_signature(key, upload_id, file_size):
+    message = f"{key}\n{upload_id}\n{file_size}".encode('utf-8')
+    return hmac.new(_upload_token_key(), message, hashlib.sha256).hexdigest()[:32]
+
+def _upload_token(key, upload_id, file_size):
+    """'<fileSize>.<hmac>' binding the declared size to this key and upload."""
+    return f"{file_size}.{_upload_token_signature(key, upload_id, file_size)}"
+
+def _declared_file_size(key, upload_id, token):
+    """fileSize declared at multipartCreate, from the client's uploadToken."""
+    file_size, _, signature = (token or '').partition('.')
+    if not file_size.isdigit() or not hmac.compare_digest(
+        signature, _upload_token_signature(key, upload_id, int(file_size))
+    ):
+        raise ValueError('Missing or invalid uploadToken')
+    # Re-checked so the size cap never rests on the secret alone
+    if not 1 <= int(file_size) <= MAX_UPLOAD_SIZE_BYTES:
+        raise ValueError('Missing or invalid uploadToken')
+    return int(file_size)
+
+def _part_sizes(file_size):
+    """Expected size of each part, in part order, for a file of file_size bytes."""
+    part_count = math.ceil(file_size / MULTIPART_PART_SIZE_BYTES)
+    last_part_size = file_size - (part_count - 1) * MULTIPART_PART_SIZE_BYTES
+    return [MULTIPART_PART_SIZE_BYTES] * (part_count - 1) + [last_part_size]
+
+def _part_urls(bucket, key, upload_id, file_size, first_part, count):
+    """
+    Presigned UploadPart URLs for parts first_part .. first_part+count-1, capped at
+    the declared part count. Each URL signs its part's exact Content-Length.
+    """
+    part_sizes = _part_sizes(file_size)
+    last_part = min(first_part + count - 1, len(part_sizes))
+    return {
+        str(part_number): s3.generate_presigned_url(
+            'upload_part',
+            Params={
+                'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number,
+                'ContentLength': part_sizes[part_number - 1],
+            },
+            ExpiresIn=PART_URL_EXPIRY_SECONDS,
+        )
+        for part_number in range(first_part, last_part + 1)
+    }
+
+def _list_uploaded_parts(bucket, key, upload_id):
+    parts = []
+    paginator = s3.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        parts.extend(
+            {'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+            for part in page.get('Parts', [])
+        )
+    return parts
 
-    if ext not in ALLOWED_EXTENSIONS:
-        return None
+def _parse_int(value, name, minimum, maximum):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if not minimum <= number <= maximum:
+        raise ValueError(f"{name} must be between {minimum} and {maximum}")
+    return number
+
+def handle_multipart_action(bucket, action, query_params):
+    """
+    multipartCreate     fileName, contentType, fileSize → key, uploadId, uploadToken,
+                        partSize, partCount and the first batch of part URLs
+    multipartPartUrls   key, uploadId, uploadToken, startPart[, count] → another batch
+                        of part URLs
+    multipartListParts  key, uploadId → parts S3 already has (resume point)
+    multipartComplete   key, uploadId, uploadToken → assembles the listed parts; rejects
+                        gaps, and aborts the upload if the part sizes don't match fileSize
+    multipartAbort      key, uploadId → discards the upload
+    Raises ValueError for bad input.
+    """
+    if action == 'multipartCreate':
+        content_type = query_params.get('contentType', '')
+        file_key = new_upload_key(query_params.get('fileName', ''), content_type)
+        file_size = _parse_int(query_params.get('fileSize'), 'fileSize', 1, MAX_UPLOAD_SIZE_BYTES)
+        _upload_token_key()  # fail before starting an upload no token can be issued for
 
-    name = re.sub(r'[^a-zA-Z0-9_-]', '_', name)[:50]
+        upload_id = s3.create_multipart_upload(
+            Bucket=bucket, Key=file_key, ContentType=content_type
+        )['UploadId']
+        return {
+            'key': file_key,
+            'uploadId': upload_id,
+            'uploadToken': _upload_token(file_key, upload_id, file_size),
+            'partSize': MULTIPART_PART_SIZE_BYTES,
+            'partCount': len(_part_sizes(file_size)),
+            'partUrls': _part_urls(bucket, file_key, upload_id, file_size, 1, PART_URL_BATCH_SIZE),
+            'maxSizeBytes': MAX_UPLOAD_SIZE_BYTES,
+        }
 
-    return f"{name}{ext}" if name else None
+    file_key = query_params.get('key', '')
+    upload_id = query_params.get('uploadId', '')
+    if not VALID_KEY_PATTERN.match(file_key) or not upload_id:
+        raise ValueError('Missing or invalid key/uploadId')
+
+    if action == 'multipartPartUrls':
+        file_size = _declared_file_size(file_key, upload_id, query_params.get('uploadToken'))
+        part_count = len(_part_sizes(file_size))
+        start_part = _parse_int(query_params.get('startPart'), 'startPart', 1, part_count)
+        count = _parse_int(query_params.get('count', PART_URL_BATCH_SIZE), 'count', 1, PART_URL_BATCH_SIZE)
+        return {'partUrls': _part_urls(bucket, file_key, upload_id, file_size, start_part, count)}
+
+    if action == 'multipartListParts':
+        parts = _list_uploaded_parts(bucket, file_key, upload_id)
+        return {'parts': [{'partNumber': p['PartNumber'], 'size': p['Size']} for p in parts]}
+
+    if action == 'multipartAbort':
+        s3.abort_multipart_upload(Bucket=bucket, Key=file_key, UploadId=upload_id)
+        return {'key': file_key, 'aborted': True}
+
+    # multipartComplete — ETags come from S3's own listing, so the client sends only
+    # the uploadToken
+    file_size = _declared_file_size(file_key, upload_id, query_params.get('uploadToken'))
+    parts = _list_uploaded_parts(bucket, file_key, upload_id)
+    if not parts:
+        raise ValueError('No parts uploaded')
+    expected_sizes = _part_sizes(file_size)
+    if [p['PartNumber'] for p in parts] != list(range(1, len(parts) + 1)) or len(parts) < len(expected_sizes):
+        raise ValueError('Uploaded parts are incomplete; upload the missing parts first')
+    if [p['Size'] for p in parts] != expected_sizes:
+        s3.abort_multipart_upload(Bucket=bucket, Key=file_key, UploadId=upload_id)
+        raise ValueError(f'Uploaded parts do not match the declared {file_size} bytes; upload aborted')
+
+    s3.complete_multipart_upload(
+        Bucket=bucket, Key=file_key, UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts]},
+    )
+    return {'key': file_key, 'sizeBytes': file_size}
 
 def lambda_handler(event, context):
-    bucket_name = 'up-staging-content'
+    bucket_name = STAGING_BUCKET
+
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
 
     try:
         from attestation_verifier import verify_request
@@ -56,47 +197,16 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Missing query parameters'}),
                 'headers': {'Content-Type': 'application/json'}
             }
-        
-        raw_file_name = query_params.get('fileName', '')
-        content_type = query_params.get('contentType', '')
 
-        if content_type not in ALLOWED_CONTENT_TYPES:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': f'Invalid content type. Allowed: {list(ALLOWED_CONTENT_TYPES)}'}),
-                'headers': {'Content-Type': 'application/json'}
-            }
-        
-        sanitized_name = sanitize_filename(raw_file_name)
-        if not sanitized_name:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Invalid filename. Must be a valid video file (.mp4, .mov, .m4v, .webm)'}),
-                'headers': {'Content-Type': 'application/json'}
-            }
+        action = query_params.get('action')
+        if action in MULTIPART_ACTIONS:
+            response_body = handle_multipart_action(bucket_name, action, query_params)
+            if attestation_result.get('session_token'):
+                response_body['session_token'] = attestation_result['session_token']
+            return build_response(200, response_body)
         
-        file_key = f"{uuid.uuid4()}-{sanitized_name}"
-
-        # Presigned POST (not presigned URL) — supports server-side content-length enforcement
-        presigned_post = s3.generate_presigned_post(
-            Bucket=bucket_name,
-            Key=file_key,
-            Fields={
-                'Content-Type': content_type,
-            },
-            Conditions=[
-                ['content-length-range', 1, MAX_UPLOAD_SIZE_BYTES],
-                {'Content-Type': content_type},
-            ],
-            ExpiresIn=300
-        )
-        
-        response_body = {
-            'url': presigned_post['url'],
-            'fields': presigned_post['fields'],
-            'key': file_key,
-            'maxSizeBytes': MAX_UPLOAD_SIZE_BYTES,
-        }
+        file_key = new_upload_key(query_params.get('fileName', ''), query_params.get('contentType', ''))
+        response_body = presigned_upload(s3, file_key, query_params['contentType'])
         if attestation_result.get('session_token'):
             response_body['session_token'] = attestation_result['session_token']
 
@@ -107,6 +217,10 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json'
             }
         }
+    except ValueError as ve:
+        return build_response(400, {'error': str(ve)})
+    except s3.exceptions.NoSuchUpload:
+        return build_response(404, {'error': 'Multipart upload not found or already completed'})
     except PermissionError as pe:
         return {
             'statusCode': 403,
@@ -123,4 +237,9 @@ def lambda_handler(event, context):
             'headers': {
                 'Content-Type': 'application/json'
             }
-        }
\ No newline at end of file
+        }
+
+
+FUNCTION_NAME = 'up-create-pre-signed-url'
+WARMUP_PRIMERS = (prime_attestation,)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
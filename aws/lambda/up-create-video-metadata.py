@@ -1,17 +1,35 @@
 import json
 import logging
+import os
+import re
 import time
-import boto3
 from datetime import datetime
+import aws_clients
+from hashtags import (
+    flatten_and_publish_hashtags, load_known_hashtags, playable_status_attributes, publish_deferred_hashtags,
+)
+from uploads import new_upload_key, presigned_upload
+from warmup import handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
+s3 = aws_clients.client('s3')
+dynamodb = aws_clients.resource('dynamodb')
 metadata_table = dynamodb.Table('up-videometadata')
-hashtag_table = dynamodb.Table('up-hashtag')
-hashtag_registry_table = dynamodb.Table('up-hashtag-registry')
-rate_limit_table = dynamodb.Table('up-rate-limits')
+compression_status_table = dynamodb.Table(os.environ.get('COMPRESSION_STATUS_TABLE', 'up-video-compression-status'))
+upload_session_table = dynamodb.Table(os.environ.get('UPLOAD_SESSION_TABLE', 'up-upload-sessions'))
+
+# Bookkeeping fields on up-video-compression-status items; everything else there is
+# compression output to copy onto the metadata item
+COMPRESSION_STATUS_KEY_FIELDS = {'videoId', 'region', 'uploadedAt', 'ttl'}
+
+# Metadata status writes only ever raise statusRank. Ranks, the status item TTL and
+# the retry policy must match up-s3-staged-to-compressed.
+COMPRESSION_STATUS_RANKS = {'PROCESSING': 0, 'PREVIEW_READY': 1, 'FAILED': 2, 'READY': 3}
+STATUS_ITEM_TTL_SECONDS = 7 * 24 * 60 * 60
+STATUS_UPDATE_MAX_ATTEMPTS = 3
+STATUS_UPDATE_BASE_BACKOFF_SECONDS = 0.1
 
 MAX_UPLOADS_PER_HOUR = 10
 RATE_LIMIT_WINDOW_SECONDS = 3600
@@ -27,59 +45,143 @@ MAX_DESCRIPTION_LENGTH = 500
 # Guard against oversized payloads to prevent DynamoDB storage abuse (bytes)
 MAX_REQUEST_BODY_SIZE = 4 * 1024  # 4 KB — generous for metadata fields
 
+# Upload sessions (action=createUploadSession): validate and reserve the metadata and
+# return the presigned POST for its key in one attested call. The upload rules come
+# from the common layer's uploads module, shared with up-create-pre-signed-url.
+UPLOAD_SESSION_ACTION = 'createUploadSession'
+
+# Client retries of one upload session send the same idempotencyKey and get the
+# same videoId/key back (with a fresh presigned POST) instead of reserving another
+# metadata item. Keys are remembered per device in up-upload-sessions.
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+UPLOAD_SESSION_TTL_SECONDS = 24 * 60 * 60
+
+_upload_rate_limiter = None  # built on first use (rate_limiter lives in the attestation layer)
+
 def save_metadata(item):
     metadata_table.put_item(Item=item)
 
-def flatten_and_publish_hashtags(video_id, hashtags):
+def reserve_metadata(item):
+    """Save an upload session's metadata unless an earlier attempt already did (it may have advanced since)."""
+    try:
+        metadata_table.put_item(Item=item, ConditionExpression='attribute_not_exists(videoId)')
+    except metadata_table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info("Metadata for %s already saved by an earlier attempt", item['videoId'])
+
+def reconcile_compression_status(video_id, region, uploaded_at):
     """
-    Flatten hashtags and publish each hashtag with the associated video info
-    to the up-hashtag table. Also registers each distinct hashtag in the
-    up-hashtag-registry table so feed generation can avoid full table scans.
+    Register the metadata key on the videoId-keyed compression status item so
+    up-s3-staged-to-compressed can update the metadata directly, and apply any
+    status it already recorded (with the two-call flow, compression usually
+    finishes before metadata is created; upload sessions register it up front).
+    Both sides write the same item before reading it, so at least one of them sees
+    the other. Both metadata writes only raise statusRank, so if compression
+    applies a newer status between our read and our write, ours is dropped.
+    Raises if either write still fails after retries: nothing else would link the
+    two items, so the caller must fail the request and let the client retry. Safe
+    to repeat. Publishes deferred hashtags if the recorded status is playable.
     """
-    for hashtag in hashtags:
-        if not isinstance(hashtag, str) or not hashtag.strip():
-            logger.warning("Invalid hashtag type: %s. Skipping.", hashtag)
-            continue
-
-        hashtag_item = {
-            "hashtag": hashtag,
-            "videoId": video_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "popularity": 0
-        }
+    response = _update_with_retry(
+        compression_status_table, video_id,
+        Key={'videoId': video_id},
+        UpdateExpression='SET #r = :r, uploadedAt = :u, #t = :t',
+        ExpressionAttributeNames={'#r': 'region', '#t': 'ttl'},
+        ExpressionAttributeValues={':r': region, ':u': uploaded_at, ':t': int(time.time()) + STATUS_ITEM_TTL_SECONDS},
+        ReturnValues='ALL_NEW',
+    )
+    recorded = {
+        name: value for name, value in response.get('Attributes', {}).items()
+        if name not in COMPRESSION_STATUS_KEY_FIELDS
+    }
+    if not recorded.get('compressionStatus'):
+        return
+    status = recorded['compressionStatus']
+    recorded['statusRank'] = COMPRESSION_STATUS_RANKS[status]
+    recorded.update(playable_status_attributes(status))
+
+    set_clauses, names, values = [], {}, {}
+    for index, (name, value) in enumerate(recorded.items()):
+        set_clauses.append(f'#a{index} = :a{index}')
+        names[f'#a{index}'] = name
+        values[f':a{index}'] = value
+    values[':rank'] = recorded['statusRank']
+    try:
+        response = _update_with_retry(
+            metadata_table, video_id,
+            Key={'region': region, 'uploadedAt': uploaded_at},
+            UpdateExpression='SET ' + ', '.join(set_clauses),
+            ConditionExpression='attribute_not_exists(statusRank) OR statusRank < :rank',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_OLD',
+        )
+        logger.info("Applied recorded compressionStatus %s to %s", status, video_id)
+    except metadata_table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info("Compression already applied a newer status to %s", video_id)
+        return
+    publish_deferred_hashtags(response.get('Attributes', {}), status)
+
+def _update_with_retry(table, video_id, **kwargs):
+    """table.update_item(**kwargs), retrying transient errors with backoff. Condition failures are raised at once."""
+    for attempt in range(STATUS_UPDATE_MAX_ATTEMPTS):
         try:
-            hashtag_table.put_item(Item=hashtag_item)
+            return table.update_item(**kwargs)
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            raise
         except Exception as e:
-            logger.error("Error publishing hashtag %s for video %s: %s", hashtag, video_id, e)
+            if attempt == STATUS_UPDATE_MAX_ATTEMPTS - 1:
+                raise
+            logger.warning("Update of %s for %s failed (attempt %d), retrying: %s",
+                           table.name, video_id, attempt + 1, e)
+            time.sleep(STATUS_UPDATE_BASE_BACKOFF_SECONDS * (2 ** attempt))
+
+def _session_key(owner, idempotency_key):
+    return f"{owner}#{idempotency_key}"
+
+def find_upload_session(owner, idempotency_key):
+    """{videoId, region, uploadedAt} an earlier attempt of this session reserved, or None."""
+    response = upload_session_table.get_item(
+        Key={'sessionKey': _session_key(owner, idempotency_key)}, ConsistentRead=True
+    )
+    return response.get('Item')
 
-        # Register the hashtag in the registry (idempotent — same PK just overwrites)
-        try:
-            hashtag_registry_table.put_item(Item={"hashtag": hashtag})
-        except Exception as e:
-            logger.error("Error registering hashtag %s in registry: %s", hashtag, e)
+def reserve_upload_session(owner, idempotency_key, video_id, region, uploaded_at):
+    """
+    Claim idempotency_key for owner's upload session. Returns None if this call
+    claimed it, else the {videoId, region, uploadedAt} a concurrent attempt reserved.
+    """
+    session_key = _session_key(owner, idempotency_key)
+    try:
+        upload_session_table.put_item(
+            Item={
+                'sessionKey': session_key,
+                'videoId': video_id,
+                'region': region,
+                'uploadedAt': uploaded_at,
+                'ttl': int(time.time()) + UPLOAD_SESSION_TTL_SECONDS,
+            },
+            ConditionExpression='attribute_not_exists(sessionKey)',
+        )
+        return None
+    except upload_session_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return find_upload_session(owner, idempotency_key)
 
 def check_rate_limit(device_id):
     """
-    Enforce per-device upload rate limiting.
-    Uses an hour-bucketed key so each window auto-expires via DynamoDB TTL.
-    Raises PermissionError if the device has exceeded MAX_UPLOADS_PER_HOUR.
+    Enforce per-device upload rate limiting via the shared limiter in the attestation
+    layer. Raises PermissionError if the device has exceeded MAX_UPLOADS_PER_HOUR.
+    Always strict: each upload is a transcode of up to 500 MB, so the limit must
+    hold exactly across containers (fresh containers start with full buckets).
     """
-    hour_bucket = int(time.time()) // RATE_LIMIT_WINDOW_SECONDS
-    rate_key = f"{device_id}#upload#{hour_bucket}"
-    ttl = (hour_bucket + 2) * RATE_LIMIT_WINDOW_SECONDS  # expire 1 window after current
-
-    response = rate_limit_table.update_item(
-        Key={'rate_key': rate_key},
-        UpdateExpression='SET #count = if_not_exists(#count, :zero) + :one, #ttl = :ttl',
-        ExpressionAttributeNames={'#count': 'request_count', '#ttl': 'ttl'},
-        ExpressionAttributeValues={':zero': 0, ':one': 1, ':ttl': ttl},
-        ReturnValues='UPDATED_NEW',
-    )
-    new_count = int(response['Attributes']['request_count'])
-    if new_count > MAX_UPLOADS_PER_HOUR:
-        raise PermissionError(
-            f"Rate limit exceeded: {MAX_UPLOADS_PER_HOUR} uploads per hour per device"
+    global _upload_rate_limiter
+    if _upload_rate_limiter is None:
+        from rate_limiter import RateLimiter
+        _upload_rate_limiter = RateLimiter(
+            'upload', MAX_UPLOADS_PER_HOUR, RATE_LIMIT_WINDOW_SECONDS,
+            f"Rate limit exceeded: {MAX_UPLOADS_PER_HOUR} uploads per hour per device",
+            strict=True,
         )
+    _upload_rate_limiter.check(device_id)
 
 
 def validate_description(description):
@@ -144,13 +246,14 @@ def remove_hashtags(description) -> str:
     return ' '.join([word for word in words if not word.startswith('#')])
 
 def lambda_handler(event, context):
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
+
     try:
         from attestation_verifier import verify_request, enforce_user_binding
         attestation_result = verify_request(event)
 
         device_id = attestation_result.get('device_id')
-        if device_id:
-            check_rate_limit(device_id)
 
         raw_body = event.get('body', '')
         if len(raw_body) > MAX_REQUEST_BODY_SIZE:
@@ -162,13 +265,25 @@ def lambda_handler(event, context):
 
         # IDOR: device_id ↔ user_id binding
         user_id = body.get('user_id')
-        enforce_user_binding(device_id, user_id)
+        enforce_user_binding(device_id, user_id, attestation_result)
+
+        is_upload_session = body.get('action') == UPLOAD_SESSION_ACTION
+        idempotency_key = body.get('idempotencyKey') if is_upload_session else None
+        if idempotency_key is not None and (
+            not isinstance(idempotency_key, str) or not IDEMPOTENCY_KEY_PATTERN.match(idempotency_key)
+        ):
+            raise ValueError("idempotencyKey must be 8-64 letters, digits or hyphens")
+
+        # A retry of a session that already reserved its upload doesn't take another upload slot
+        earlier = find_upload_session(device_id or user_id, idempotency_key) if idempotency_key else None
+        if device_id and not earlier:
+            check_rate_limit(device_id)
 
         video_id = body.get('videoId')
         description = body.get('description')
         uploaded_at = body.get('uploadedAt', datetime.utcnow().isoformat())
 
-        if not video_id:
+        if not video_id and not is_upload_session:
             return {
                 "statusCode": 400,
                 "body": json.dumps({"message": "Missing required fields: videoId"})
@@ -181,6 +296,18 @@ def lambda_handler(event, context):
         region = body.get('region', 'NA')
         country = body.get('country', 'NA')
 
+        upload = None
+        if is_upload_session:
+            # The metadata is reserved under the key the client is about to upload to
+            content_type = body.get('contentType')
+            video_id = new_upload_key(body.get('fileName'), content_type)
+            if idempotency_key and not earlier:
+                earlier = reserve_upload_session(device_id or user_id, idempotency_key, video_id, region, uploaded_at)
+            if earlier:
+                # A retry: hand back the same key and redo every step, each of which is idempotent
+                video_id, region, uploaded_at = earlier['videoId'], earlier['region'], earlier['uploadedAt']
+            upload = presigned_upload(s3, video_id, content_type)
+
         date_partition = uploaded_at[:10]
 
         item = {
@@ -193,16 +320,27 @@ def lambda_handler(event, context):
             "city": city, 
             "region": region, 
             "country": country,
-            "compressionStatus": "PROCESSING",  # set to READY by up-s3-staged-to-compressed
+            "compressionStatus": "PROCESSING",  # set to PREVIEW_READY/READY by up-s3-staged-to-compressed
+            "statusRank": COMPRESSION_STATUS_RANKS['PROCESSING'],
         }
 
-        save_metadata(item)
-        flatten_and_publish_hashtags(video_id, hashtags)
+        if is_upload_session:
+            # Nothing is uploaded yet: hashtags are published by the status write that
+            # first makes the video playable (see the common layer's hashtags module)
+            item["hashtagsDeferred"] = True
+            reserve_metadata(item)
+            reconcile_compression_status(video_id, region, uploaded_at)
+        else:
+            save_metadata(item)
+            reconcile_compression_status(video_id, region, uploaded_at)
+            flatten_and_publish_hashtags(video_id, hashtags)
 
         response_body = {
             "message": "Metadata and hashtags saved successfully",
             "videoId": video_id
         }
+        if upload:
+            response_body.update(upload)
         if attestation_result.get('session_token'):
             response_body['session_token'] = attestation_result['session_token']
 
@@ -228,3 +366,8 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "body": json.dumps({"message": "Failed to save metadata"})
         }
+
+
+FUNCTION_NAME = 'up-create-video-metadata'
+WARMUP_PRIMERS = (prime_attestation, load_known_hashtags)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
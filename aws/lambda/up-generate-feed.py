@@ -1,6 +1,6 @@
+import heapq
 import json
 import os
-import boto3
 from boto3.dynamodb.conditions import Key
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
@@ -9,6 +9,8 @@ import time
 import traceback
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import aws_clients
+from warmup import handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 # Load the feed word list for seeding new-user confidence scores
 try:
@@ -21,7 +23,7 @@ except FileNotFoundError:
 
 
 # Initialize the DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+dynamodb = aws_clients.resource('dynamodb')
 hashtag_table = dynamodb.Table('up-hashtag')
 hashtag_registry_table = dynamodb.Table('up-hashtag-registry')
 user_profiles_table = dynamodb.Table('up-user-profiles')
@@ -31,7 +33,26 @@ HARD_FEED_LIMIT = 40
 HASHTAG_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
 ACTIVE_USER_WINDOW_DAYS = 7  # Only batch-generate feeds for users active within this window
 
+# Confidence-map compaction: scores decay exponentially with this half-life, scores
+# that decay below MIN_CONFIDENCE_SCORE are dropped, and only the top-N per feed type
+# are kept (quantized unless CONFIDENCE_QUANTUM=''), clamped to ±MAX_CONFIDENCE_SCORE
+# so quantizing never exceeds Decimal precision. The batch job writes compacted maps
+# back; the request path compacts in memory. Must match up-update-user-profiles.
+CONFIDENCE_HALF_LIFE_DAYS = float(os.environ.get('CONFIDENCE_HALF_LIFE_DAYS', '30'))
+MIN_CONFIDENCE_SCORE = Decimal(os.environ.get('MIN_CONFIDENCE_SCORE', '0.001'))
+MAX_CONFIDENCE_HASHTAGS = int(os.environ.get('MAX_CONFIDENCE_HASHTAGS', '200'))
+CONFIDENCE_QUANTUM = os.environ.get('CONFIDENCE_QUANTUM', '0.001')
+MAX_CONFIDENCE_SCORE = Decimal(os.environ.get('MAX_CONFIDENCE_SCORE', '1e9'))
+VIDEO_FEED_TYPES = ('VIDEO_FOCUSED_FEED', 'VIDEO_AUDIO_FEED')
+
+# Cold-start feeds: one precomputed word-list-seeded feed per feed type, refreshed by
+# the batch job and stored in up-user-profiles under a reserved key (user_ids are UUIDs)
+COLD_START_FEED_KEY_PREFIX = '__cold_start__#'
+COLD_START_CACHE_TTL_SECONDS = 10 * 60
+
 _hashtag_cache = {"hashtags": None, "expires_at": 0}
+_cold_start_cache = {}  # video_feed_type -> {"video_feed": [...], "expires_at": float}
+_seed_scores_cache = {}  # video_feed_type -> {hashtag: Decimal}
 
 debug_mode = False  # Set to False to disable debug logs
 
@@ -48,8 +69,8 @@ def _fetch_fallback_videos(exclude_ids: set, seen_checksums: set, limit: int):
         response = videometadata_table.scan(
             ProjectionExpression=_VIDEO_METADATA_FIELDS,
             ExpressionAttributeNames=_VIDEO_METADATA_EXPR_NAMES,
-            FilterExpression='compressionStatus = :ready',
-            ExpressionAttributeValues={':ready': 'READY'},
+            FilterExpression='compressionStatus IN (:ready, :preview)',
+            ExpressionAttributeValues={':ready': 'READY', ':preview': 'PREVIEW_READY'},
             Limit=200,
         )
         items = response.get('Items', [])
@@ -90,13 +111,43 @@ def generate_video_feed(user_id, hashtags, confidence_scores, limit, seen_checks
             logger.info(f"Padded feed with {len(fallback)} fallback videos (had {len(video_metadatas)}/{limit})")
             video_metadatas.extend(fallback)
 
+    video_metadatas = collapse_near_duplicates(video_metadatas)
     logger.debug(f"Generated video feed: {video_metadatas}")
     return video_metadatas
 
+def collapse_near_duplicates(video_metadatas):
+    """
+    Keep only the first of any videos whose perceptual hashes (set by the compression
+    pass) are within the near-duplicate radius. The phash field is stripped — the
+    client doesn't need it. Videos without a phash are always kept.
+    """
+    try:
+        from video_fingerprint import NearDuplicateIndex, from_hex
+    except (ImportError, RuntimeError) as e:
+        # RuntimeError: the layer rejects a misconfigured NEAR_DUPLICATE_RADIUS at import
+        logger.warning("video_fingerprint layer unavailable, skipping near-duplicate collapse: %s", e)
+        for item in video_metadatas:
+            item.pop('phash', None)
+        return video_metadatas
+
+    index = NearDuplicateIndex()
+    collapsed = []
+    for item in video_metadatas:
+        phash_hex = item.pop('phash', None)
+        if phash_hex:
+            phash = from_hex(phash_hex)
+            if index.find(phash) is not None:
+                logger.debug(f"Collapsing near-duplicate video {item['videoId']}")
+                continue
+            index.add(phash)
+        collapsed.append(item)
+    return collapsed
+
 # Only fetch the fields the client actually uses + compressionStatus for server-side filtering
-_VIDEO_METADATA_FIELDS = 'videoId, description, hashtags, muteByDefault, uploadedAt, city, #r, country, compressionStatus'
+_VIDEO_METADATA_FIELDS = 'videoId, description, hashtags, muteByDefault, uploadedAt, city, #r, country, compressionStatus, hls, posterKey, spriteSheet, durationSeconds, videoWidth, videoHeight, compressedKey, phash'
 _VIDEO_METADATA_EXPR_NAMES = {'#r': 'region'}  # 'region' is a DynamoDB reserved word
 _VIDEOID_GSI = 'videoId-uploadedAt-index'
+_PLAYABLE_STATUSES = {'READY', 'PREVIEW_READY'}
 
 videometadata_table = dynamodb.Table('up-videometadata')
 
@@ -139,11 +190,11 @@ def get_video_metadatas(video_ids):
             if result is not None:
                 video_metadata.append(result)
 
-    # Filter out videos that are not ready for playback.
+    # Filter out videos that are not ready for playback (PREVIEW_READY serves the fast proxy).
     # Legacy videos without compressionStatus are treated as ready (backward compatible).
     video_metadata = [
         item for item in video_metadata
-        if item.get('compressionStatus', 'READY') == 'READY'
+        if item.get('compressionStatus', 'READY') in _PLAYABLE_STATUSES
     ]
 
     # Strip compressionStatus before returning — client doesn't need it
@@ -158,7 +209,7 @@ def _query_hashtag(hashtag: str):
     """Query DynamoDB for a single hashtag. Designed for parallel execution."""
     try:
         response = hashtag_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('hashtag').eq(hashtag),
+            KeyConditionExpression=Key('hashtag').eq(hashtag),
             ScanIndexForward=False,
             Limit=200
         )
@@ -319,21 +370,47 @@ def should_generate_new_feed(last_updated_ts):
         last_updated = last_updated.replace(tzinfo=timezone.utc)
     return (datetime.now(timezone.utc) - last_updated) >= timedelta(minutes=2)
 
-def update_user_feed(user_id, video_feed):
+def update_user_feed(user_id, video_feed, compacted_algorithm=None, expected_last_login=None):
     """
     Update the user's pre-generated video feed in DynamoDB.
     Uses last_batch_feed_update (not last_updated_feed) so batch jobs
     don't interfere with the individual request rate limit.
+
+    When compacted_algorithm is given, the compacted confidence maps are written
+    back in the same call, guarded on last_login (bumped by every profile sync) so
+    a sync that landed after the scan is never overwritten. On conflict only the
+    feed is written and compaction waits for the next batch run.
     """
+    now = datetime.now(timezone.utc).isoformat()
+    set_clauses = ["video_feed = :video_feed", "last_batch_feed_update = :last_batch_feed_update"]
+    names = {}
+    values = {':video_feed': video_feed, ':last_batch_feed_update': now}
+    kwargs = {}
+
+    if compacted_algorithm:
+        names.update({'#algorithm': 'algorithm', '#scores': 'hashtag_to_confidence_scores', '#last_login': 'last_login'})
+        for index, (feed_type, scores) in enumerate(compacted_algorithm.items()):
+            names[f'#f{index}'] = feed_type
+            values[f':scores{index}'] = scores
+            set_clauses.append(f"#algorithm.#f{index}.#scores = :scores{index}")
+        set_clauses.append("algorithm_compacted_at = :last_batch_feed_update")
+        if expected_last_login is None:
+            kwargs['ConditionExpression'] = 'attribute_not_exists(#last_login)'
+        else:
+            kwargs['ConditionExpression'] = '#last_login = :expected_last_login'
+            values[':expected_last_login'] = expected_last_login
+        kwargs['ExpressionAttributeNames'] = names
+
     try:
         user_profiles_table.update_item(
             Key={'user_id': user_id},
-            UpdateExpression="SET video_feed = :video_feed, last_batch_feed_update = :last_batch_feed_update",
-            ExpressionAttributeValues={
-                ':video_feed': video_feed,
-                ':last_batch_feed_update': datetime.now(timezone.utc).isoformat()
-            }
+            UpdateExpression="SET " + ", ".join(set_clauses),
+            ExpressionAttributeValues=values,
+            **kwargs
         )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info("Profile %s changed since scan, skipping confidence compaction", user_id)
+        update_user_feed(user_id, video_feed)
     except Exception as e:
         logger.error("Error updating user feed for user_id %s: %s", user_id, e)
         raise
@@ -358,12 +435,130 @@ def update_individual_feed_timestamp(user_id, video_feed_type):
     except Exception as e:
         logger.error(f"Error updating individual feed timestamp for {user_id}: {e}")
 
+def _seconds_since(iso_ts):
+    """Seconds elapsed since an ISO timestamp; 0 when missing or unparseable."""
+    if not iso_ts:
+        return 0
+    try:
+        ts = datetime.fromisoformat(iso_ts)
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return max((datetime.now(timezone.utc) - ts).total_seconds(), 0)
+    except (ValueError, TypeError):
+        return 0
+
+
+def compact_confidence_scores(scores: dict, elapsed_seconds: float = 0) -> dict:
+    """
+    Apply exponential decay for elapsed_seconds, drop scores that decayed below
+    MIN_CONFIDENCE_SCORE, keep the top MAX_CONFIDENCE_HASHTAGS and quantize.
+    """
+    factor = Decimal(str(0.5 ** (elapsed_seconds / (CONFIDENCE_HALF_LIFE_DAYS * 86400))))
+    decayed = (
+        (tag, max(-MAX_CONFIDENCE_SCORE, min(Decimal(score) * factor, MAX_CONFIDENCE_SCORE)))
+        for tag, score in scores.items()
+    )
+    kept = heapq.nlargest(
+        MAX_CONFIDENCE_HASHTAGS,
+        ((tag, score) for tag, score in decayed if abs(score) >= MIN_CONFIDENCE_SCORE),
+        key=lambda kv: kv[1],
+    )
+    if CONFIDENCE_QUANTUM:
+        quantum = Decimal(CONFIDENCE_QUANTUM)
+        return {tag: score.quantize(quantum) for tag, score in kept}
+    return dict(kept)
+
+
+def compact_user_algorithm(user_profile: dict) -> dict:
+    """
+    Compacted {feed_type: hashtag_to_confidence_scores} for the feed types present
+    on the profile, decayed for the time since the last batch compaction.
+    """
+    algorithm = user_profile.get('algorithm', {})
+    elapsed = _seconds_since(user_profile.get('algorithm_compacted_at'))
+    return {
+        feed_type: compact_confidence_scores(
+            algorithm[feed_type].get('hashtag_to_confidence_scores', {}), elapsed
+        )
+        for feed_type in VIDEO_FEED_TYPES
+        if feed_type in algorithm
+    }
+
+
 def extract_seen_checksums(user_profile: dict) -> set:
     """Extract seen video ID checksums from an already-fetched user profile."""
     return set(
         user_profile.get('preferences', {}).get('seen_video_ids_checksum', [])
     )
 
+def seed_confidence_scores(video_feed_type):
+    """
+    Word-list confidence scores for a user with no history. Positive word-list scores
+    seed the audio feed, negative ones (as magnitudes) the focused feed. Built once per container.
+    """
+    if video_feed_type not in _seed_scores_cache:
+        seeds = {}
+        for tag, score in FEED_WORD_LIST.items():
+            if video_feed_type == 'VIDEO_AUDIO_FEED' and score > 0:
+                seeds[tag] = Decimal(str(score))
+            elif video_feed_type == 'VIDEO_FOCUSED_FEED' and score < 0:
+                seeds[tag] = Decimal(str(abs(score)))
+        _seed_scores_cache[video_feed_type] = seeds
+    return dict(_seed_scores_cache[video_feed_type])
+
+
+def refresh_cold_start_feeds():
+    """Regenerate the precomputed cold-start feed for each feed type from the word-list seeds."""
+    hashtags = fetch_all_hashtags()
+    for video_feed_type in VIDEO_FEED_TYPES:
+        try:
+            video_feed = generate_video_feed(
+                f"{COLD_START_FEED_KEY_PREFIX}{video_feed_type}", hashtags,
+                seed_confidence_scores(video_feed_type), HARD_FEED_LIMIT
+            )
+            if not video_feed:
+                logger.warning(f"Cold-start feed for {video_feed_type} came back empty, keeping previous")
+                continue
+            user_profiles_table.put_item(Item={
+                'user_id': f"{COLD_START_FEED_KEY_PREFIX}{video_feed_type}",
+                'video_feed': video_feed,
+                'generated_at': datetime.now(timezone.utc).isoformat(),
+            })
+            _cold_start_cache[video_feed_type] = {
+                "video_feed": video_feed,
+                "expires_at": time.time() + COLD_START_CACHE_TTL_SECONDS,
+            }
+            logger.info(f"Refreshed cold-start feed for {video_feed_type} ({len(video_feed)} videos)")
+        except Exception as e:
+            logger.error(f"Error refreshing cold-start feed for {video_feed_type}: {e}")
+
+
+def get_cold_start_feed(video_feed_type, limit):
+    """
+    Serve the precomputed cold-start feed from module cache, else from its single item.
+    Returns a per-request shuffle, or None if no cold-start feed has been generated yet.
+    """
+    cached = _cold_start_cache.get(video_feed_type)
+    if not cached or time.time() >= cached["expires_at"]:
+        try:
+            response = user_profiles_table.get_item(
+                Key={'user_id': f"{COLD_START_FEED_KEY_PREFIX}{video_feed_type}"},
+                ProjectionExpression='video_feed',
+            )
+        except Exception as e:
+            logger.error(f"Error fetching cold-start feed for {video_feed_type}: {e}")
+            return None
+        video_feed = response.get('Item', {}).get('video_feed')
+        if not video_feed:
+            return None
+        cached = {"video_feed": video_feed, "expires_at": time.time() + COLD_START_CACHE_TTL_SECONDS}
+        _cold_start_cache[video_feed_type] = cached
+
+    video_feed = list(cached["video_feed"])
+    random.shuffle(video_feed)
+    return video_feed[:limit]
+
+
 def process_individual_user(user_id, video_feed_type, limit):
     """
     Process an individual user's request for a video feed.
@@ -382,6 +577,12 @@ def process_individual_user(user_id, video_feed_type, limit):
             logger.info(f"User {user_id} already exists (concurrent creation), fetching profile")
             user_profile = fetch_user_profile(user_id)
         if not user_profile:
+            # First app open: serve the precomputed cold-start feed without hashtag fan-out.
+            # No rate-limit timestamp is written, so the next request personalizes immediately.
+            cold_start_feed = get_cold_start_feed(video_feed_type, limit)
+            if cold_start_feed:
+                logger.info(f"Returning cold-start feed for new user {user_id} ({len(cold_start_feed)} videos)")
+                return cold_start_feed
             user_profile = {'user_id': user_id}
 
     # If the batch job pre-generated a feed that's still fresh, return it immediately
@@ -398,16 +599,12 @@ def process_individual_user(user_id, video_feed_type, limit):
     if not should_generate_new_feed(user_profile.get(rate_limit_field)):
         raise Exception(f"{TOO_MANY_REQUESTS_ERROR} for user_id {user_id}, please wait a couple minutes")
 
-    # Get the user's hashtag to confidence scores from algorithm.<feed_type>
-    hashtag_to_confidence = user_profile.get('algorithm', {}).get(video_feed_type, {}).get('hashtag_to_confidence_scores', {})
+    # Get the user's decayed, top-N hashtag to confidence scores from algorithm.<feed_type>
+    hashtag_to_confidence = compact_user_algorithm(user_profile).get(video_feed_type, {})
 
     # Seed new users with word list scores so the feed algorithm picks content-appropriate hashtags
     if not hashtag_to_confidence:
-        for tag, score in FEED_WORD_LIST.items():
-            if video_feed_type == 'VIDEO_AUDIO_FEED' and score > 0:
-                hashtag_to_confidence[tag] = Decimal(str(score))
-            elif video_feed_type == 'VIDEO_FOCUSED_FEED' and score < 0:
-                hashtag_to_confidence[tag] = Decimal(str(abs(score)))
+        hashtag_to_confidence = seed_confidence_scores(video_feed_type)
 
     # Extract seen checksums from the profile we already fetched (avoids redundant DynamoDB read)
     seen_checksums = extract_seen_checksums(user_profile)
@@ -455,6 +652,10 @@ def process_all_users():
         for user in users:
             user_id = user['user_id']
 
+            # Reserved cold-start feed items are refreshed by refresh_cold_start_feeds
+            if user_id.startswith(COLD_START_FEED_KEY_PREFIX):
+                continue
+
             # Skip users who haven't opened the app recently
             if not _is_recently_active(user):
                 continue
@@ -463,10 +664,13 @@ def process_all_users():
             if not should_generate_new_feed(user.get('last_batch_feed_update')):
                 continue
 
+            # Decay and trim both confidence maps before merging, so merge cost and
+            # the written-back item size stay bounded as the profile ages
+            compacted_algorithm = compact_user_algorithm(user)
+
             # Merge confidence scores from both feed types for a combined batch feed
-            algorithm = user.get('algorithm', {})
-            focused_scores = algorithm.get('VIDEO_FOCUSED_FEED', {}).get('hashtag_to_confidence_scores', {})
-            audio_scores = algorithm.get('VIDEO_AUDIO_FEED', {}).get('hashtag_to_confidence_scores', {})
+            focused_scores = compacted_algorithm.get('VIDEO_FOCUSED_FEED', {})
+            audio_scores = compacted_algorithm.get('VIDEO_AUDIO_FEED', {})
             hashtag_to_confidence = {**focused_scores, **audio_scores}
             # Where both feeds have a score for the same hashtag, take the higher one
             for tag in focused_scores:
@@ -483,7 +687,8 @@ def process_all_users():
             video_feed = generate_video_feed(user_id, hashtags, hashtag_to_confidence, HARD_FEED_LIMIT, seen_checksums)
 
             # Update the user's feed in the user profiles table (writes last_batch_feed_update, NOT last_updated_feed)
-            update_user_feed(user_id, video_feed)
+            # and write the compacted confidence maps back in the same call
+            update_user_feed(user_id, video_feed, compacted_algorithm, user.get('last_login'))
 
         # Check if there are more users to process
         if 'LastEvaluatedKey' not in response:
@@ -499,6 +704,8 @@ def get_params_invalid_reason(user_id, video_feed_type, limit):
     """
     if not user_id or not isinstance(user_id, str):
         return "Invalid user_id, must be a string"
+    if user_id.startswith(COLD_START_FEED_KEY_PREFIX):
+        return "Invalid user_id, reserved prefix"
     if not video_feed_type or not isinstance(video_feed_type, str) or video_feed_type not in ["VIDEO_AUDIO_FEED", "VIDEO_FOCUSED_FEED"]:
         return "Invalid video_feed_type, must be VIDEO_AUDIO_FEED or VIDEO_FOCUSED_FEED"
     if not limit or not isinstance(limit, int) or limit <= 0:
@@ -506,6 +713,9 @@ def get_params_invalid_reason(user_id, video_feed_type, limit):
     return None
 
 def lambda_handler(event, context):
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
+
     try:
         # Check if the invocation is via HTTP by inspecting the 'http' key
         if 'http' in event["requestContext"]:
@@ -518,7 +728,7 @@ def lambda_handler(event, context):
             user_id = body.get('user_id')
 
             # IDOR protection: ensure this device is bound to this user_id
-            enforce_user_binding(attestation_result.get('device_id'), user_id)
+            enforce_user_binding(attestation_result.get('device_id'), user_id, attestation_result)
             video_feed_type = body.get('video_feed_type')
             limit = body.get('limit', HARD_FEED_LIMIT)
 
@@ -540,6 +750,7 @@ def lambda_handler(event, context):
             }
         else:
             # Handle non-HTTP invocations
+            refresh_cold_start_feeds()
             process_all_users()
             return {
                 "statusCode": 200,
@@ -563,4 +774,14 @@ def lambda_handler(event, context):
             return {
                 "statusCode": 500,
                 "body": json.dumps({"message": "Failed to generate user feeds"})
-            }
\ No newline at end of file
+            }
+
+
+def _prime_seed_scores():
+    for video_feed_type in VIDEO_FEED_TYPES:
+        seed_confidence_scores(video_feed_type)
+
+
+FUNCTION_NAME = 'up-generate-feed'
+WARMUP_PRIMERS = (prime_attestation, fetch_all_hashtags, _prime_seed_scores)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
@@ -1,56 +1,231 @@
+import hashlib
+import json
 import logging
-import boto3
 import os
 import re
+import shutil
 import subprocess
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import aws_clients
+from hashtags import playable_status_attributes, publish_deferred_hashtags
+from uploads import VALID_KEY_PATTERN  # staging key format shared with the upload handlers
+from warmup import handle_warmup, is_warmup_event, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+# Part uploads and downloads of large objects outlast the shared default read timeout
+S3_READ_TIMEOUT_SECONDS = float(os.environ.get('S3_READ_TIMEOUT_SECONDS', '60'))
+
+s3_client = aws_clients.client('s3', read_timeout=S3_READ_TIMEOUT_SECONDS)
+dynamodb = aws_clients.resource('dynamodb')
 metadata_table = dynamodb.Table('up-videometadata')
+content_hash_table = dynamodb.Table(os.environ.get('CONTENT_HASH_TABLE', 'up-video-content-hashes'))
+compression_status_table = dynamodb.Table(os.environ.get('COMPRESSION_STATUS_TABLE', 'up-video-compression-status'))
 
 COMPRESSED_BUCKET = "up-compressed-content"
 TEMP_DIR = "/tmp"
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', "/opt/bin/ffmpeg")
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', "/opt/bin/ffprobe")
+PROBE_TIMEOUT_SECONDS = 30
 
-# Must match the key format produced by up-create-pre-signed-url
-VALID_KEY_PATTERN = re.compile(
-    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}-[a-zA-Z0-9_-]{1,50}\.(mp4|mov|m4v|webm)$'
-)
+# Full-quality x264 settings. ENCODE_THREADS=0 leaves thread count to ffmpeg.
+# Tune with benchmarks/transcode_benchmark.py and the encode_stats log lines.
+ENCODE_CRF = os.environ.get('ENCODE_CRF', '25')
+ENCODE_PRESET = os.environ.get('ENCODE_PRESET', 'medium')  # 'slower' is too expensive for Lambda
+ENCODE_THREADS = int(os.environ.get('ENCODE_THREADS', '0'))
+FFMPEG_BENCH_PATTERN = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s|bench: maxrss=(\d+)\s*(?:KiB|kB)')
 
-VIDEOID_GSI = 'videoId-uploadedAt-index'
+# Remux policy: sources already inside these bounds are stream-copied
+# (-c copy) instead of re-encoded. Anything else gets a source-tuned encode.
+REMUX_VIDEO_CODECS = {'h264'}
+REMUX_AUDIO_CODECS = {'aac'}
+REMUX_PIX_FMTS = {'yuv420p', 'yuvj420p'}
+REMUX_MAX_VIDEO_BITRATE = int(os.environ.get('REMUX_MAX_VIDEO_BITRATE', str(8_000_000)))
+MAX_OUTPUT_LONG_SIDE = 1920
+MAX_OUTPUT_FPS = 30
+AUDIO_COPY_MAX_BITRATE = 192_000
+# Above this many source pixels × seconds, trade a little size for speed
+FAST_PRESET_PIXEL_SECONDS = 1920 * 1080 * 90
 
+# Streaming mode pipes the S3 body into ffmpeg's stdin and uploads fragmented-MP4
+# output as a multipart upload while encoding, so nothing touches /tmp and upload
+# size is not capped by ephemeral storage. Inputs whose moov atom trails the media
+# data can't be demuxed from a pipe and fall back to the /tmp path.
+STREAMING_TRANSCODE = os.environ.get('STREAMING_TRANSCODE', 'false').lower() == 'true'
+STREAM_READ_CHUNK_BYTES = 1024 * 1024
+MULTIPART_PART_SIZE_BYTES = 8 * 1024 * 1024  # S3 minimum is 5 MiB (except the last part)
+MULTIPART_UPLOAD_CONCURRENCY = 4
+MP4_HEADER_PROBE_BYTES = 64 * 1024
 
-def update_compression_status(video_id, status):
-    """Resolve the item's PK via videoId GSI, then update compressionStatus."""
-    try:
-        response = metadata_table.query(
-            IndexName=VIDEOID_GSI,
-            KeyConditionExpression='videoId = :vid',
-            ExpressionAttributeValues={':vid': video_id},
-            ProjectionExpression='#r, uploadedAt',
-            ExpressionAttributeNames={'#r': 'region'},
-            Limit=1,
-        )
-        items = response.get('Items', [])
-        if not items:
-            logger.warning("No metadata record found for videoId %s, skipping status update", video_id)
-            return
+# HLS packaging adds an adaptive ladder next to the progressive MP4, encoded from
+# the same decode. Rungs are (short side px, video bps); rungs above the source's
+# short side are skipped. Output lands under hls/<object key>/ in COMPRESSED_BUCKET.
+HLS_PACKAGING = os.environ.get('HLS_PACKAGING', 'false').lower() == 'true'
+HLS_PREFIX = "hls"
+HLS_LADDER = [(360, 800_000), (540, 1_500_000), (720, 3_000_000)]
+HLS_SEGMENT_SECONDS = 2
+HLS_AUDIO_BITRATE = 96_000
+HLS_CONTENT_TYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t'}
 
-        region = items[0]['region']
-        uploaded_at = items[0]['uploadedAt']
+# Poster frame and scrub sprite, produced by the same decode as the video and
+# stored under assets/<object key>/. Duration and display resolution come from
+# the probe. All are recorded on the metadata item for cheap feed placeholders.
+# Opt-in like the other pipeline modes: the filter graph needs a full decode, so
+# it also turns remux-eligible sources into a decode pass.
+DERIVED_ASSETS = os.environ.get('DERIVED_ASSETS', 'false').lower() == 'true'
+ASSETS_PREFIX = "assets"
+POSTER_FORMAT = os.environ.get('POSTER_FORMAT', 'jpg')  # 'jpg' | 'webp'
+POSTER_SHORT_SIDE = 540
+SPRITE_COLUMNS = 5
+SPRITE_ROWS = 2
+SPRITE_TILE_WIDTH = 160
+ASSET_CONTENT_TYPES = {'.jpg': 'image/jpeg', '.webp': 'image/webp'}
 
-        metadata_table.update_item(
-            Key={'region': region, 'uploadedAt': uploaded_at},
-            UpdateExpression='SET compressionStatus = :s',
-            ExpressionAttributeValues={':s': status},
-        )
+# Two-phase mode: a quick low-res 'ultrafast' proxy is uploaded under the final key
+# and the video marked PREVIEW_READY (feeds may serve it) before the full-quality
+# encode overwrites the same key — S3 PUTs are atomic — and flips it to READY.
+# Sources that only need a remux skip the preview; the full path is already fast.
+TWO_PHASE_TRANSCODE = os.environ.get('TWO_PHASE_TRANSCODE', 'false').lower() == 'true'
+PREVIEW_READY_STATUS = "PREVIEW_READY"
+PREVIEW_SHORT_SIDE = 480
+
+# Chunked mode: long sources are split at keyframes (stream copy), the video chunks
+# are encoded by parallel ffmpeg processes and concatenated losslessly, with audio
+# encoded once alongside. Only used when the source needs a re-encode.
+CHUNKED_ENCODE = os.environ.get('CHUNKED_ENCODE', 'false').lower() == 'true'
+CHUNKED_MIN_DURATION_SECONDS = 60
+CHUNK_SECONDS = 10
+CHUNK_WORKERS = max(1, int(os.environ.get('CHUNK_WORKERS', str(os.cpu_count() or 1))))
+
+# Concurrent multi-record mode: process up to CONCURRENT_RECORDS records of one event
+# at once, each reserving an estimate of its /tmp footprint from a shared budget.
+CONCURRENT_RECORDS = max(1, int(os.environ.get('CONCURRENT_RECORDS', '1')))
+TMP_BUDGET_FRACTION = 0.9
+TMP_FOOTPRINT_MULTIPLIER = 2.5  # source + output (+ chunks), relative to source size
+
+# Content-hash dedupe: the staged object's SHA-256 is computed as it downloads to
+# /tmp (no extra read) and looked up in a hash → compressed-key index. On a hit the
+# new metadata points at the existing rendition (compressedKey) and transcoding is
+# skipped. Streamed sources are hashed as they feed ffmpeg, so they are indexed for
+# later uploads but can't skip their own transcode.
+CONTENT_DEDUPE = os.environ.get('CONTENT_DEDUPE', 'false').lower() == 'true'
+HASH_READ_CHUNK_BYTES = 1024 * 1024
+
+# Perceptual fingerprint (video_fingerprint layer): FINGERPRINT_FRAMES evenly spaced
+# frames are seeked out of the staged object over a presigned URL, hashed, stored on
+# the metadata as `phash` and indexed for near-duplicate lookups. With the short
+# circuit on, a near-duplicate reuses the existing rendition like an exact match.
+PERCEPTUAL_FINGERPRINT = os.environ.get('PERCEPTUAL_FINGERPRINT', 'false').lower() == 'true'
+NEAR_DUPLICATE_SHORT_CIRCUIT = os.environ.get('NEAR_DUPLICATE_SHORT_CIRCUIT', 'false').lower() == 'true'
+FINGERPRINT_FRAMES = 8
+FINGERPRINT_FRAME_SIZE = 32  # must match video_fingerprint.FRAME_SIZE
+
+# videoId-keyed status items carry the metadata key (region, uploadedAt) once known,
+# so status updates are one direct write instead of a GSI lookup (see
+# update_compression_status). They only need to outlive metadata creation.
+STATUS_ITEM_TTL_SECONDS = 7 * 24 * 60 * 60
+STATUS_UPDATE_MAX_ATTEMPTS = 3
+STATUS_UPDATE_BASE_BACKOFF_SECONDS = 0.1
+
+# Every status write, to the status item and to the metadata item, is conditional on
+# statusRank only ever increasing, so a late writer can never move a video back (e.g.
+# PREVIEW_READY or FAILED over READY). FAILED ranks below READY so a successful retry
+# still wins. Must match up-create-video-metadata.
+COMPRESSION_STATUS_RANKS = {'PROCESSING': 0, PREVIEW_READY_STATUS: 1, 'FAILED': 2, 'READY': 3}
+
+
+def update_compression_status(video_id, status, attributes=None):
+    """
+    Record compressionStatus (plus any attributes produced by the transcode, e.g.
+    HLS renditions) on the videoId-keyed status item, then write it straight to the
+    metadata item whose key that item carries. Upload sessions register the key
+    before the upload starts; with the older presign-then-metadata flow it is often
+    still missing, and up-create-video-metadata registers it afterwards and applies
+    whatever status it finds there.
+    Single-item updates serialize, so at least one side always sees the other, and
+    the statusRank condition on every write keeps the later of two racing writes
+    from applying an older status.
+    """
+    attributes = {**(attributes or {}), 'compressionStatus': status, 'statusRank': COMPRESSION_STATUS_RANKS[status]}
+    try:
+        pointer = _record_status(video_id, attributes)
+        if pointer is None:
+            logger.warning("Status item for %s is already past %s, skipping status update", video_id, status)
+            return
+        if 'region' not in pointer or 'uploadedAt' not in pointer:
+            logger.info("No metadata key for %s yet, %s left for metadata creation to apply", video_id, status)
+            return
+        _update_metadata_with_retry(pointer['region'], pointer['uploadedAt'], video_id, attributes)
         logger.info("Updated compressionStatus to %s for %s", status, video_id)
     except Exception as e:
         logger.error("Failed to update compressionStatus for %s: %s", video_id, e)
 
+
+def _record_status(video_id, attributes):
+    """
+    SET attributes on the status item; returns the item's metadata key fields, or
+    None if the item already records a status at least as far along.
+    """
+    set_clauses, names, values = _set_clauses({**attributes, 'ttl': int(time.time()) + STATUS_ITEM_TTL_SECONDS})
+    try:
+        response = compression_status_table.update_item(
+            Key={'videoId': video_id},
+            UpdateExpression='SET ' + ', '.join(set_clauses),
+            ConditionExpression='attribute_not_exists(statusRank) OR statusRank < :rank',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={**values, ':rank': attributes['statusRank']},
+            ReturnValues='ALL_NEW',
+        )
+    except compression_status_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return response.get('Attributes', {})
+
+
+def _set_clauses(attributes):
+    """(clauses, names, values) for `SET #aN = :aN, ...` over a dict of attributes."""
+    set_clauses, names, values = [], {}, {}
+    for index, (name, value) in enumerate(attributes.items()):
+        set_clauses.append(f'#a{index} = :a{index}')
+        names[f'#a{index}'] = name
+        values[f':a{index}'] = value
+    return set_clauses, names, values
+
+
+def _update_metadata_with_retry(region, uploaded_at, video_id, attributes):
+    """Apply a status write to the metadata item; publishes an upload session's deferred hashtags once playable."""
+    status = attributes['compressionStatus']
+    set_clauses, names, values = _set_clauses({**attributes, **playable_status_attributes(status)})
+    for attempt in range(STATUS_UPDATE_MAX_ATTEMPTS):
+        try:
+            response = metadata_table.update_item(
+                Key={'region': region, 'uploadedAt': uploaded_at},
+                UpdateExpression='SET ' + ', '.join(set_clauses),
+                # Never create a partial metadata item for a deleted/unknown key, and
+                # never replace a status that is already further along
+                ConditionExpression='attribute_exists(videoId) AND '
+                                    '(attribute_not_exists(statusRank) OR statusRank < :rank)',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={**values, ':rank': attributes['statusRank']},
+                ReturnValues='ALL_OLD',
+            )
+            break
+        except metadata_table.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.warning("Metadata item for %s is gone or already past %s, skipping status update",
+                           video_id, attributes['compressionStatus'])
+            return
+        except Exception as e:
+            if attempt == STATUS_UPDATE_MAX_ATTEMPTS - 1:
+                raise
+            logger.warning("Metadata update for %s failed (attempt %d), retrying: %s", video_id, attempt + 1, e)
+            time.sleep(STATUS_UPDATE_BASE_BACKOFF_SECONDS * (2 ** attempt))
+    publish_deferred_hashtags(response.get('Attributes', {}), status)
+
+
 def list_tmp_directory():
     logger.debug("Contents of %s:", TEMP_DIR)
     for root, dirs, files in os.walk(TEMP_DIR):
@@ -60,74 +235,998 @@ def list_tmp_directory():
             logger.debug("Directory: %s", os.path.join(root, name))
 
 def lambda_handler(event, context):
-    for record in event["Records"]:
-        download_path = None
-        compressed_path = None
-        try:
-            source_bucket = record["s3"]["bucket"]["name"]
-            object_key = record["s3"]["object"]["key"]
-            logger.info("Processing file %s from bucket %s", object_key, source_bucket)
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
 
-            if not VALID_KEY_PATTERN.match(object_key):
-                raise ValueError(f"Rejecting invalid object key: {object_key!r}")
+    records = event["Records"]
+    if CONCURRENT_RECORDS > 1 and len(records) > 1:
+        process_records_concurrently(records)
+        return
 
-            list_tmp_directory()
+    for record in records:
+        process_record(record)
 
-            # UUID-only local filenames — object_key never touches local paths
-            download_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}.mp4")
-            s3_client.download_file(source_bucket, object_key, download_path)
-            logger.info("Downloaded %s to %s", object_key, download_path)
 
-            list_tmp_directory()
-
-            compressed_path = os.path.join(TEMP_DIR, f"compressed_{uuid.uuid4()}.mp4")
-            compress_video(download_path, compressed_path)
+def process_record(record, tmp_budget=None):
+    object_key = None
+    reserved = 0
+    ready = False  # once READY is recorded, later cleanup errors must not mark the video FAILED
+    try:
+        source_bucket = record["s3"]["bucket"]["name"]
+        object_key = record["s3"]["object"]["key"]
+        logger.info("Processing file %s from bucket %s", object_key, source_bucket)
 
-            list_tmp_directory()
+        if not VALID_KEY_PATTERN.match(object_key):
+            raise ValueError(f"Rejecting invalid object key: {object_key!r}")
 
-            if not os.path.exists(compressed_path) or os.path.getsize(compressed_path) == 0:
-                raise Exception(f"Compression failed or output file is empty: {compressed_path}")
+        phash = None
+        if PERCEPTUAL_FINGERPRINT:
+            phash = compute_perceptual_hash(source_bucket, object_key)
+            duplicate_attributes = find_near_duplicate_rendition(phash) if NEAR_DUPLICATE_SHORT_CIRCUIT else None
+            if duplicate_attributes:
+                logger.info("Near-duplicate of %s, skipping transcode for %s",
+                            duplicate_attributes['compressedKey'], object_key)
+                update_compression_status(object_key, "READY", duplicate_attributes)
+                ready = True
+                s3_client.delete_object(Bucket=source_bucket, Key=object_key)
+                return
 
-            s3_client.upload_file(compressed_path, COMPRESSED_BUCKET, object_key, ExtraArgs={"ContentType": "video/mp4"})
-            logger.info("Uploaded compressed file to %s/%s", COMPRESSED_BUCKET, object_key)
+        if STREAMING_TRANSCODE and is_stream_friendly(source_bucket, object_key):
+            attributes, content_hash = stream_compress_video(
+                source_bucket, object_key, COMPRESSED_BUCKET, object_key, CONTENT_DEDUPE
+            )
+        else:
+            if tmp_budget:
+                reserved = tmp_budget.acquire(
+                    int(record["s3"]["object"].get("size", 0) * TMP_FOOTPRINT_MULTIPLIER)
+                )
+            attributes, content_hash = transcode_via_tmp(source_bucket, object_key, CONTENT_DEDUPE)
+            if attributes.get('compressedKey', object_key) != object_key:
+                logger.info("Duplicate of %s, skipped transcode for %s", attributes['compressedKey'], object_key)
+                update_compression_status(object_key, "READY", attributes)
+                ready = True
+                s3_client.delete_object(Bucket=source_bucket, Key=object_key)
+                return
 
-            update_compression_status(object_key, "READY")
+        if content_hash:
+            attributes['contentHash'] = content_hash
+        if phash is not None:
+            attributes['phash'] = f"{phash:016x}"
+        update_compression_status(object_key, "READY", attributes)
+        ready = True
+        if content_hash:
+            register_rendition(content_hash, object_key, attributes)
+        if phash is not None:
+            register_near_duplicate_rendition(phash, object_key, attributes)
 
-            s3_client.delete_object(Bucket=source_bucket, Key=object_key)
-            logger.info("Deleted original file from %s/%s", source_bucket, object_key)
+        s3_client.delete_object(Bucket=source_bucket, Key=object_key)
+        logger.info("Deleted original file from %s/%s", source_bucket, object_key)
 
-        except Exception as e:
-            logger.error("Error processing file %s: %s", object_key, e)
+    except Exception as e:
+        logger.error("Error processing file %s: %s", object_key, e)
+        if not ready:
             update_compression_status(object_key, "FAILED")
-            raise e
-        finally:
-            # Clean up /tmp files to prevent "No space left on device" on warm Lambda reuse
-            for path in [download_path, compressed_path]:
-                try:
-                    if path and os.path.exists(path):
-                        os.remove(path)
-                except Exception:
-                    pass
+        raise e
+    finally:
+        if tmp_budget and reserved:
+            tmp_budget.release(reserved)
+
+
+def download_with_content_hash(bucket, key, path):
+    """Stream the object to path, hashing it on the way; returns its SHA-256."""
+    digest = hashlib.sha256()
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    with open(path, 'wb') as f:
+        for chunk in body.iter_chunks(HASH_READ_CHUNK_BYTES):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicate_rendition(content_hash):
+    """
+    Metadata attributes pointing at an existing rendition of identical content, or
+    None. Index entries whose compressed object has since been deleted are ignored.
+    """
+    try:
+        item = content_hash_table.get_item(Key={'contentHash': content_hash}).get('Item')
+    except Exception as e:
+        logger.error("Content hash lookup failed for %s: %s", content_hash, e)
+        return None
+    if not item or not rendition_exists(item['compressedKey']):
+        return None
 
+    return {
+        **item.get('attributes', {}),
+        'compressedKey': item['compressedKey'],
+        'contentHash': content_hash,
+    }
 
-def compress_video(input_path, output_path):
-    """Compress to H.264/AAC with faststart for streaming."""
+
+def rendition_exists(compressed_key):
     try:
+        s3_client.head_object(Bucket=COMPRESSED_BUCKET, Key=compressed_key)
+        return True
+    except s3_client.exceptions.ClientError as e:
+        logger.info("Indexed rendition %s is gone: %s", compressed_key, e)
+        return False
+
+
+def register_rendition(content_hash, object_key, attributes):
+    """Index a freshly transcoded rendition by content hash (latest rendition wins)."""
+    try:
+        content_hash_table.put_item(Item={
+            'contentHash': content_hash,
+            'compressedKey': object_key,
+            'attributes': {k: v for k, v in attributes.items() if k != 'contentHash'},
+        })
+    except Exception as e:
+        logger.error("Failed to index content hash for %s: %s", object_key, e)
+
+
+def sample_fingerprint_frames(source_url, duration):
+    """
+    Seek out FINGERPRINT_FRAMES evenly spaced frames as raw 8-bit grayscale
+    thumbnails. Each seek is its own ffmpeg process doing ranged reads of the URL;
+    frames that time out or fail to decode are skipped.
+    """
+    frame_bytes = FINGERPRINT_FRAME_SIZE * FINGERPRINT_FRAME_SIZE
+
+    def grab_frame(index):
+        timestamp = duration * (index + 0.5) / FINGERPRINT_FRAMES
         command = [
-            "/opt/bin/ffmpeg",
-            "-y",
-            "-i", input_path,
-            "-c:v", "libx264",
-            "-crf", "25",
-            "-preset", "medium",  # 'slower' is too expensive for Lambda
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-movflags", "+faststart",
-            output_path
+            FFMPEG_BIN, "-v", "error", "-ss", f"{timestamp:.3f}", "-i", source_url,
+            "-frames:v", "1",
+            "-vf", f"scale={FINGERPRINT_FRAME_SIZE}:{FINGERPRINT_FRAME_SIZE},format=gray",
+            "-f", "rawvideo", "pipe:1",
         ]
+        try:
+            result = subprocess.run(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                timeout=PROBE_TIMEOUT_SECONDS,
+            )
+        except (subprocess.TimeoutExpired, OSError) as e:
+            logger.warning("Skipping fingerprint frame at %.3fs: %s", timestamp, e)
+            return None
+        return result.stdout if len(result.stdout) == frame_bytes else None
+
+    with ThreadPoolExecutor(max_workers=FINGERPRINT_FRAMES) as executor:
+        frames = list(executor.map(grab_frame, range(FINGERPRINT_FRAMES)))
+    return [frame for frame in frames if frame]
+
+
+def compute_perceptual_hash(bucket, key):
+    """
+    64-bit perceptual hash of the staged object, or None if it can't be computed.
+    Fingerprinting is optional: any failure here only means no fingerprint.
+    """
+    try:
+        from video_fingerprint import video_phash
+
+        source_url = s3_client.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=300
+        )
+        probe = probe_video(source_url)
+        duration = float((probe or {}).get('format', {}).get('duration') or 0)
+        frames = sample_fingerprint_frames(source_url, duration) if duration > 0 else []
+        if not frames:
+            logger.warning("No frames sampled for fingerprinting %s", key)
+            return None
+        return video_phash(frames)
+    except Exception as e:
+        logger.error("Fingerprinting failed for %s: %s", key, e)
+        return None
+
+
+def find_near_duplicate_rendition(phash):
+    """Metadata attributes reusing the closest near-duplicate rendition, or None."""
+    if phash is None:
+        return None
+
+    try:
+        from video_fingerprint import find_near_duplicates
+
+        for match in find_near_duplicates(phash):
+            if rendition_exists(match['compressedKey']):
+                return {
+                    **match['attributes'],
+                    'compressedKey': match['compressedKey'],
+                    'phash': f"{phash:016x}",
+                    'nearDuplicateOf': match['videoId'],
+                }
+    except Exception as e:
+        logger.error("Near-duplicate lookup failed: %s", e)
+    return None
+
+
+def register_near_duplicate_rendition(phash, object_key, attributes):
+    try:
+        from video_fingerprint import register_fingerprint
+
+        register_fingerprint(
+            object_key, phash, object_key,
+            {k: v for k, v in attributes.items() if k not in ('contentHash', 'phash')},
+        )
+    except Exception as e:
+        logger.error("Failed to index fingerprint for %s: %s", object_key, e)
+
+
+class TmpSpaceBudget:
+    """
+    Shared /tmp byte budget for concurrently processed records. A reservation larger
+    than the whole budget waits until nothing else is reserved, then runs alone.
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, requested_bytes):
+        requested_bytes = max(requested_bytes, 1)
+        with self._condition:
+            while self.reserved_bytes and self.reserved_bytes + requested_bytes > self.total_bytes:
+                self._condition.wait()
+            self.reserved_bytes += requested_bytes
+        return requested_bytes
+
+    def release(self, reserved_bytes):
+        with self._condition:
+            self.reserved_bytes -= reserved_bytes
+            self._condition.notify_all()
+
+
+def process_records_concurrently(records):
+    """Process records in parallel under a /tmp budget; re-raise the first failure after all finish."""
+    tmp_budget = TmpSpaceBudget(int(shutil.disk_usage(TEMP_DIR).free * TMP_BUDGET_FRACTION))
+    with ThreadPoolExecutor(max_workers=min(CONCURRENT_RECORDS, len(records))) as executor:
+        futures = [executor.submit(process_record, record, tmp_budget) for record in records]
+        errors = [future.exception() for future in futures]
+    failures = [error for error in errors if error]
+    if failures:
+        logger.error("%d of %d records failed", len(failures), len(records))
+        raise failures[0]
+
+
+def transcode_via_tmp(source_bucket, object_key, content_dedupe=False):
+    """
+    Download to /tmp, compress to a second /tmp file, upload the result.
+    Returns (attributes, content_hash): metadata attributes from any derived outputs
+    and, with content_dedupe, the SHA-256 computed during the download. If that hash
+    matches an existing rendition the transcode is skipped and the attributes point
+    at it (compressedKey).
+    """
+    content_hash = None
+    download_path = None
+    compressed_path = None
+    work_dir = os.path.join(TEMP_DIR, f"work_{uuid.uuid4()}")
+    try:
+        list_tmp_directory()
+
+        # UUID-only local filenames — object_key never touches local paths
+        download_path = os.path.join(TEMP_DIR, f"{uuid.uuid4()}.mp4")
+        if content_dedupe:
+            content_hash = download_with_content_hash(source_bucket, object_key, download_path)
+            duplicate_attributes = find_duplicate_rendition(content_hash)
+            if duplicate_attributes:
+                return duplicate_attributes, content_hash
+        else:
+            s3_client.download_file(source_bucket, object_key, download_path)
+        logger.info("Downloaded %s to %s", object_key, download_path)
+
+        list_tmp_directory()
+
+        probe = probe_video(download_path)
+        if TWO_PHASE_TRANSCODE and not is_remux_eligible(probe):
+            publish_preview(download_path, object_key)
+
+        extra_outputs = derived_outputs(probe, work_dir)
+
+        compressed_path = os.path.join(TEMP_DIR, f"compressed_{uuid.uuid4()}.mp4")
+        if should_chunk_encode(probe):
+            stats = chunked_compress_video(download_path, compressed_path, probe, work_dir, extra_outputs)
+        else:
+            stats = compress_video(download_path, compressed_path, probe, extra_outputs)
+        log_encode_stats(object_key, stats)
+
+        list_tmp_directory()
+
+        if not os.path.exists(compressed_path) or os.path.getsize(compressed_path) == 0:
+            raise Exception(f"Compression failed or output file is empty: {compressed_path}")
+
+        s3_client.upload_file(compressed_path, COMPRESSED_BUCKET, object_key, ExtraArgs={"ContentType": "video/mp4"})
+        logger.info("Uploaded compressed file to %s/%s", COMPRESSED_BUCKET, object_key)
+
+        return publish_derived_outputs(extra_outputs, object_key), content_hash
+    finally:
+        # Clean up /tmp files to prevent "No space left on device" on warm Lambda reuse
+        for path in [download_path, compressed_path]:
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except Exception:
+                pass
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def probe_video(source):
+    """
+    ffprobe a local path or URL. Returns {'video', 'audio', 'format'} with the first
+    video/audio stream dicts (None if absent), or None if probing fails.
+    """
+    command = [
+        FFPROBE_BIN, "-v", "error", "-print_format", "json",
+        "-show_streams", "-show_format", source,
+    ]
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            check=True, timeout=PROBE_TIMEOUT_SECONDS,
+        )
+        data = json.loads(result.stdout)
+    except (subprocess.SubprocessError, ValueError, OSError) as e:
+        logger.warning("ffprobe failed, falling back to default encode: %s", e)
+        return None
+
+    streams = data.get('streams', [])
+    return {
+        'video': next((
+            stream for stream in streams
+            if stream.get('codec_type') == 'video'
+            and not stream.get('disposition', {}).get('attached_pic')
+        ), None),
+        'audio': next((stream for stream in streams if stream.get('codec_type') == 'audio'), None),
+        'format': data.get('format', {}),
+    }
+
+
+def _probe_int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _probe_fps(video):
+    num, _, den = (video.get('avg_frame_rate') or '0/1').partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _display_dimensions(video):
+    """(width, height) as displayed, swapping coded dimensions for ±90° rotation."""
+    width, height = _probe_int(video.get('width')), _probe_int(video.get('height'))
+    rotation = _probe_int((video.get('tags') or {}).get('rotate'))
+    for side_data in video.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            rotation = _probe_int(side_data['rotation'])
+    if abs(rotation) % 180 == 90:
+        return height, width
+    return width, height
+
+
+def _video_bitrate(probe):
+    """Video stream bitrate, else the container bitrate as an upper bound."""
+    return _probe_int(probe['video'].get('bit_rate')) or _probe_int(probe['format'].get('bit_rate'))
+
+
+def is_remux_eligible(probe):
+    """True if the source is H.264/AAC within resolution, frame-rate and bitrate policy."""
+    if not probe or not probe['video']:
+        return False
+    video, audio = probe['video'], probe['audio']
+    width, height = _probe_int(video.get('width')), _probe_int(video.get('height'))
+    bitrate = _video_bitrate(probe)
+    return (
+        video.get('codec_name') in REMUX_VIDEO_CODECS
+        and video.get('pix_fmt') in REMUX_PIX_FMTS
+        and 0 < max(width, height) <= MAX_OUTPUT_LONG_SIDE
+        and _probe_fps(video) <= MAX_OUTPUT_FPS + 0.5
+        and 0 < bitrate <= REMUX_MAX_VIDEO_BITRATE
+        and (audio is None or audio.get('codec_name') in REMUX_AUDIO_CODECS)
+    )
+
+
+def encoder_args(probe=None):
+    """
+    ffmpeg codec arguments. Without a probe this is the fixed H.264/AAC policy;
+    with one, scaling, frame rate, preset and audio handling follow the source.
+    """
+    return video_encoder_args(probe) + audio_encoder_args(probe)
+
+
+def video_encoder_args(probe=None):
+    args = ["-c:v", "libx264", "-crf", ENCODE_CRF]
+    if ENCODE_THREADS > 0:
+        args += ["-threads", str(ENCODE_THREADS)]
+    preset = ENCODE_PRESET
+
+    video = probe['video'] if probe else None
+    if video:
+        # ffmpeg autorotates before the filter graph, so orient by the displayed size
+        width, height = _display_dimensions(video)
+        if max(width, height) > MAX_OUTPUT_LONG_SIDE:
+            scale = f"scale={MAX_OUTPUT_LONG_SIDE}:-2" if width >= height else f"scale=-2:{MAX_OUTPUT_LONG_SIDE}"
+            args += ["-vf", scale]
+        if _probe_fps(video) > MAX_OUTPUT_FPS + 0.5:
+            args += ["-r", str(MAX_OUTPUT_FPS)]
+        if video.get('pix_fmt') not in REMUX_PIX_FMTS:
+            args += ["-pix_fmt", "yuv420p"]  # 10-bit HDR (iPhone HEVC) isn't universally decodable
+
+        duration = float(_probe_int(probe['format'].get('duration')))
+        if width * height * duration > FAST_PRESET_PIXEL_SECONDS and preset == "medium":
+            preset = "fast"
+
+    return args + ["-preset", preset]
+
+
+def audio_encoder_args(probe=None):
+    audio = probe['audio'] if probe else None
+    if probe and audio is None:
+        return ["-an"]
+    if (audio and audio.get('codec_name') in REMUX_AUDIO_CODECS
+            and 0 < _probe_int(audio.get('bit_rate')) <= AUDIO_COPY_MAX_BITRATE):
+        return ["-c:a", "copy"]
+    return ["-c:a", "aac", "-b:a", "128k"]
+
+
+def transcode_args(probe):
+    """Stream copy for policy-compliant sources, otherwise a source-tuned encode."""
+    if is_remux_eligible(probe):
+        logger.info("Source within policy, remuxing without re-encode")
+        return ["-c", "copy"]
+    return encoder_args(probe)
+
+
+def build_ffmpeg_command(input_source, output_args, output_target, extra_outputs=()):
+    """
+    One ffmpeg invocation: the main video output plus any derived outputs, all fed
+    from a single decode of input_source. Derived outputs contribute -filter_complex
+    chains (reading [0:v]) and their own output arguments. With no output_target
+    only the derived outputs are written.
+    """
+    command = [FFMPEG_BIN, "-y", "-benchmark", "-i", input_source]
+    filters = [output['filter'] for output in extra_outputs if output.get('filter')]
+    if filters:
+        command += ["-filter_complex", ";".join(filters)]
+    if output_target:
+        command += ["-map", "0:v:0", "-map", "0:a:0?", *output_args, output_target]
+    for output in extra_outputs:
+        command += output['args']
+    return command
+
+
+def compress_video(input_path, output_path, probe=None, extra_outputs=()):
+    """Remux or compress to H.264/AAC with faststart for streaming. Returns encode stats."""
+    if probe is None:
+        probe = probe_video(input_path)
+    args = transcode_args(probe)
+    try:
+        command = build_ffmpeg_command(
+            input_path,
+            [*args, "-movflags", "+faststart"],
+            output_path,
+            extra_outputs,
+        )
         logger.info("Running command: %s", ' '.join(command))
-        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        started = time.monotonic()
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
         logger.info("Video compression complete: %s", output_path)
     except subprocess.CalledProcessError as e:
         logger.error("FFmpeg compression failed: %s", e.stderr.decode())
-        raise e
\ No newline at end of file
+        raise e
+    return encode_stats(
+        probe, args, time.monotonic() - started, os.path.getsize(output_path), [result.stderr]
+    )
+
+
+def encode_stats(probe, args, elapsed_seconds, output_bytes, ffmpeg_stderrs=(), mode=None):
+    """
+    Per-job encode metrics: encode fps, real-time factor, output size and the
+    ffmpeg -benchmark CPU time / peak RSS (the largest process, for multi-process
+    jobs). Logged by log_encode_stats and reported by the benchmark suite.
+    """
+    video = (probe or {}).get('video') or {}
+    duration = float(((probe or {}).get('format') or {}).get('duration') or 0)
+    cpu_seconds, peak_rss_kb = 0.0, 0
+    for stderr in ffmpeg_stderrs:
+        for utime, stime, maxrss in FFMPEG_BENCH_PATTERN.findall((stderr or b'').decode(errors='replace')):
+            if utime:
+                cpu_seconds += float(utime) + float(stime)
+            if maxrss:
+                peak_rss_kb = max(peak_rss_kb, int(maxrss))
+
+    def arg_value(flag):
+        return args[args.index(flag) + 1] if flag in args else None
+
+    return {
+        'mode': mode or ('remux' if args == ["-c", "copy"] else 'encode'),
+        'preset': arg_value("-preset"),
+        'crf': arg_value("-crf"),
+        'threads': arg_value("-threads") or 'auto',
+        'sourceWidth': _probe_int(video.get('width')),
+        'sourceHeight': _probe_int(video.get('height')),
+        'durationSeconds': round(duration, 3),
+        'elapsedSeconds': round(elapsed_seconds, 3),
+        'encodeFps': round(duration * _probe_fps(video) / elapsed_seconds, 2) if elapsed_seconds else None,
+        'realTimeFactor': round(duration / elapsed_seconds, 3) if elapsed_seconds else None,
+        'outputBytes': output_bytes,
+        'cpuSeconds': round(cpu_seconds, 3),
+        'peakRssKb': peak_rss_kb or None,
+    }
+
+
+def log_encode_stats(object_key, stats):
+    """One structured log line per job, so preset and memory-size changes can be compared."""
+    logger.info("encode_stats %s", json.dumps({
+        'objectKey': object_key,
+        'lambdaMemoryMb': os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE'),
+        **stats,
+    }))
+
+
+def publish_preview(input_source, object_key):
+    """
+    Phase one of a two-phase transcode: encode a low-res proxy, upload it under
+    the final key and mark the video PREVIEW_READY. Failures are logged and
+    swallowed — the full-quality phase still runs.
+    """
+    preview_path = os.path.join(TEMP_DIR, f"preview_{uuid.uuid4()}.mp4")
+    try:
+        command = build_ffmpeg_command(
+            input_source,
+            [
+                "-vf", f"scale=w='if(gt(iw,ih),-2,{PREVIEW_SHORT_SIDE})':h='if(gt(iw,ih),{PREVIEW_SHORT_SIDE},-2)'",
+                "-c:v", "libx264", "-preset", "ultrafast", "-crf", "30", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "64k",
+                "-movflags", "+faststart",
+            ],
+            preview_path,
+        )
+        logger.info("Running preview command: %s", ' '.join(command))
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+        s3_client.upload_file(preview_path, COMPRESSED_BUCKET, object_key, ExtraArgs={"ContentType": "video/mp4"})
+        update_compression_status(object_key, PREVIEW_READY_STATUS)
+        logger.info("Published preview rendition for %s", object_key)
+    except Exception as e:
+        stderr = getattr(e, 'stderr', None)
+        logger.warning("Preview phase failed for %s, continuing with full encode: %s %s",
+                       object_key, e, stderr.decode(errors='replace') if stderr else '')
+    finally:
+        if os.path.exists(preview_path):
+            os.remove(preview_path)
+
+
+# ---------------------------------------------------------------------------
+# Chunked parallel encoding
+# ---------------------------------------------------------------------------
+
+def should_chunk_encode(probe):
+    if not CHUNKED_ENCODE or CHUNK_WORKERS < 2 or not probe or not probe['video']:
+        return False
+    if is_remux_eligible(probe):
+        return False
+    return float(_probe_int(probe['format'].get('duration'))) >= CHUNKED_MIN_DURATION_SECONDS
+
+
+def _run_ffmpeg(command, description):
+    """Run ffmpeg, returning its stderr (carries -benchmark stats when requested)."""
+    logger.info("Running %s command: %s", description, ' '.join(command))
+    try:
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stderr
+    except subprocess.CalledProcessError as e:
+        logger.error("FFmpeg %s failed: %s", description, e.stderr.decode(errors='replace'))
+        raise
+
+
+def chunked_compress_video(input_path, output_path, probe, work_dir, extra_outputs=()):
+    """
+    Split the video at keyframes, encode the chunks with CHUNK_WORKERS parallel
+    ffmpeg processes, then concatenate them losslessly with the separately encoded
+    audio. Derived outputs need a decode of their own here, so they run as one
+    more job in the same pool. Returns encode stats.
+    """
+    started = time.monotonic()
+    chunk_dir = os.path.join(work_dir, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # 1. Keyframe-aligned split (stream copy — no decode)
+    _run_ffmpeg([
+        FFMPEG_BIN, "-y", "-i", input_path,
+        "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_time", str(CHUNK_SECONDS),
+        "-segment_format", "mp4", "-reset_timestamps", "1",
+        os.path.join(chunk_dir, "src_%04d.mp4"),
+    ], "chunk split")
+    sources = sorted(name for name in os.listdir(chunk_dir) if name.startswith("src_"))
+    if not sources:
+        raise Exception(f"Chunk split produced no segments for {input_path}")
+
+    threads_per_chunk = max(1, (os.cpu_count() or 1) // CHUNK_WORKERS)
+    video_args = video_encoder_args(probe)
+    audio_path = os.path.join(work_dir, "audio.m4a")
+    has_audio = probe['audio'] is not None
+
+    def encode_chunk(name):
+        encoded = os.path.join(chunk_dir, name.replace("src_", "enc_"))
+        stderr = _run_ffmpeg([
+            FFMPEG_BIN, "-y", "-benchmark", "-i", os.path.join(chunk_dir, name),
+            *video_args, "-threads", str(threads_per_chunk), "-an", encoded,
+        ], f"chunk encode {name}")
+        return encoded, stderr
+
+    # 2. Encode chunks (and audio, and any derived outputs) in parallel
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+        futures = [executor.submit(encode_chunk, name) for name in sources]
+        side_jobs = []
+        if has_audio:
+            side_jobs.append(executor.submit(_run_ffmpeg, [
+                FFMPEG_BIN, "-y", "-i", input_path, "-map", "0:a:0", "-vn",
+                *audio_encoder_args(probe), audio_path,
+            ], "audio encode"))
+        if extra_outputs:
+            side_jobs.append(executor.submit(
+                _run_ffmpeg, build_ffmpeg_command(input_path, [], None, extra_outputs), "derived outputs"
+            ))
+        encoded_chunks, chunk_stderrs = zip(*(future.result() for future in futures))
+        for job in side_jobs:
+            job.result()
+
+    # 3. Lossless concat
+    list_path = os.path.join(chunk_dir, "concat.txt")
+    with open(list_path, "w") as f:
+        f.writelines(f"file '{path}'\n" for path in encoded_chunks)
+
+    command = [FFMPEG_BIN, "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if has_audio:
+        command += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+    command += ["-c", "copy", "-movflags", "+faststart", output_path]
+    _run_ffmpeg(command, "chunk concat")
+    logger.info("Chunked compression complete: %d chunks, %d workers", len(encoded_chunks), CHUNK_WORKERS)
+    return encode_stats(
+        probe, video_args, time.monotonic() - started, os.path.getsize(output_path),
+        chunk_stderrs, mode='chunked',
+    )
+
+
+# ---------------------------------------------------------------------------
+# Streaming S3 → ffmpeg → S3
+# ---------------------------------------------------------------------------
+
+def is_stream_friendly(bucket, key):
+    """
+    True if ffmpeg can demux the object from a pipe: WebM always can; MP4/MOV only
+    when the moov atom precedes mdat. Walks the top-level ISO-BMFF boxes in the
+    first MP4_HEADER_PROBE_BYTES (one ranged GET).
+    """
+    if key.lower().endswith('.webm'):
+        return True
+
+    head = s3_client.get_object(
+        Bucket=bucket, Key=key, Range=f"bytes=0-{MP4_HEADER_PROBE_BYTES - 1}"
+    )['Body'].read()
+
+    offset = 0
+    while offset + 8 <= len(head):
+        box_size = int.from_bytes(head[offset:offset + 4], 'big')
+        box_type = head[offset + 4:offset + 8]
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if box_size == 1 and offset + 16 <= len(head):
+            box_size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if box_size < 8:
+            return False  # box runs to EOF or is malformed
+        offset += box_size
+    return False  # moov/mdat order not visible in the probe window
+
+
+def stream_compress_video(source_bucket, source_key, dest_bucket, dest_key, hash_source=False):
+    """
+    Pipe the source object through ffmpeg (remuxing when the probe allows) and
+    multipart-upload the fragmented MP4 output as it is produced. Download, encode
+    and upload run concurrently; the multipart upload is aborted on any failure.
+    Derived outputs are written to /tmp by the same process. Returns (attributes,
+    content_hash): their metadata attributes and, with hash_source, the
+    source's SHA-256 computed as it is fed to ffmpeg.
+    """
+    # ffprobe reads the source over a short-lived presigned URL (ranged reads, no download)
+    source_url = s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': source_bucket, 'Key': source_key}, ExpiresIn=300
+    )
+    probe = probe_video(source_url)
+    if TWO_PHASE_TRANSCODE and not is_remux_eligible(probe):
+        publish_preview(source_url, dest_key)
+
+    work_dir = os.path.join(TEMP_DIR, f"work_{uuid.uuid4()}")
+    extra_outputs = derived_outputs(probe, work_dir)
+    args = transcode_args(probe)
+    command = build_ffmpeg_command(
+        "pipe:0",
+        [
+            *args,
+            # Fragmented MP4 — the moov is written first, so output can be streamed
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4",
+        ],
+        "pipe:1",
+        extra_outputs,
+    )
+    logger.info("Running streaming command: %s", ' '.join(command))
+
+    started = time.monotonic()
+    output_bytes = 0
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        # Started only once ffmpeg is running, so a failed spawn leaves no upload behind
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=dest_bucket, Key=dest_key, ContentType="video/mp4"
+        )['UploadId']
+    except Exception:
+        process.kill()
+        raise
+    stderr_chunks = []
+    feed_errors = []
+    digest = hashlib.sha256() if hash_source else None
+
+    def feed_stdin():
+        try:
+            body = s3_client.get_object(Bucket=source_bucket, Key=source_key)['Body']
+            for chunk in body.iter_chunks(STREAM_READ_CHUNK_BYTES):
+                if digest:
+                    digest.update(chunk)
+                process.stdin.write(chunk)
+        except Exception as e:  # BrokenPipe if ffmpeg exits early; surfaced via its return code
+            feed_errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+
+    def drain_stderr():
+        stderr_chunks.append(process.stderr.read())
+
+    feeder = threading.Thread(target=feed_stdin, daemon=True)
+    stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    feeder.start()
+    stderr_reader.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=MULTIPART_UPLOAD_CONCURRENCY) as executor:
+            # Bounded in-flight parts keep memory at ~concurrency × part size
+            in_flight = threading.BoundedSemaphore(MULTIPART_UPLOAD_CONCURRENCY * 2)
+            futures = []
+            part_number = 0
+            while True:
+                data = process.stdout.read(MULTIPART_PART_SIZE_BYTES)
+                if not data:
+                    break
+                part_number += 1
+                output_bytes += len(data)
+                in_flight.acquire()
+                futures.append(executor.submit(
+                    _upload_part, dest_bucket, dest_key, upload_id, part_number, data, in_flight
+                ))
+            parts = [future.result() for future in futures]
+
+        return_code = process.wait()
+        feeder.join()
+        stderr_reader.join()
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, command, stderr=b''.join(stderr_chunks))
+        if feed_errors:
+            raise feed_errors[0]
+        if not parts:
+            raise Exception(f"Streaming compression produced no output for {source_key}")
+
+        s3_client.complete_multipart_upload(
+            Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts},
+        )
+        logger.info("Streamed compressed file to %s/%s in %d parts", dest_bucket, dest_key, len(parts))
+        log_encode_stats(dest_key, encode_stats(
+            probe, args, time.monotonic() - started, output_bytes,
+            stderr_chunks, mode='stream',
+        ))
+
+        return publish_derived_outputs(extra_outputs, dest_key), digest.hexdigest() if digest else None
+    except Exception as e:
+        if isinstance(e, subprocess.CalledProcessError):
+            logger.error("FFmpeg streaming compression failed: %s", (e.stderr or b'').decode(errors='replace'))
+        process.kill()
+        s3_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _upload_part(bucket, key, upload_id, part_number, data, in_flight):
+    try:
+        response = s3_client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+    finally:
+        in_flight.release()
+
+
+# ---------------------------------------------------------------------------
+# Derived outputs (written by the same ffmpeg process as the main video)
+# ---------------------------------------------------------------------------
+
+def derived_outputs(probe, work_dir):
+    """
+    Extra outputs for this source. Each is a dict with an optional 'filter'
+    (-filter_complex chain), output 'args', and 'publish', a callable taking the
+    object key that uploads the files and returns metadata attributes.
+    """
+    outputs = []
+    if DERIVED_ASSETS:
+        assets = asset_outputs(probe, os.path.join(work_dir, "assets"))
+        if assets:
+            outputs.append(assets)
+    if HLS_PACKAGING:
+        hls = hls_output(probe, os.path.join(work_dir, "hls"))
+        if hls:
+            outputs.append(hls)
+    return outputs
+
+
+def publish_derived_outputs(extra_outputs, object_key):
+    attributes = {}
+    for output in extra_outputs:
+        attributes.update(output['publish'](object_key))
+    return attributes
+
+
+def asset_outputs(probe, assets_dir):
+    """
+    Poster frame (most representative of the opening frames) and a
+    SPRITE_COLUMNS × SPRITE_ROWS scrub sprite sampled evenly across the video,
+    plus duration/resolution attributes. None if the source can't be probed.
+    """
+    if not probe or not probe['video']:
+        logger.warning("Skipping derived assets: source could not be probed")
+        return None
+
+    width, height = _display_dimensions(probe['video'])
+    duration = float(probe['format'].get('duration') or 0)
+    frame_count = SPRITE_COLUMNS * SPRITE_ROWS
+    interval = max(duration / frame_count, 0.1) if duration else 1.0
+
+    poster_name = f"poster.{POSTER_FORMAT}"
+    poster_codec = ["-c:v", "libwebp", "-quality", "80"] if POSTER_FORMAT == 'webp' else ["-q:v", "3"]
+    chains = [
+        f"[0:v]thumbnail=30,scale=w='if(gt(iw,ih),-2,{POSTER_SHORT_SIDE})':h='if(gt(iw,ih),{POSTER_SHORT_SIDE},-2)'[poster]",
+        f"[0:v]fps=1/{interval:.3f},scale={SPRITE_TILE_WIDTH}:-2,tile={SPRITE_COLUMNS}x{SPRITE_ROWS}[sprite]",
+    ]
+    args = [
+        "-map", "[poster]", "-frames:v", "1", *poster_codec, os.path.join(assets_dir, poster_name),
+        "-map", "[sprite]", "-frames:v", "1", "-q:v", "4", os.path.join(assets_dir, "sprite.jpg"),
+    ]
+    os.makedirs(assets_dir, exist_ok=True)
+
+    def publish(object_key):
+        prefix = f"{ASSETS_PREFIX}/{object_key}"
+        upload_directory(assets_dir, COMPRESSED_BUCKET, prefix, ASSET_CONTENT_TYPES)
+        attributes = {
+            'posterKey': f"{prefix}/{poster_name}",
+            'spriteSheet': {
+                'key': f"{prefix}/sprite.jpg",
+                'columns': SPRITE_COLUMNS,
+                'rows': SPRITE_ROWS,
+                'tileWidth': SPRITE_TILE_WIDTH,
+                'intervalSeconds': Decimal(f"{interval:.3f}"),
+            },
+            'videoWidth': width,
+            'videoHeight': height,
+        }
+        if duration:
+            attributes['durationSeconds'] = Decimal(f"{duration:.3f}")
+        return attributes
+
+    return {'filter': ";".join(chains), 'args': args, 'publish': publish}
+
+
+def hls_output(probe, hls_dir):
+    """HLS ladder from one split of the decoded video; None if the source can't be probed."""
+    if not probe or not probe['video']:
+        logger.warning("Skipping HLS packaging: source could not be probed")
+        return None
+
+    video = probe['video']
+    short_side = min(_probe_int(video.get('width')), _probe_int(video.get('height')))
+    rungs = [rung for rung in HLS_LADDER if rung[0] <= short_side] or HLS_LADDER[:1]
+    has_audio = probe['audio'] is not None
+
+    # Orientation-agnostic: the short side becomes the rung height (or width, for portrait)
+    chains = [f"[0:v]split={len(rungs)}" + "".join(f"[hls{i}]" for i in range(len(rungs)))]
+    args = []
+    stream_map = []
+    for i, (rung_short_side, bitrate) in enumerate(rungs):
+        chains.append(
+            f"[hls{i}]scale=w='if(gt(iw,ih),-2,{rung_short_side})':h='if(gt(iw,ih),{rung_short_side},-2)'[hls{i}out]"
+        )
+        args += [
+            "-map", f"[hls{i}out]",
+            f"-c:v:{i}", "libx264",
+            f"-b:v:{i}", str(bitrate),
+            f"-maxrate:v:{i}", str(int(bitrate * 1.2)),
+            f"-bufsize:v:{i}", str(bitrate * 2),
+        ]
+        if has_audio:
+            args += ["-map", "0:a:0"]
+            stream_map.append(f"v:{i},a:{i}")
+        else:
+            stream_map.append(f"v:{i}")
+
+    if has_audio:
+        args += ["-c:a", "aac", "-b:a", str(HLS_AUDIO_BITRATE)]
+    args += [
+        "-preset", "veryfast",
+        # Aligned keyframes at segment boundaries so renditions switch cleanly
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-sc_threshold", "0",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(hls_dir, "v%v", "seg_%03d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(hls_dir, "v%v", "index.m3u8"),
+    ]
+    os.makedirs(hls_dir, exist_ok=True)
+
+    def publish(object_key):
+        prefix = f"{HLS_PREFIX}/{object_key}"
+        upload_directory(hls_dir, COMPRESSED_BUCKET, prefix, HLS_CONTENT_TYPES)
+        return {'hls': {
+            'masterKey': f"{prefix}/master.m3u8",
+            'segmentSeconds': HLS_SEGMENT_SECONDS,
+            'renditions': [
+                {
+                    'shortSide': rung_short_side,
+                    'bandwidth': bitrate + (HLS_AUDIO_BITRATE if has_audio else 0),
+                    'playlistKey': f"{prefix}/v{i}/index.m3u8",
+                }
+                for i, (rung_short_side, bitrate) in enumerate(rungs)
+            ],
+        }}
+
+    return {'filter': ";".join(chains), 'args': args, 'publish': publish}
+
+
+def upload_directory(local_dir, bucket, prefix, content_types):
+    """Upload every file under local_dir to bucket/prefix/<relative path> in parallel."""
+    uploads = []
+    for root, _, files in os.walk(local_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            key = f"{prefix}/{os.path.relpath(path, local_dir).replace(os.sep, '/')}"
+            content_type = content_types.get(os.path.splitext(name)[1], 'application/octet-stream')
+            uploads.append((path, key, content_type))
+
+    with ThreadPoolExecutor(max_workers=MULTIPART_UPLOAD_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(s3_client.upload_file, path, bucket, key, ExtraArgs={"ContentType": content_type})
+            for path, key, content_type in uploads
+        ]
+        for future in futures:
+            future.result()
+    logger.info("Uploaded %d files to %s/%s", len(uploads), bucket, prefix)
+
+
+def _prime_ffmpeg():
+    """Page the ffmpeg/ffprobe binaries in from the layer."""
+    for binary in (FFMPEG_BIN, FFPROBE_BIN):
+        subprocess.run([binary, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+
+FUNCTION_NAME = 'up-s3-staged-to-compressed'
+WARMUP_PRIMERS = (_prime_ffmpeg,)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
@@ -1,10 +1,13 @@
-import boto3
+import heapq
 import json
 import logging
+import os
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
 from botocore.exceptions import ClientError
+import aws_clients
+from warmup import WARMUP_PROBE_KEY, handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -13,8 +16,34 @@ logger.setLevel(logging.INFO)
 # The entire request body must not exceed this limit (bytes).
 MAX_REQUEST_BODY_SIZE = 10 * 1024  # 10 KB — generous for preferences + feed metadata
 
-dynamodb = boto3.resource('dynamodb')
+CONFIDENCE_SCORES_KEY = 'hashtag_to_confidence_scores'
+CONFIDENCE_UPDATES_KEY = 'hashtag_to_confidence_updates'        # delta: absolute scores to SET
+CONFIDENCE_INCREMENTS_KEY = 'hashtag_to_confidence_increments'  # delta: amounts added to stored scores
+
+# Each delta hashtag becomes one nested-path clause; this keeps the
+# UpdateExpression comfortably under DynamoDB's 4 KB expression limit.
+MAX_DELTA_HASHTAGS = 100
+
+# Stored confidence maps are capped to the top-N hashtags per feed type, clamped to
+# ±MAX_CONFIDENCE_SCORE and optionally quantized (set CONFIDENCE_QUANTUM='' to store
+# full precision). Must match the compaction settings in up-generate-feed.
+MAX_CONFIDENCE_HASHTAGS = int(os.environ.get('MAX_CONFIDENCE_HASHTAGS', '200'))
+CONFIDENCE_QUANTUM = os.environ.get('CONFIDENCE_QUANTUM', '0.001')
+MAX_CONFIDENCE_SCORE = Decimal(os.environ.get('MAX_CONFIDENCE_SCORE', '1e9'))
+
+# Write coalescing: in 'coalesce' mode requests are queued on SQS and the consumer
+# (this function, via an event source mapping) merges every pending update per
+# user_id into one write per batching window. A 202 is only returned once the queue
+# has the message; without PROFILE_UPDATE_QUEUE_URL there is nowhere durable to
+# queue, so updates are written directly.
+PROFILE_WRITE_MODE = os.environ.get('PROFILE_WRITE_MODE', 'direct')  # 'direct' | 'coalesce'
+PROFILE_UPDATE_QUEUE_URL = os.environ.get('PROFILE_UPDATE_QUEUE_URL')
+
+dynamodb = aws_clients.resource('dynamodb')
 table = dynamodb.Table('up-user-profiles')
+sqs = aws_clients.client('sqs') if PROFILE_UPDATE_QUEUE_URL else None
+if PROFILE_WRITE_MODE == 'coalesce' and not sqs:
+    logger.warning("PROFILE_WRITE_MODE=coalesce without PROFILE_UPDATE_QUEUE_URL, writing profiles directly")
 
 
 class VideoFeedType(Enum):
@@ -23,21 +52,95 @@ class VideoFeedType(Enum):
 
 
 class VideoFeedTypeMetadata:
-    def __init__(self, hashtag_to_confidence_scores=None):
-        self.hashtag_to_confidence_scores = hashtag_to_confidence_scores or {}
+    """
+    Confidence scores for one feed type. A payload carries either the full
+    `hashtag_to_confidence_scores` map, which replaces the stored map, or a delta
+    of only the changed hashtags: `hashtag_to_confidence_updates` (scores to SET)
+    and/or `hashtag_to_confidence_increments` (amounts added to the stored score).
+    A feed type absent from the payload leaves the stored map untouched.
+    """
+
+    def __init__(self, hashtag_to_confidence_scores=None, score_updates=None, score_increments=None):
+        self.hashtag_to_confidence_scores = hashtag_to_confidence_scores
+        self.score_updates = score_updates or {}
+        self.score_increments = score_increments or {}
+
+    @property
+    def is_full(self):
+        return self.hashtag_to_confidence_scores is not None
+
+    @property
+    def is_delta(self):
+        return not self.is_full and bool(self.score_updates or self.score_increments)
 
     def to_dynamodb(self):
-        return {
-            k: Decimal(str(v))
-            for k, v in self.hashtag_to_confidence_scores.items()
-            if k.strip()
+        """Stored form of a full map: top MAX_CONFIDENCE_HASHTAGS scores, clamped and quantized."""
+        scores = {
+            tag: max(-MAX_CONFIDENCE_SCORE, min(score, MAX_CONFIDENCE_SCORE))
+            for tag, score in _to_decimal_scores(self.hashtag_to_confidence_scores or {}).items()
+        }
+        if len(scores) > MAX_CONFIDENCE_HASHTAGS:
+            scores = dict(heapq.nlargest(MAX_CONFIDENCE_HASHTAGS, scores.items(), key=lambda kv: kv[1]))
+        if CONFIDENCE_QUANTUM:
+            quantum = Decimal(CONFIDENCE_QUANTUM)
+            scores = {tag: score.quantize(quantum) for tag, score in scores.items()}
+        return scores
+
+    def merged_with(self, later):
+        """Combine this update with a later one for the same feed type."""
+        if later.is_full:
+            return later
+        if not later.is_delta:
+            return self
+
+        if self.is_full:
+            scores = _to_decimal_scores(self.hashtag_to_confidence_scores)
+            for tag, increment in later.score_increments.items():
+                scores[tag] = scores.get(tag, Decimal(0)) + increment
+            scores.update(later.score_updates)
+            return VideoFeedTypeMetadata(hashtag_to_confidence_scores=scores)
+
+        score_updates = {**self.score_updates, **later.score_updates}
+        # A later SET supersedes anything added before it
+        score_increments = {
+            tag: increment for tag, increment in self.score_increments.items()
+            if tag not in later.score_updates
         }
+        for tag, increment in later.score_increments.items():
+            if tag in score_updates:
+                score_updates[tag] += increment
+            else:
+                score_increments[tag] = score_increments.get(tag, Decimal(0)) + increment
+        return VideoFeedTypeMetadata(score_updates=score_updates, score_increments=score_increments)
 
     @classmethod
     def from_payload(cls, payload):
-        return cls(
-            hashtag_to_confidence_scores=payload.get('hashtag_to_confidence_scores', {})
-        )
+        if CONFIDENCE_SCORES_KEY in payload:
+            return cls(hashtag_to_confidence_scores=payload.get(CONFIDENCE_SCORES_KEY) or {})
+
+        score_updates = _to_decimal_scores(payload.get(CONFIDENCE_UPDATES_KEY) or {})
+        score_increments = _to_decimal_scores(payload.get(CONFIDENCE_INCREMENTS_KEY) or {})
+        # SET and SET-with-arithmetic on the same path in one expression is rejected
+        # by DynamoDB, so fold any increment for an updated hashtag into the update.
+        for tag in set(score_updates) & set(score_increments):
+            score_updates[tag] += score_increments.pop(tag)
+        return cls(score_updates=score_updates, score_increments=score_increments)
+
+
+def _to_decimal_scores(scores):
+    """Convert a {hashtag: number} map to Decimals, dropping empty keys. Raises ValueError."""
+    if not isinstance(scores, dict):
+        raise ValueError("confidence scores must be a map")
+    converted = {}
+    for tag, score in scores.items():
+        if not isinstance(tag, str) or not tag.strip():
+            continue
+        if isinstance(score, bool) or not isinstance(score, (int, float, Decimal)):
+            raise ValueError(f"confidence score for {tag!r} must be a number")
+        converted[tag] = Decimal(str(score))
+        if not converted[tag].is_finite():  # json.loads accepts NaN/Infinity
+            raise ValueError(f"confidence score for {tag!r} must be finite")
+    return converted
 
 
 class UserProfile:
@@ -67,12 +170,36 @@ class UserProfile:
         }
         logger.debug("Video feed metadata: %s", video_feed_metadata)
 
-        return cls(
+        user_profile = cls(
             user_id=user_id,
             video_feed_metadata=video_feed_metadata,
             preferences=payload.get('preferences', {}),
             last_login=payload.get('last_login')
         )
+        if user_profile.delta_hashtag_count() > MAX_DELTA_HASHTAGS:
+            raise ValueError(f"Delta payload exceeds {MAX_DELTA_HASHTAGS} hashtags")
+        return user_profile
+
+    def merged_with(self, later):
+        """Combine this update with a later one for the same user (later values win)."""
+        video_feed_metadata = {
+            feed_type: metadata.merged_with(later.video_feed_metadata.get(feed_type, VideoFeedTypeMetadata()))
+            for feed_type, metadata in self.video_feed_metadata.items()
+        }
+        last_logins = [ts for ts in (self.last_login, later.last_login) if ts]
+        return UserProfile(
+            user_id=self.user_id,
+            video_feed_metadata=video_feed_metadata,
+            # Each payload carries the whole preferences map, so the latest one wins
+            preferences=later.preferences or self.preferences,
+            last_login=max(last_logins) if last_logins else None,
+        )
+
+    def delta_hashtag_count(self):
+        return sum(
+            len(metadata.score_updates) + len(metadata.score_increments)
+            for metadata in self.video_feed_metadata.values()
+        )
 
     def validate(self):
         if not self.user_id:
@@ -80,36 +207,6 @@ class UserProfile:
         if not any(self.video_feed_metadata.values()) and not self.preferences and not self.last_login:
             raise ValueError("No valid data to update (e.g., video feed metadata, preferences, or last_login).")
 
-    def to_dynamodb_item(self):
-        item = {
-            'user_id': self.user_id,
-        }
-
-        for feed_type, metadata in self.video_feed_metadata.items():
-            item[feed_type] = metadata.to_dynamodb()
-
-        if self.preferences:
-            item['preferences'] = self.preferences
-
-        if self.last_login:
-            item['last_login'] = self.last_login
-
-        logger.debug("Item: %s", item)
-        return item
-
-
-def ensure_user_exists(user_profile):
-    """Create the profile if it doesn't already exist (conditional put)."""
-    logger.info("user_profile %s %s", user_profile.user_id, user_profile.video_feed_metadata)
-    try:
-        table.put_item(
-            Item=user_profile.to_dynamodb_item(),
-            ConditionExpression="attribute_not_exists(user_id)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
-            raise
-
 
 def sanitize_dynamodb_map(d):
     """Remove empty-string keys and convert floats to Decimal for DynamoDB."""
@@ -122,65 +219,226 @@ def sanitize_dynamodb_map(d):
     return d
 
 
-def update_user_profile(user_profile):
-    sanitized_focused_feed = sanitize_dynamodb_map({
-        "hashtag_to_confidence_scores": user_profile.video_feed_metadata["VIDEO_FOCUSED_FEED"].to_dynamodb()
-    })
+def build_profile_update(user_profile):
+    """
+    Build the single update_item call that upserts a profile.
+
+    Returns (update_expression, names, values, condition_expression). The condition
+    is None when the write needs no pre-existing structure (an upsert that creates
+    the item); delta writes to nested score paths require those maps to exist.
+    """
+    names = {"#last_login": "last_login"}
+    values = {":last_login": user_profile.last_login or datetime.utcnow().isoformat()}
+    set_clauses = ["#last_login = :last_login"]
+    conditions = []
+
+    if user_profile.preferences:
+        names["#prefs"] = "preferences"
+        values[":prefs"] = sanitize_dynamodb_map(user_profile.preferences)
+        set_clauses.append("#prefs = :prefs")
+
+    feeds = user_profile.video_feed_metadata
+    full_feeds = {t: m for t, m in feeds.items() if m.is_full}
+    delta_feeds = {t: m for t, m in feeds.items() if m.is_delta}
+
+    if full_feeds or delta_feeds:
+        names["#algorithm"] = "algorithm"
+
+    if len(full_feeds) == len(VideoFeedType):
+        # Every feed type replaced — write the whole algorithm map, no condition needed
+        values[":algorithm"] = {
+            feed_type: {CONFIDENCE_SCORES_KEY: metadata.to_dynamodb()}
+            for feed_type, metadata in full_feeds.items()
+        }
+        set_clauses.append("#algorithm = :algorithm")
+        return "SET " + ", ".join(set_clauses), names, values, None
+
+    if full_feeds:
+        conditions.append("attribute_exists(#algorithm)")
+
+    value_index = 0
+    for feed_index, (feed_type, metadata) in enumerate(list(full_feeds.items()) + list(delta_feeds.items())):
+        feed_name = f"#f{feed_index}"
+        names[feed_name] = feed_type
+
+        if metadata.is_full:
+            values[f":feed{feed_index}"] = {CONFIDENCE_SCORES_KEY: metadata.to_dynamodb()}
+            set_clauses.append(f"#algorithm.{feed_name} = :feed{feed_index}")
+            continue
+
+        names["#scores"] = CONFIDENCE_SCORES_KEY
+        scores_path = f"#algorithm.{feed_name}.#scores"
+        conditions.append(f"attribute_exists({scores_path})")
+
+        for tag, score in metadata.score_updates.items():
+            names[f"#h{value_index}"] = tag
+            values[f":v{value_index}"] = score
+            set_clauses.append(f"{scores_path}.#h{value_index} = :v{value_index}")
+            value_index += 1
+
+        for tag, increment in metadata.score_increments.items():
+            names[f"#h{value_index}"] = tag
+            values[f":v{value_index}"] = increment
+            values[":zero"] = Decimal(0)
+            path = f"{scores_path}.#h{value_index}"
+            set_clauses.append(f"{path} = if_not_exists({path}, :zero) + :v{value_index}")
+            value_index += 1
+
+    condition_expression = " AND ".join(conditions) if conditions else None
+    return "SET " + ", ".join(set_clauses), names, values, condition_expression
+
+
+def _initialize_algorithm(user_profile):
+    """
+    Create the algorithm map and per-feed score maps a conditional profile write
+    depends on. Only runs on a profile's first sync (or a legacy profile missing
+    a feed map), so the steady state stays at one write per request.
+    """
+    seed = {
+        feed_type.value: {CONFIDENCE_SCORES_KEY: {}}
+        for feed_type in VideoFeedType
+    }
+    response = table.update_item(
+        Key={"user_id": user_profile.user_id},
+        UpdateExpression="SET #algorithm = if_not_exists(#algorithm, :seed)",
+        ExpressionAttributeNames={"#algorithm": "algorithm"},
+        ExpressionAttributeValues={":seed": seed},
+        ReturnValues="UPDATED_OLD",
+    )
+    if "algorithm" not in response.get("Attributes", {}):
+        return  # freshly seeded with every feed map
+
+    # algorithm already existed, so one of its feed maps must be missing
+
+    names = {"#algorithm": "algorithm"}
+    values = {}
+    clauses = []
+    for index, feed_type in enumerate(VideoFeedType):
+        names[f"#f{index}"] = feed_type.value
+        values[f":feed{index}"] = seed[feed_type.value]
+        clauses.append(f"#algorithm.#f{index} = if_not_exists(#algorithm.#f{index}, :feed{index})")
+    table.update_item(
+        Key={"user_id": user_profile.user_id},
+        UpdateExpression="SET " + ", ".join(clauses),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
 
-    sanitized_audio_feed = sanitize_dynamodb_map({
-        "hashtag_to_confidence_scores": user_profile.video_feed_metadata["VIDEO_AUDIO_FEED"].to_dynamodb()
-    })
 
-    update_expression = (
-        "SET #prefs = :prefs, #last_login = :last_login, "
-        "#algorithm = if_not_exists(#algorithm, :empty_map)"
-    )
-    expression_attribute_values = {
-        ":prefs": sanitize_dynamodb_map(user_profile.preferences),
-        ":last_login": user_profile.last_login or datetime.utcnow().isoformat(),
-        ":empty_map": {},
-    }
-    expression_attribute_names = {
-        "#prefs": "preferences",
-        "#last_login": "last_login",
-        "#algorithm": "algorithm",
+def update_user_profile(user_profile):
+    """
+    Upsert the profile in one conditional write. If the write depends on score maps
+    that don't exist yet, initialize them once and retry the same write.
+    """
+    update_expression, names, values, condition_expression = build_profile_update(user_profile)
+    kwargs = {
+        "Key": {"user_id": user_profile.user_id},
+        "UpdateExpression": update_expression,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
     }
+    if condition_expression:
+        kwargs["ConditionExpression"] = condition_expression
 
     try:
-        table.update_item(
-            Key={"user_id": user_profile.user_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ExpressionAttributeNames=expression_attribute_names,
-        )
+        table.update_item(**kwargs)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            logger.error("Error updating user profile: %s", e)
+            raise
+        logger.info("Initializing algorithm maps for user_id=%s", user_profile.user_id)
+        _initialize_algorithm(user_profile)
+        table.update_item(**kwargs)
 
-        feed_update_expression = (
-            "SET #algorithm.#video_focused_feed = :video_focused_feed, "
-            "#algorithm.#video_audio_feed = :video_audio_feed"
-        )
-        feed_expression_attribute_values = {
-            ":video_focused_feed": sanitized_focused_feed if sanitized_focused_feed else {},
-            ":video_audio_feed": sanitized_audio_feed if sanitized_audio_feed else {},
-        }
-        feed_expression_attribute_names = {
-            "#algorithm": "algorithm",
-            "#video_focused_feed": "VIDEO_FOCUSED_FEED",
-            "#video_audio_feed": "VIDEO_AUDIO_FEED",
-        }
 
-        table.update_item(
-            Key={"user_id": user_profile.user_id},
-            UpdateExpression=feed_update_expression,
-            ExpressionAttributeValues=feed_expression_attribute_values,
-            ExpressionAttributeNames=feed_expression_attribute_names,
-        )
+# ---------------------------------------------------------------------------
+# Write coalescing
+# ---------------------------------------------------------------------------
+
+def enqueue_profile_update(payload):
+    """Queue a validated payload on SQS for the coalescing consumer."""
+    sqs.send_message(QueueUrl=PROFILE_UPDATE_QUEUE_URL, MessageBody=json.dumps(payload))
+
 
+def coalesce_profile_updates(payloads):
+    """Merge queued payloads into {user_id: (merged UserProfile, [UserProfile, ...])}, in arrival order."""
+    coalesced = {}
+    for payload in payloads:
+        user_profile = UserProfile.from_payload(payload)
+        if user_profile.user_id in coalesced:
+            merged, originals = coalesced[user_profile.user_id]
+            coalesced[user_profile.user_id] = (merged.merged_with(user_profile), originals + [user_profile])
+        else:
+            coalesced[user_profile.user_id] = (user_profile, [user_profile])
+    return coalesced
+
+
+def flush_profile_updates(payloads):
+    """
+    Apply queued payloads with one write per user_id. If merging pushes a delta past
+    MAX_DELTA_HASHTAGS, that user's updates are written one by one instead.
+    Returns the user_ids whose write failed.
+    """
+    failed_user_ids = set()
+    coalesced = coalesce_profile_updates(payloads)
+    for user_id, (merged, originals) in coalesced.items():
+        try:
+            if merged.delta_hashtag_count() > MAX_DELTA_HASHTAGS:
+                for user_profile in originals:
+                    update_user_profile(user_profile)
+            else:
+                update_user_profile(merged)
+        except Exception:
+            logger.exception("Coalesced profile write failed for user_id=%s", user_id)
+            failed_user_ids.add(user_id)
+
+    logger.info("Flushed %d queued profile updates as %d writes", len(payloads), len(coalesced))
+    return failed_user_ids
+
+
+def _parse_queued_payload(record):
+    """The record's payload if it is a valid profile update, else None (logged)."""
+    try:
+        payload = json.loads(record['body'])
+        UserProfile.from_payload(payload).validate()
+        return payload
     except Exception as e:
-        logger.error("Error updating user profile: %s", e)
-        raise
+        logger.error("Invalid queued profile update %s: %s", record.get('messageId'), e)
+        return None
+
+
+def _handle_queue_batch(event):
+    """
+    SQS consumer: coalesce the batch and report failed messages for redelivery.
+    Each message is parsed and validated on its own, so a malformed one fails alone
+    (and ends up in the queue's DLQ) instead of blocking the rest of the batch.
+    """
+    failures = []
+    parsed = []
+    for record in event['Records']:
+        payload = _parse_queued_payload(record)
+        if payload is None:
+            failures.append(record['messageId'])
+        else:
+            parsed.append((record, payload))
+
+    failed_user_ids = flush_profile_updates([payload for _, payload in parsed])
+    failures.extend(record['messageId'] for record, payload in parsed if payload['user_id'] in failed_user_ids)
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
+def _is_queue_event(event):
+    records = event.get('Records') or []
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
 
 
 def lambda_handler(event, context):
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
+
+    if _is_queue_event(event):
+        return _handle_queue_batch(event)
+
     try:
         from attestation_verifier import verify_request, enforce_user_binding
         attestation_result = verify_request(event)
@@ -194,20 +452,25 @@ def lambda_handler(event, context):
         payload = json.loads(raw_body)
 
         # IDOR: device_id ↔ user_id binding
-        enforce_user_binding(attestation_result.get('device_id'), payload.get('user_id'))
+        enforce_user_binding(attestation_result.get('device_id'), payload.get('user_id'), attestation_result)
 
         user_profile = UserProfile.from_payload(payload)
         user_profile.validate()
 
-        ensure_user_exists(user_profile)
-        update_user_profile(user_profile)
+        if PROFILE_WRITE_MODE == 'coalesce' and sqs:
+            enqueue_profile_update(payload)
+            status_code = 202
+            response_body = {'message': 'User profile update queued'}
+        else:
+            update_user_profile(user_profile)
+            status_code = 200
+            response_body = {'message': 'User profile updated successfully'}
 
-        response_body = {'message': 'User profile updated successfully'}
         if attestation_result.get('session_token'):
             response_body['session_token'] = attestation_result['session_token']
 
         return {
-            'statusCode': 200,
+            'statusCode': status_code,
             'body': json.dumps(response_body)
         }
     except PermissionError as pe:
@@ -226,3 +489,12 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': json.dumps({'error': 'Internal server error'})
         }
+
+
+def _prime_profile_table():
+    table.get_item(Key={'user_id': WARMUP_PROBE_KEY}, ProjectionExpression='user_id')
+
+
+FUNCTION_NAME = 'up-update-user-profiles'
+WARMUP_PRIMERS = (prime_attestation, _prime_profile_table)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
@@ -8,12 +8,16 @@ credentials for a JWT proactively — before making any business API calls.
 
 import json
 import logging
+from warmup import handle_warmup, is_warmup_event, prime_attestation, prime_during_init
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
 def lambda_handler(event, context):
+    if is_warmup_event(event):
+        return handle_warmup(FUNCTION_NAME, WARMUP_PRIMERS)
+
     try:
         from attestation_verifier import verify_request
         result = verify_request(event)
@@ -36,3 +40,8 @@ def lambda_handler(event, context):
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': 'Verification failed'}),
         }
+
+
+FUNCTION_NAME = 'up-verify-attestation'
+WARMUP_PRIMERS = (prime_attestation,)
+prime_during_init(FUNCTION_NAME, WARMUP_PRIMERS)
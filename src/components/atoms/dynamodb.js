@@ -68,6 +68,40 @@ export const createVideoMetadata = async (metadata) => {
   }
 };
 
+/**
+ * Validate and reserve the video's metadata and get the presigned POST for its
+ * upload in one attested call. Returns { url, fields, key, maxSizeBytes, videoId }.
+ * Throws on failure so callers can retry with backoff(); retries must pass the same
+ * idempotencyKey so the server hands back the session it already reserved.
+ */
+export const createUploadSession = async (metadata, fileName, contentType, idempotencyKey) => {
+  const userId = await getUUIDCache();
+  const headers = await getRequestHeaders();
+  const response = await fetch(CREATE_VIDEO_METADATA_URL, {
+    method: 'POST',
+    headers,
+    body: JSON.stringify({
+      ...metadata.toJSON(),
+      action: 'createUploadSession',
+      fileName,
+      contentType,
+      idempotencyKey,
+      user_id: userId,
+    }),
+  });
+
+  // Handle attestation state (clear stale keys on 403) BEFORE handleResponse throws
+  if (response.status === 403) {
+    await handleAttestationResponse(response, null);
+  }
+
+  await handleResponse(response, "Failed to create upload session");
+
+  const data = await response.json();
+  await handleAttestationResponse(response, data);
+  return data;
+};
+
 export const fetchFeed = async (payload) => {
   try {
     const headers = await getRequestHeaders();
@@ -22,9 +22,12 @@ import {
 
 const windowWidth = Dimensions.get('window').width;
 
+// Deduplicated uploads play an existing rendition, so compressedKey wins over videoId
+const videoSourceUrl = (item) => `${COMPRESSED_S3_BUCKET}/${item.compressedKey || item.videoId}`;
+
 // Extracted component so each FlatList item can use the useVideoPlayer hook
 const VideoItem = React.memo(({ item, videoStyle, index, isMuted, shouldPlay, onPlayerReady, onPlayToEnd, onError }) => {
-  const source = `${COMPRESSED_S3_BUCKET}/${item.videoId}`;
+  const source = videoSourceUrl(item);
 
   const player = useVideoPlayer(source, (p) => {
     p.loop = false;
@@ -66,11 +69,11 @@ const VideoItem = React.memo(({ item, videoStyle, index, isMuted, shouldPlay, on
     if (!player) return;
     const sub = player.addListener('statusChange', ({ status, error: err }) => {
       if (status === 'error' && err) {
-        onError?.(item.videoId, err.message);
+        onError?.(item.videoId, err.message, source);
       }
     });
     return () => sub.remove();
-  }, [player, item.videoId, onError]);
+  }, [player, item.videoId, source, onError]);
 
   return (
     <VideoView
@@ -121,8 +124,7 @@ const VideoSlide = () => {
     videoSlideVideoRefs.current[index] = player;
   }, [videoSlideVideoRefs]);
 
-  const handleVideoError = useCallback((videoId, error) => {
-    const url = `${COMPRESSED_S3_BUCKET}/${videoId}`;
+  const handleVideoError = useCallback((videoId, error, url) => {
     console.error(`Video playback error for ${videoId}: ${error}\nURL: ${url}`);
 
     if (typeof error === 'string') {
@@ -16,11 +16,11 @@ import * as ImagePicker from 'expo-image-picker';
 import { useVideoPlayer, VideoView } from 'expo-video';
 import Modal from 'react-native-modal';
 import {VideoMetadata} from '../atoms/VideoMetadata';
-import {createVideoMetadata} from '../atoms/dynamodb';
-import {getPresignedPost, uploadVideo} from '../atoms/s3';
+import {createUploadSession} from '../atoms/dynamodb';
+import {uploadVideo} from '../atoms/s3';
 import {fetchGeoLocation} from '../atoms/location';
 import {MAX_DESCRIPTION_CHARACTERS} from "../atoms/constants";
-import {backoff} from "../atoms/utilities";
+import {backoff, generateUUID} from "../atoms/utilities";
 
 const SCREEN_HEIGHT = Dimensions.get('window').height;
 const SCREEN_WIDTH = Dimensions.get('window').width;
@@ -142,22 +142,11 @@ const UploadContentPage = () => {
     try {
       const fileName = media.split('/').pop();
       const contentType = 'video/mp4';
-      const presignedPost = await backoff(getPresignedPost, 2, 1000, 10000)(fileName, contentType);
 
-      // Upload video to S3 via pre-signed POST (enforces server-side size limit)
-      const isUploaded = await backoff(
-          () => uploadVideo({uri: media, type: contentType}, presignedPost),
-          3, 1000, 30000
-      )();
-      if (!isUploaded) {
-        throw new Error('Video upload failed.');
-      }
-      setProgress(0.8); // After S3 upload, progress to 80%
-
-      // Generate metadata and save to DynamoDB — key comes from the presigned POST response
+      // One call validates and reserves the metadata and returns the presigned POST —
+      // the server picks the videoId, which is also the upload key
       const geoLocation = await fetchGeoLocation();
       const metadata = new VideoMetadata({
-        videoId: presignedPost.key,
         description,
         hashtags,
         muteByDefault,
@@ -166,8 +155,21 @@ const UploadContentPage = () => {
         region: geoLocation.region,
         country: geoLocation.country
       });
+      // One key per submission, so backoff retries reuse the same reserved session
+      const idempotencyKey = generateUUID();
+      const uploadSession = await backoff(createUploadSession, 2, 1000, 15000)(
+          metadata, fileName, contentType, idempotencyKey
+      );
+      setProgress(0.3);
 
-      await backoff(createVideoMetadata, 2, 1000, 15000)(metadata);
+      // Upload video to S3 via pre-signed POST (enforces server-side size limit)
+      const isUploaded = await backoff(
+          () => uploadVideo({uri: media, type: contentType}, uploadSession),
+          3, 1000, 30000
+      )();
+      if (!isUploaded) {
+        throw new Error('Video upload failed.');
+      }
       setProgress(1.0); // Completion
       await new Promise((r) => setTimeout(r, 1000));
       resetState();